@@ -0,0 +1,361 @@
+"""
+Cache of build products shared between builds, decks, users & CI jobs:
+compiled pieces of decks (see slide_cache), preprocessed & converted plots
+(see plot_processing), and precompiled preambles (see preamble_format).
+
+Everything is stored under a hash of what went into it, including the version
+of the program that made it, so the cache can live on a shared filesystem
+(set BEAMER_PLOT_SLIDES_CACHE, or --cacheDir). Entries are written under a
+temporary name & renamed into place, so nobody ever sees a partial file, and
+a lock file stops entries being removed while they are being read.
+Directories & entries are made group-writable (directories also setgid), so
+everyone in the cache directory's group can add, use & evict entries.
+
+The cache is kept under a maximum size (BEAMER_PLOT_SLIDES_CACHE_SIZE in MB,
+or --cacheSize) by removing the least recently used entries. Hits & misses
+are counted for each kind of entry, and added to stats.json in the cache.
+"""
+
+
+import contextlib
+import functools
+import hashlib
+import json
+import logging
+import os
+import shutil
+import subprocess
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # no locking, e.g. on Windows
+    fcntl = None
+
+
+log = logging.getLogger(__name__)
+
+
+DIR_ENV_VAR = "BEAMER_PLOT_SLIDES_CACHE"
+SIZE_ENV_VAR = "BEAMER_PLOT_SLIDES_CACHE_SIZE"
+
+DEFAULT_MAX_SIZE_MB = 2048
+
+# Subdirectories for each kind of entry. Only these are ever evicted from.
+KINDS = ["pieces", "plots", "formats"]
+
+LOCK_NAME = ".lock"
+STATS_NAME = "stats.json"
+
+# Permissions for the cache's directories & files, so it can be shared by a group
+DIR_MODE = 0o2775
+FILE_MODE = 0o664
+
+# Entries used more recently than this many seconds ago are never evicted,
+# since another build may be about to use them
+MIN_EVICTION_AGE = 600
+
+# When evicting, go down to this fraction of the maximum size,
+# so we don't need to evict again straight away
+EVICTION_TARGET = 0.8
+
+
+def get_default_cache_dir():
+    """Get the cache directory, from BEAMER_PLOT_SLIDES_CACHE if set,
+    otherwise in the user's cache directory"""
+    if os.environ.get(DIR_ENV_VAR):
+        return os.environ[DIR_ENV_VAR]
+    cache_home = os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache"))
+    return os.path.join(cache_home, "beamer-plot-slides")
+
+
+def get_default_max_size():
+    """Get the maximum cache size in MB, from BEAMER_PLOT_SLIDES_CACHE_SIZE if set"""
+    try:
+        return float(os.environ.get(SIZE_ENV_VAR, DEFAULT_MAX_SIZE_MB))
+    except ValueError:
+        log.warning("Ignoring invalid %s=%s", SIZE_ENV_VAR, os.environ[SIZE_ENV_VAR])
+        return DEFAULT_MAX_SIZE_MB
+
+
+@functools.lru_cache(maxsize=None)
+def get_tool_version(cmd):
+    """Get the first line of `cmd --version`, for putting in cache keys.
+    Returns None if it can't be run."""
+    try:
+        output = subprocess.check_output([cmd, "--version"], stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    lines = output.decode(errors="replace").splitlines()
+    return lines[0].strip() if lines else None
+
+
+def get_tool_tag(cmd):
+    """Get a short tag for the version of a program, for cache filenames"""
+    return hashlib.sha1(str(get_tool_version(cmd)).encode()).hexdigest()[:8]
+
+
+def _set_mode(path, mode):
+    """Set a file's permissions, if we own it. Needed as well as
+    giving the mode on creation, since the umask may remove group write."""
+    try:
+        os.chmod(path, mode)
+    except OSError:
+        pass
+
+
+def make_shared_dir(dirname):
+    """Make a directory (& its parents) that the group can write to"""
+    if os.path.isdir(dirname):
+        return
+    parent = os.path.dirname(dirname)
+    if parent and parent != dirname:
+        make_shared_dir(parent)
+    try:
+        os.mkdir(dirname, DIR_MODE)
+    except FileExistsError:
+        return
+    _set_mode(dirname, DIR_MODE)
+
+
+class ArtifactCache(object):
+    """An on-disk cache, see the module description
+
+    Parameters
+    ----------
+    cache_dir : str, optional
+        Cache directory. Default is from get_default_cache_dir.
+    max_size : float, optional
+        Maximum size in MB. Default is from get_default_max_size.
+    """
+
+    def __init__(self, cache_dir=None, max_size=None):
+        self.cache_dir = os.path.abspath(cache_dir or get_default_cache_dir())
+        self.max_size = max_size if max_size is not None else get_default_max_size()
+        self.stats = {}
+        # estimate of the total size, so we don't have to look at every entry
+        # each time one is added. None until first calculated.
+        self._size = None
+        # stats are updated from several threads at once
+        self._stats_lock = threading.Lock()
+
+    def get_dir(self, kind):
+        """Get the directory for a kind of entry, making it if necessary"""
+        dirname = os.path.join(self.cache_dir, kind)
+        make_shared_dir(dirname)
+        return dirname
+
+    @contextlib.contextmanager
+    def locked(self, exclusive=False):
+        """Hold the cache lock. Shared for reading & adding entries,
+        exclusive for removing them.
+
+        The lock file is only opened for reading (flock doesn't need more),
+        so anyone who can read it can lock it."""
+        make_shared_dir(self.cache_dir)
+        lock_filename = os.path.join(self.cache_dir, LOCK_NAME)
+        if not os.path.isfile(lock_filename):
+            try:
+                os.close(os.open(lock_filename, os.O_WRONLY | os.O_CREAT | os.O_EXCL, FILE_MODE))
+                _set_mode(lock_filename, FILE_MODE)
+            except FileExistsError:
+                pass
+        with open(lock_filename, "r") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _touch(filename):
+        """Mark an entry as recently used. Only its owner (or root) can
+        do this, so entries used by others may be evicted a little early."""
+        try:
+            os.utime(filename)
+        except OSError:
+            pass
+
+    def _count(self, filename, stat):
+        """Add one to a statistic for the kind of entry a file is"""
+        kind = os.path.basename(os.path.dirname(filename))
+        with self._stats_lock:
+            kind_stats = self.stats.setdefault(kind, {'hits': 0, 'misses': 0, 'stores': 0})
+            kind_stats[stat] += 1
+
+    def lookup(self, filename):
+        """Check if an entry exists, counting it as a hit or miss,
+        and marking it as recently used.
+
+        Parameters
+        ----------
+        filename : str
+            Path of entry in the cache
+
+        Returns
+        -------
+        bool
+        """
+        with self.locked():
+            found = os.path.isfile(filename)
+            if found:
+                self._touch(filename)
+        self._count(filename, 'hits' if found else 'misses')
+        return found
+
+    def fetch(self, filename, dest_filename):
+        """Copy an entry out of the cache, if it exists
+
+        Parameters
+        ----------
+        filename : str
+            Path of entry in the cache
+        dest_filename : str
+            Where to copy it to
+
+        Returns
+        -------
+        bool
+            Whether it was in the cache
+        """
+        tmp_filename = "%s.%d.tmp" % (dest_filename, os.getpid())
+        with self.locked():
+            try:
+                shutil.copyfile(filename, tmp_filename)
+                found = True
+            except OSError:
+                found = False
+                if os.path.isfile(tmp_filename):
+                    os.remove(tmp_filename)
+            if found:
+                self._touch(filename)
+        if found:
+            os.replace(tmp_filename, dest_filename)
+        self._count(filename, 'hits' if found else 'misses')
+        return found
+
+    def store(self, src_filename, filename, copy=False):
+        """Put a file into the cache, replacing any existing entry
+
+        Parameters
+        ----------
+        src_filename : str
+            File to add. Should be on the same filesystem as the cache
+            (e.g. a temporary file in the cache) unless copy is True.
+        filename : str
+            Path of entry in the cache
+        copy : bool, optional
+            Copy src_filename, rather than moving it
+
+        Raises
+        ------
+        OSError
+            If it can't be stored, e.g. the cache isn't writable
+        """
+        tmp_filename = None
+        try:
+            if copy:
+                tmp_filename = "%s.%d.tmp" % (filename, os.getpid())
+                shutil.copyfile(src_filename, tmp_filename)
+                src_filename = tmp_filename
+            size = os.path.getsize(src_filename)
+            _set_mode(src_filename, FILE_MODE)
+            with self.locked():
+                os.replace(src_filename, filename)
+        except OSError:
+            if tmp_filename is not None and os.path.isfile(tmp_filename):
+                os.remove(tmp_filename)
+            raise
+        self._count(filename, 'stores')
+        if self._size is not None:
+            self._size += size
+        if self._size is None or self._size > self.max_size * 1024 * 1024:
+            self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries until the cache is under its maximum size"""
+        with self.locked(exclusive=True):
+            entries = []
+            for kind in KINDS:
+                dirname = os.path.join(self.cache_dir, kind)
+                if not os.path.isdir(dirname):
+                    continue
+                for entry in os.scandir(dirname):
+                    if entry.is_file():
+                        st = entry.stat()
+                        entries.append((st.st_mtime, st.st_size, entry.path))
+            total = sum(e[1] for e in entries)
+            max_bytes = self.max_size * 1024 * 1024
+            if total > max_bytes:
+                n_removed = 0
+                now = time.time()
+                for mtime, size, filename in sorted(entries):
+                    if total <= EVICTION_TARGET * max_bytes or now - mtime < MIN_EVICTION_AGE:
+                        break
+                    try:
+                        os.remove(filename)
+                    except OSError:
+                        continue
+                    total -= size
+                    n_removed += 1
+                log.info("Removed %d least recently used entries from %s, now %.0f MB",
+                         n_removed, self.cache_dir, total / (1024. * 1024.))
+            self._size = total
+
+    def save_stats(self):
+        """Add the hits & misses since the last call to the totals in stats.json,
+        and log them
+
+        Returns
+        -------
+        dict
+            Hits, misses & stores for each kind of entry since the last call
+        """
+        with self._stats_lock:
+            stats, self.stats = self.stats, {}
+        if not stats:
+            return stats
+        log.info("Cache %s: %s", self.cache_dir,
+                 ", ".join("%s %d hits, %d misses" % (kind, s['hits'], s['misses'])
+                           for kind, s in sorted(stats.items())))
+        stats_filename = os.path.join(self.cache_dir, STATS_NAME)
+        try:
+            with self.locked(exclusive=True):
+                totals = {}
+                if os.path.isfile(stats_filename):
+                    with open(stats_filename) as f:
+                        totals = json.load(f)
+                for kind, kind_stats in stats.items():
+                    kind_totals = totals.setdefault(kind, {})
+                    for key, value in kind_stats.items():
+                        kind_totals[key] = kind_totals.get(key, 0) + value
+                tmp_filename = "%s.%d.tmp" % (stats_filename, os.getpid())
+                with open(tmp_filename, "w") as f:
+                    json.dump(totals, f, indent=2)
+                _set_mode(tmp_filename, FILE_MODE)
+                os.replace(tmp_filename, stats_filename)
+        except (OSError, ValueError) as err:
+            log.warning("Couldn't save cache statistics to %s: %s", stats_filename, err)
+        return stats
+
+
+_cache = None
+
+
+def configure(cache_dir=None, max_size=None):
+    """Set the cache used by get_cache. Defaults are as for ArtifactCache."""
+    global _cache
+    cache = ArtifactCache(cache_dir, max_size)
+    if _cache is None or (_cache.cache_dir, _cache.max_size) != (cache.cache_dir, cache.max_size):
+        _cache = cache
+
+
+def get_cache():
+    """Get the cache for this process, see configure"""
+    if _cache is None:
+        configure()
+    return _cache
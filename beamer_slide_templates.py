@@ -5,6 +5,8 @@ Robin Aggleton 2015
 """
 
 
+import functools
+import math
 import re
 
 only_title_slide = \
@@ -327,6 +329,213 @@ r"""
 """ % tuple([ten_plot_width]*5)
 
 
+# For generated grid layouts, everything is relative to \textwidth:
+# total width for all the columns of plots
+grid_total_width = 0.95
+# height available for plots, with 16:9 aspect ratio & room for the frame title
+grid_total_height = 0.45
+# height taken up by the title above each plot
+grid_plot_title_height = 0.03
+# default plot width/height
+default_plot_aspect = 4. / 3.
+
+
+def grid_layout(num_plots, aspect=default_plot_aspect):
+    """Work out the grid that makes the plots as big as possible
+
+    Parameters
+    ----------
+    num_plots : int
+        Number of plots
+    aspect : float, optional
+        Width/height of each plot
+
+    Returns
+    -------
+    int, int, float
+        Number of rows, number of columns, and width of each plot as a
+        fraction of \\textwidth
+    """
+    best = None
+    for num_cols in range(1, num_plots + 1):
+        num_rows = int(math.ceil(num_plots / float(num_cols)))
+        # plots are limited by either the width or height available
+        width = min(grid_total_width / num_cols,
+                    (grid_total_height / num_rows - grid_plot_title_height) * aspect)
+        if best is None or width > best[2]:
+            best = (num_rows, num_cols, width)
+    num_rows, num_cols, width = best
+    return num_rows, num_cols, round(width, 3)
+
+
+# Number of rows & columns, and width of each plot as a fraction of \textwidth,
+# for each hand-written template, keyed by the number of plots it holds
+fixed_layouts = {
+    1: (1, 1, one_plot_width),
+    2: (1, 2, two_plot_width),
+    3: (1, 3, three_plot_width),
+    4: (2, 2, four_plot_width),
+    6: (2, 3, six_plot_width),
+    8: (2, 4, eight_plot_width),
+    10: (2, 5, ten_plot_width),
+}
+
+
+def plot_layout(num_plots, aspect=default_plot_aspect):
+    """Get the layout of the plots for a slide with num_plots plots,
+    matching the template tex_files.choose_slide_template picks.
+    Plots go along the top row first.
+
+    Parameters
+    ----------
+    num_plots : int
+        Number of plots
+    aspect : float, optional
+        Width/height of each plot, for generated grid layouts
+
+    Returns
+    -------
+    int, int, float
+        Number of rows, number of columns, and width of each plot as a
+        fraction of \\textwidth
+    """
+    for n in sorted(fixed_layouts):
+        if num_plots <= n:
+            return fixed_layouts[n]
+    return grid_layout(num_plots, aspect)
+
+
+@functools.lru_cache(maxsize=None)
+def make_grid_slide_template(num_plots, aspect=default_plot_aspect):
+    """Generate a slide template with the plots in a grid, for any number of plots.
+
+    The plots are arranged in columns, with plots 1, 2, ... along the top row,
+    like the hand-written templates. Templates are cached, so it's cheap to call
+    this for every slide.
+
+    Parameters
+    ----------
+    num_plots : int
+        Number of plots
+    aspect : float, optional
+        Width/height of each plot
+
+    Returns
+    -------
+    str
+        Slide template
+    """
+    num_rows, num_cols, width = grid_layout(num_plots, aspect)
+    columns = []
+    for col in range(num_cols):
+        plots = []
+        for plot_num in range(col + 1, num_plots + 1, num_cols):
+            plots.append("@PLOT%dTITLE\n\\\\\n\\includegraphics[width=\\textwidth]{@PLOT%d}\n"
+                         % (plot_num, plot_num))
+        columns.append("\\begin{column}{%g\\textwidth}\n\\begin{center}\n" % width
+                       + "\\\\\n".join(plots)
+                       + "\\end{center}\n\\end{column}\n")
+    return (
+        "\n\\section{@SLIDE_SECTION}\n"
+        "\\begin{frame}{@SLIDE_TITLE}\n"
+        "@TOPTEXT\n"
+        "\\begin{columns}\n"
+        + "\n".join(columns)
+        + "\\end{columns}\n"
+        "@BOTTOMTEXT\n"
+        "\\end{frame}\n"
+    )
+
+
+# Matches the placeholders in the templates
+PLACEHOLDER_RE = re.compile(r"@(SLIDE_TITLE|SLIDE_SECTION|TOPTEXT|BOTTOMTEXT|PLOT(\d+)TITLE|PLOT(\d+))")
+
+# Marks where a field goes in a specialised template
+FIELD_MARKER = "\x00%s\x00"
+FIELD_MARKER_RE = re.compile("\x00(\\w+)\x00")
+
+# Compiled templates, see compile_template
+_compiled_templates = {}
+
+
+def _specialise_template(slide_template, num_plots, empty_fields):
+    """Fill in the parts of a template that don't depend on the slide contents,
+    leaving markers where each field should go.
+
+    Unused plots are removed, and the line breaks tidied up around them and
+    around empty fields.
+    """
+    def get_field(match):
+        field = match.group(1)
+        plot_num = match.group(2) or match.group(3)
+        if plot_num and int(plot_num) > num_plots:
+            return ""
+        if field in empty_fields:
+            return ""
+        return FIELD_MARKER % field
+
+    # remove unused figures to avoid "missing .tex file" error
+    slide = re.sub(r"\\includegraphics\[[^\]]*\]{@PLOT(\d+)}",
+                   lambda m: "" if int(m.group(1)) > num_plots else m.group(0),
+                   slide_template)
+    slide = PLACEHOLDER_RE.sub(get_field, slide)
+    slide = re.sub(r"\\\\\n\n", "", slide)  # remove useless line breaks
+    slide = slide.replace("\n\n\\\\", "\\\\")
+    slide = re.sub(r"}\\\\\n", "}\n", slide)
+    return slide
+
+
+def compile_template(slide_template, num_plots, empty_fields=frozenset()):
+    """Turn a slide template into a list of alternating literal text & field names,
+    so that slides can be rendered in one pass with render_slide.
+
+    The result is cached, so this is cheap to call for every slide.
+
+    Parameters
+    ----------
+    slide_template : str
+        Slide template
+    num_plots : int
+        Number of plots to go in the template
+    empty_fields : frozenset[str], optional
+        Fields that will be empty, e.g. PLOT1TITLE,
+        since these affect how the line breaks get tidied up
+
+    Returns
+    -------
+    list[str]
+        Literal text at even indices, field names at odd indices
+    """
+    key = (slide_template, num_plots, empty_fields)
+    compiled = _compiled_templates.get(key)
+    if compiled is None:
+        specialised = _specialise_template(slide_template, num_plots, empty_fields)
+        compiled = FIELD_MARKER_RE.split(specialised)
+        _compiled_templates[key] = compiled
+    return compiled
+
+
+def render_slide(compiled_template, fields):
+    """Render a slide from a compiled template
+
+    Parameters
+    ----------
+    compiled_template : list[str]
+        Compiled template from compile_template
+    fields : dict
+        Contents of each field, e.g. SLIDE_TITLE, PLOT1, PLOT1TITLE
+
+    Returns
+    -------
+    str
+        Slide contents
+    """
+    parts = compiled_template[:]
+    for i in range(1, len(parts), 2):
+        parts[i] = fields[parts[i]]
+    return "".join(parts)
+
+
 def make_slide(slide_template, slide_section, slide_title, plots, top_text=None, bottom_text=None):
     """
     Create slide contents.
@@ -350,23 +559,14 @@ def make_slide(slide_template, slide_section, slide_title, plots, top_text=None,
     str
         Slide contents
     """
-
-    slide = slide_template.replace("@SLIDE_TITLE", slide_title)
-    slide = slide.replace("@SLIDE_SECTION", slide_section)
-    top_text = top_text or ""
-    slide = slide.replace("@TOPTEXT", top_text)
-    bottom_text = bottom_text or ""
-    slide = slide.replace("@BOTTOMTEXT", bottom_text)
-    # Go backwards since we want to replace "PLOT10" before "PLOT1"
-    for i in range(len(plots), 0, -1):
-        plot_filename, plot_title = plots[i-1]
-        slide = slide.replace("@PLOT"+str(i)+"TITLE", plot_title)
-        slide = slide.replace("@PLOT"+str(i), plot_filename)
-
-    # cleanup incase we have leftover unused figures
-    slide = re.sub(r"@PLOT\dTITLE", "", slide)
-    slide = re.sub(r"\\includegraphics\[.*\]{@PLOT\d}", "", slide)  # to avoid "missing .tex file" error
-    slide = re.sub(r"\\\\\n\n", "", slide)  # remove useless line breaks
-    slide = slide.replace("\n\n\\\\", "\\\\")
-    slide = re.sub(r"}\\\\\n", "}\n", slide)
-    return slide
+    fields = {
+        "SLIDE_TITLE": slide_title,
+        "SLIDE_SECTION": slide_section,
+        "TOPTEXT": top_text or "",
+        "BOTTOMTEXT": bottom_text or "",
+    }
+    for i, plot in enumerate(plots, 1):
+        fields["PLOT%d" % i] = plot[0]
+        fields["PLOT%dTITLE" % i] = plot[1] if len(plot) > 1 else ""
+    empty_fields = frozenset(k for k, v in fields.items() if not v)
+    return render_slide(compile_template(slide_template, len(plots), empty_fields), fields)
@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+
+"""
+Benchmark for making whole decks: synthetic decks of increasing size, with
+slides cycling through every plot-count layout, using dummy PDF plots.
+
+For each deck size, measures the time & peak Python memory (with tracemalloc)
+to write the TeX files, and optionally the time to compile them.
+Results are saved as JSON, and can be compared to a previous run:
+
+    ./benchmarks/bench_decks.py --output before.json
+    # ... change something ...
+    ./benchmarks/bench_decks.py --output after.json --compare before.json
+"""
+
+
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import latex_compile
+import tex_files
+
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+DEFAULT_SIZES = [10, 100, 1000, 10000]
+
+# Every layout: 1-10 plots use the fixed templates, more use generated grids
+PLOT_COUNTS = list(range(0, 11)) + [12, 16]
+
+# Number of distinct dummy plot files
+NUM_PLOT_FILES = 20
+
+# Metrics where bigger is worse, used for comparisons
+COMPARED_METRICS = ["tex_time", "tex_peak_memory_mb", "compile_time"]
+
+
+def make_dummy_pdf(filename, label):
+    """Write a small single-page PDF with a line of text on it
+
+    Parameters
+    ----------
+    filename : str
+        Name of PDF file to make
+    label : str
+        Text to put on the page
+    """
+    content = "BT /F1 24 Tf 20 100 Td (%s) Tj ET 20 20 m 380 280 l S" % label
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        "<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 400 300] "
+        "/Contents 4 0 R /Resources << /Font << /F1 5 0 R >> >> >>",
+        "<< /Length %d >>\nstream\n%s\nendstream" % (len(content), content),
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    out = "%PDF-1.4\n"
+    offsets = []
+    for i, obj in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += "%d 0 obj\n%s\nendobj\n" % (i, obj)
+    xref = len(out)
+    out += "xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += "".join("%010d 00000 n \n" % offset for offset in offsets)
+    out += "trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    with open(filename, "w") as f:
+        f.write(out)
+
+
+def make_plots(plot_dir):
+    """Make the dummy plots
+
+    Returns
+    -------
+    list[str]
+        Plot filenames
+    """
+    plots = []
+    for i in range(NUM_PLOT_FILES):
+        filename = os.path.join(plot_dir, "plot_%d.pdf" % i)
+        make_dummy_pdf(filename, "Plot %d" % i)
+        plots.append(filename)
+    return plots
+
+
+def iter_synthetic_slides(num_slides, plot_filenames):
+    """Generate slides cycling through all the layouts in PLOT_COUNTS
+
+    Parameters
+    ----------
+    num_slides : int
+        Number of slides
+    plot_filenames : list[str]
+        Plots to use, in turn
+
+    Yields
+    ------
+    dict
+        Contents of each slide
+    """
+    plot_index = 0
+    for i in range(num_slides):
+        num_plots = PLOT_COUNTS[i % len(PLOT_COUNTS)]
+        plots = []
+        for j in range(num_plots):
+            plots.append([plot_filenames[plot_index % len(plot_filenames)], "Plot %d" % (j + 1)])
+            plot_index += 1
+        slide = {'title': "Slide %d with %d plots" % (i + 1, num_plots), 'plots': plots}
+        if i % 3 == 0:
+            slide['toptext'] = "Some text about $p_{T}$ \\& $\\eta$"
+        if i % 5 == 0:
+            slide['bottomtext'] = "\\textbf{Conclusion}: looks fine"
+        yield slide
+
+
+def bench_tex(num_slides, plot_filenames, out_dir, template_filename):
+    """Time writing the TeX files for a synthetic deck
+
+    Returns
+    -------
+    dict
+        Time in seconds, slides per second, and peak memory in MB
+    """
+    front_dict = {'title': "Benchmark", 'subtitle': "%d slides" % num_slides, 'author': "Nobody"}
+    out_stem = os.path.join(out_dir, "deck_%d" % num_slides)
+    tracemalloc.start()
+    start = time.time()
+    tex_files.write_tex_files(template_filename, front_dict,
+                              iter_synthetic_slides(num_slides, plot_filenames),
+                              out_stem, do_toc=True)
+    tex_time = time.time() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'tex_time': tex_time,
+        'tex_slides_per_sec': num_slides / tex_time if tex_time > 0 else None,
+        'tex_peak_memory_mb': peak / (1024. * 1024.),
+    }, out_stem + ".tex"
+
+
+def bench_compile(tex_filename):
+    """Time compiling the TeX files, with the same passes as a normal build
+
+    Returns
+    -------
+    dict
+        Total time, and time for each pass, in seconds
+    """
+    start = time.time()
+    pass_times = latex_compile.compile_pdf(tex_filename, outdir=os.path.dirname(tex_filename),
+                                           num_compilations=latex_compile.MAX_COMPILATIONS, nonstop=True)
+    return {'compile_time': time.time() - start, 'compile_passes': pass_times}
+
+
+def get_git_commit():
+    """Get the current commit of the repository, if available"""
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_results(results, previous, threshold):
+    """Print the change in each metric compared to a previous run
+
+    Parameters
+    ----------
+    results, previous : dict
+        Output from this script
+    threshold : float
+        Fractional increase above which a change counts as a regression
+
+    Returns
+    -------
+    int
+        Number of regressions
+    """
+    previous_by_size = {r['num_slides']: r for r in previous['results']}
+    print()
+    print("Compared to %s (commit %s):" % (previous.get('timestamp'), previous.get('commit')))
+    print("%8s %20s %12s %12s %8s" % ("# slides", "metric", "before", "after", "change"))
+    n_regressions = 0
+    for result in results['results']:
+        before = previous_by_size.get(result['num_slides'])
+        if before is None:
+            continue
+        for metric in COMPARED_METRICS:
+            if result.get(metric) is None or not before.get(metric):
+                continue
+            change = result[metric] / before[metric] - 1
+            flag = ""
+            if change > threshold:
+                flag = "  REGRESSION"
+                n_regressions += 1
+            print("%8d %20s %12.4g %12.4g %+7.0f%%%s"
+                  % (result['num_slides'], metric, before[metric], result[metric], 100 * change, flag))
+    return n_regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", help="Deck sizes (number of slides)", type=int, nargs='+',
+                        default=DEFAULT_SIZES)
+    parser.add_argument("--compile", help="Also compile the decks, up to this many slides",
+                        type=int, default=0, dest="compileMax")
+    parser.add_argument("--template", help="Beamer template",
+                        default=os.path.join(REPO_DIR, "beamer_template.tex"))
+    parser.add_argument("--output", help="Save results to this JSON file")
+    parser.add_argument("--compare", help="Compare to results saved by a previous run")
+    parser.add_argument("--threshold", help="Fractional slowdown counted as a regression",
+                        type=float, default=0.1)
+    parser.add_argument("--keep", help="Keep the generated files, and print where they are",
+                        action='store_true')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(message)s')
+
+    work_dir = tempfile.mkdtemp(prefix="bench_decks_")
+    try:
+        plot_filenames = make_plots(work_dir)
+        results = {
+            'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S"),
+            'commit': get_git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'results': [],
+        }
+        print("%8s %12s %14s %14s %14s" % ("# slides", "TeX [s]", "TeX [slides/s]", "TeX peak [MB]", "compile [s]"))
+        for num_slides in args.sizes:
+            result = {'num_slides': num_slides}
+            tex_result, tex_filename = bench_tex(num_slides, plot_filenames, work_dir, args.template)
+            result.update(tex_result)
+            if num_slides <= args.compileMax:
+                result.update(bench_compile(tex_filename))
+            results['results'].append(result)
+            compile_time = result.get('compile_time')
+            print("%8d %12.3f %14.0f %14.1f %14s"
+                  % (num_slides, result['tex_time'], result['tex_slides_per_sec'] or 0,
+                     result['tex_peak_memory_mb'],
+                     "%.1f" % compile_time if compile_time is not None else "-"))
+    finally:
+        if args.keep:
+            print("Files kept in", work_dir)
+        else:
+            shutil.rmtree(work_dir)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        if compare_results(results, previous, args.threshold):
+            sys.exit(1)
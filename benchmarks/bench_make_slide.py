@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+"""
+Microbenchmark for beamer_slide_templates.make_slide: slides rendered per second
+with the compiled single-pass renderer, compared to the original implementation
+of chained str.replace & re.sub calls.
+
+Run:
+
+    ./benchmarks/bench_make_slide.py
+"""
+
+
+import argparse
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import beamer_slide_templates as bst
+
+
+def make_slide_replace(slide_template, slide_section, slide_title, plots, top_text=None, bottom_text=None):
+    """The original make_slide, for comparison"""
+    slide = slide_template.replace("@SLIDE_TITLE", slide_title)
+    slide = slide.replace("@SLIDE_SECTION", slide_section)
+    top_text = top_text or ""
+    slide = slide.replace("@TOPTEXT", top_text)
+    bottom_text = bottom_text or ""
+    slide = slide.replace("@BOTTOMTEXT", bottom_text)
+    # Go backwards since we want to replace "PLOT10" before "PLOT1"
+    for i in range(len(plots), 0, -1):
+        plot_filename, plot_title = plots[i-1]
+        slide = slide.replace("@PLOT"+str(i)+"TITLE", plot_title)
+        slide = slide.replace("@PLOT"+str(i), plot_filename)
+
+    # cleanup incase we have leftover unused figures
+    slide = re.sub(r"@PLOT\dTITLE", "", slide)
+    slide = re.sub(r"\\includegraphics\[.*\]{@PLOT\d}", "", slide)  # to avoid "missing .tex file" error
+    slide = re.sub(r"\\\\\n\n", "", slide)  # remove useless line breaks
+    slide = slide.replace("\n\n\\\\", "\\\\")
+    slide = re.sub(r"}\\\\\n", "}\n", slide)
+    return slide
+
+
+TEMPLATES = {
+    1: bst.one_plot_slide,
+    4: bst.four_plot_slide,
+    10: bst.ten_plot_slide,
+}
+
+
+def bench(func, num_plots, number):
+    """Get the number of slides per second rendered by func"""
+    plots = [["some/long/directory/plot_%d.pdf" % i, "Plot %d title" % i]
+             for i in range(1, num_plots + 1)]
+    template = TEMPLATES[num_plots]
+
+    def render():
+        func(template, "Section", "Slide title", plots, "Top text", "Bottom text")
+
+    best = min(timeit.repeat(render, number=number, repeat=3))
+    return number / best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--number", help="Number of slides to render per timing", type=int, default=20000)
+    args = parser.parse_args()
+
+    print("%8s %15s %15s %8s" % ("# plots", "replace [/s]", "compiled [/s]", "speedup"))
+    for num_plots in sorted(TEMPLATES):
+        old_rate = bench(make_slide_replace, num_plots, args.number)
+        new_rate = bench(bst.make_slide, num_plots, args.number)
+        print("%8d %15.0f %15.0f %8.1f" % (num_plots, old_rate, new_rate, new_rate / old_rate))
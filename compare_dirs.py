@@ -11,15 +11,18 @@ Usage:
 
 import os
 import argparse
-import make_slides as ms
 import json
-from glob import glob
+import make_slides as ms
+import artifact_cache
+import plot_processing
+import slide_config
 import re
+import sys
 import logging
+from concurrent.futures import ThreadPoolExecutor
 
 
 log = logging.getLogger(__name__)
-logging.basicConfig(level=logging.INFO, format='%(message)s')
 
 
 # These 3 functions stolen form Ned Batchelder
@@ -45,22 +48,197 @@ def sorted_nicely(l):
     return sorted(l, key=alphanum_key)
 
 
-def create_json_contents(args):
-    """Create the JSON dict to be passed to make_slides.py"""
-    json_dict = {
-        'frontpage': {
-            "title": args.title.replace("_", "\_"),
-            "subtitle": "",
-            "author": ""
-        },
-        'slides': []
+def scan_dir(dname, exts, recursive=False):
+    """Find all plot files in a directory
+
+    Parameters
+    ----------
+    dname : str
+        Directory to scan
+    exts : list[str]
+        File extensions to look for, without the dot
+    recursive : bool, optional
+        Look in subdirectories as well
+
+    Returns
+    -------
+    list[str], dict
+        Plot filenames relative to dname,
+        and the mtime of each (sub)directory scanned, relative to dname
+
+    Notes
+    -----
+    Matches like glob(os.path.join(dname, "*." + ext)): extensions are
+    case-sensitive and hidden files are skipped. Hidden & symlinked
+    subdirectories aren't scanned, so a link back up the tree can't loop.
+    """
+    suffixes = tuple("." + ext for ext in exts)
+    filenames = []
+    mtimes = {}
+    to_scan = [""]
+    while to_scan:
+        subdir = to_scan.pop()
+        this_dir = os.path.join(dname, subdir)
+        mtimes[subdir] = os.stat(this_dir).st_mtime
+        for entry in os.scandir(this_dir):
+            if entry.name.startswith("."):
+                continue
+            rel_name = os.path.join(subdir, entry.name)
+            if entry.is_dir():
+                if recursive and not entry.is_symlink():
+                    to_scan.append(rel_name)
+            elif entry.name.endswith(suffixes):
+                filenames.append(rel_name)
+    return sorted(filenames), mtimes
+
+
+def index_is_valid(dname, entry, exts, recursive):
+    """Check if an index entry for a directory is up to date.
+    Any added or removed file changes the mtime of its directory."""
+    if entry.get('exts') != sorted(exts) or entry.get('recursive') != recursive:
+        return False
+    for subdir, mtime in entry['mtimes'].items():
+        try:
+            if os.stat(os.path.join(dname, subdir)).st_mtime != mtime:
+                return False
+        except OSError:
+            return False
+    return True
+
+
+def scan_dirs(dirs, exts, recursive=False, index_filename=None):
+    """Find all plot files in several directories simultaneously
+
+    Parameters
+    ----------
+    dirs : list[str]
+        Directories to scan
+    exts : list[str]
+        File extensions to look for, without the dot
+    recursive : bool, optional
+        Look in subdirectories as well
+    index_filename : str, optional
+        JSON file to store the results in, so directories that haven't
+        changed don't need to be scanned again next time
+
+    Returns
+    -------
+    list[set[str]]
+        Plot filenames in each directory, relative to that directory
+    """
+    index = {}
+    if index_filename and os.path.isfile(index_filename):
+        try:
+            with open(index_filename) as f:
+                index = json.load(f)
+        except (OSError, ValueError) as err:
+            log.warning("Ignoring unreadable index %s: %s", index_filename, err)
+        if not isinstance(index, dict):
+            log.warning("Ignoring index %s, it isn't a JSON object", index_filename)
+            index = {}
+
+    def get_filenames(dname):
+        key = os.path.abspath(dname)
+        entry = index.get(key)
+        if isinstance(entry, dict) and index_is_valid(dname, entry, exts, recursive):
+            log.debug("Using index for %s", dname)
+            return entry['files']
+        log.debug("Scanning %s", dname)
+        filenames, mtimes = scan_dir(dname, exts, recursive)
+        index[key] = {'exts': sorted(exts), 'recursive': recursive,
+                      'mtimes': mtimes, 'files': filenames}
+        return filenames
+
+    with ThreadPoolExecutor(max_workers=len(dirs)) as pool:
+        results = [set(f) for f in pool.map(get_filenames, dirs)]
+
+    if index_filename:
+        # under a temporary name first, so a run that's interrupted or
+        # simultaneous doesn't leave a partial index
+        tmp_filename = "%s.%d.tmp" % (index_filename, os.getpid())
+        with open(tmp_filename, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp_filename, index_filename)
+    return results
+
+
+def plots_are_identical(filenames, pixel_threshold=None, dpi=30):
+    """Check if the same plot from several dirs is identical in all of them
+
+    Parameters
+    ----------
+    filenames : list[str]
+        Plot files to compare
+    pixel_threshold : float, optional
+        If set, plots whose low-resolution renderings differ in less than this
+        fraction of pixels also count as identical
+    dpi : int, optional
+        Resolution of renderings
+
+    Returns
+    -------
+    bool
+    """
+    if not all(os.path.isfile(f) for f in filenames):
+        return False
+    if len(set(plot_processing.file_digest(f) for f in filenames)) == 1:
+        return True
+    if pixel_threshold is None:
+        return False
+    try:
+        renderings = [plot_processing.get_plot_pixels(f, dpi) for f in filenames]
+    except Exception as err:
+        log.warning("Couldn't render %s: %s", filenames, err)
+        return False
+    return all(plot_processing.pixel_difference(renderings[0], r) < pixel_threshold
+               for r in renderings[1:])
+
+
+def find_identical_plots(plotnames, dirs, pixel_threshold=None):
+    """Find which plots are the same in all dirs, checking them simultaneously
+
+    Returns
+    -------
+    set[str]
+        Plot names that are identical
+    """
+    def check(plotname):
+        return plots_are_identical([os.path.join(d, plotname) for d in dirs], pixel_threshold)
+
+    with ThreadPoolExecutor() as pool:
+        identical = pool.map(check, plotnames)
+    return set(p for p, same in zip(plotnames, identical) if same)
+
+
+def make_skipped_slide(skipped, max_listed=90):
+    """Make a slide listing the plots that were skipped for being identical"""
+    names = [slide_config.escape_tex(p) for p in sorted_nicely(skipped)]
+    if len(names) > max_listed:
+        names = names[:max_listed] + ["\\ldots and %d more" % (len(names) - max_listed)]
+    return {
+        "title": "Identical plots",
+        "toptext": "%d plots identical in all directories, not shown:" % len(skipped),
+        "bottomtext": ("\\begin{multicols}{3}\n\\tiny\n"
+                       + "\\\\\n".join(names)
+                       + "\n\\end{multicols}")
     }
 
+
+def create_frontpage(args):
+    """Create the title page contents"""
+    return {
+        "title": slide_config.escape_tex(args.title),
+        "subtitle": "",
+        "author": ""
+    }
+
+
+def generate_slides(args):
+    """Generate the contents of each slide, to be passed to make_slides.build"""
     if not args.plotname:
         # find all common plotnames
-        plotnames = []
-        for dname in args.dir:
-            plotnames.append(set([os.path.basename(f) for f in glob(os.path.join(dname, "*." + args.ext))]))
+        exts = [e for ext in args.ext or ["pdf"] for e in ext.split(",") if e]
+        plotnames = scan_dirs(args.dir, exts, args.recursive, args.index)
         common_plotnames = plotnames[0]
         log.debug(common_plotnames)
         for pnames in plotnames[1:]:
@@ -68,13 +246,22 @@ def create_json_contents(args):
         args.plotname = sorted_nicely(list(common_plotnames))
         log.debug(args.plotname)
 
+    skipped = set()
+    if args.onlyDiff or args.pixelThreshold is not None:
+        skipped = find_identical_plots(args.plotname, args.dir, args.pixelThreshold)
+        log.info("Skipping %d of %d plots that are identical in all dirs", len(skipped), len(args.plotname))
+
     for plot in args.plotname:
-        this_dict = {"title": plot.replace("_", "\_")}
-        plot_entries = [[os.path.join(this_dir, plot), this_label] for this_dir, this_label in zip(args.dir, args.dirlabel)]
+        if plot in skipped:
+            continue
+        this_dict = {"title": slide_config.escape_tex(plot)}
+        plot_entries = [[slide_config.get_safe_plot_path(os.path.join(this_dir, plot)), slide_config.escape_tex(this_label)]
+                        for this_dir, this_label in zip(args.dir, args.dirlabel)]
         this_dict['plots'] = plot_entries
-        json_dict['slides'].append(this_dict)
+        yield this_dict
 
-    return json_dict
+    if skipped:
+        yield make_skipped_slide(skipped)
 
 
 if __name__ == '__main__':
@@ -83,36 +270,28 @@ if __name__ == '__main__':
     parser.add_argument("--dir", help="Directory to get plot from. Can be used multiple times", action="append")
     parser.add_argument("--dirlabel", help="Label to be given for dir. Must be used in conjunction with --dir, once per entry.", action="append")
     parser.add_argument("--plotname", help="Filename of plot. Can be used multiple times. If not specified, uses all files with extension specified by --ext", action="append")
-    parser.add_argument("--ext", help="File extension to use when gathering filenames. Only used if --plotname not specified", default="pdf")
+    parser.add_argument("--ext", help="File extension to use when gathering filenames, e.g. pdf, png, eps, svg (EPS & SVG are converted to PDF). Can be used multiple times, or comma-separated. Only used if --plotname not specified. Default is pdf", action="append")
+    parser.add_argument("--recursive", help="Also look for plots in subdirectories of each --dir", action='store_true')
+    parser.add_argument("--index", help="JSON file to cache the list of plots in each --dir, so unchanged dirs aren't rescanned")
     parser.add_argument("--title", help="Title of presentation", default="Plot comparison")
-    parser.add_argument("--template", help="Template beamer tex file", default="beamer_template.tex")
-    parser.add_argument("--noCompile", help="Don't compile PDF", action='store_true')
-    parser.add_argument("--noCleanup", help="Don't remove auxiliary aux/toc/log etc", action='store_true')
-    parser.add_argument("-v", "--verbose", help="Run in verbose mode", action='store_true')
-    parser.add_argument("--open", help="Open PDF", action='store_true')
+    parser.add_argument("--onlyDiff", help="Skip plots that are byte-identical in all dirs", action='store_true')
+    parser.add_argument("--pixelThreshold",
+                        help="Also skip plots whose low-resolution renderings differ in less than this fraction "
+                        "of pixels, e.g. 0.001. Implies --onlyDiff. Requires ghostscript.",
+                        type=float)
+    ms.add_build_arguments(parser)
     args = parser.parse_args()
 
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
     if args.verbose:
-        log.setLevel(logging.DEBUG)
+        logging.getLogger().setLevel(logging.DEBUG)
 
-    # create a JSON config
-    json_dict = create_json_contents(args)
+    # comparing renderings uses the cache before the build does
+    artifact_cache.configure(args.cacheDir, args.cacheSize)
 
-    temp_json = os.path.splitext(args.output)[0] + ".json"
-    with open(temp_json, "w") as f:
-        f.write(json.dumps(json_dict, indent=4))
-    
-    # This is horrible FIXME
-    new_args = [temp_json]
-    new_args.append('--template=' + args.template)
-    for name in ['noCompile', 'noCleanup', 'open', 'verbose']:
-        if vars(args)[name]:
-            new_args.append("--"+name)
-
-    log.debug(new_args)
-
-    # run the main program as usual
-    ms.main(new_args)
-
-    # cleanup JSON
-    os.remove(temp_json)
+    # pass the slides straight to the main program as they are made
+    try:
+        ms.build(args, create_frontpage(args), generate_slides(args), ms.get_output_stem(args.output, args.draft))
+    except ms.BUILD_ERRORS as err:
+        log.error("%s", err)
+        sys.exit(1)
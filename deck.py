@@ -0,0 +1,152 @@
+"""
+Python interface for making decks, without needing a JSON configuration file:
+
+    import deck
+
+    my_deck = deck.Deck(title="My plots", author="Me")
+    my_deck.add_slide("Jet pT", plots=[("jet_pt.pdf", "Data"), ("jet_pt_mc.pdf", "MC")])
+    result = my_deck.build("my_plots.pdf")
+    print(result.pdf_filename, result.timings)
+
+Nothing here touches the logging configuration, so it can be used many
+times from the same program.
+"""
+
+
+import os
+import make_slides as ms
+import slide_config
+
+
+DEFAULT_TEMPLATE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "beamer_template.tex")
+
+
+class Slide(object):
+    """One slide in a deck
+
+    Parameters
+    ----------
+    title : str, optional
+        Slide title, also used for the section in the table of contents
+    plots : list[(str, str)], optional
+        Filename and optional title for each plot
+    toptext : str, optional
+        TeX to go above the plots
+    bottomtext : str, optional
+        TeX to go below the plots
+    """
+
+    def __init__(self, title='', plots=None, toptext='', bottomtext=''):
+        self.title = title
+        self.plots = [list(p) for p in plots or []]
+        self.toptext = toptext
+        self.bottomtext = bottomtext
+
+    @classmethod
+    def from_dict(cls, slide_dict):
+        """Make a Slide from its configuration file entry"""
+        return cls(title=slide_dict.get('title', ''),
+                   plots=slide_dict.get('plots'),
+                   toptext=slide_dict.get('toptext', ''),
+                   bottomtext=slide_dict.get('bottomtext', ''))
+
+    def to_dict(self):
+        """Get the configuration file entry for this slide"""
+        slide_dict = {'title': self.title}
+        if self.plots:
+            slide_dict['plots'] = self.plots
+        if self.toptext:
+            slide_dict['toptext'] = self.toptext
+        if self.bottomtext:
+            slide_dict['bottomtext'] = self.bottomtext
+        return slide_dict
+
+    def __repr__(self):
+        return "Slide(%r, plots=%r)" % (self.title, self.plots)
+
+
+class Deck(object):
+    """A set of slides, with a title page
+
+    Parameters
+    ----------
+    title : str, optional
+        Title for title slide
+    subtitle : str, optional
+        Subtitle for title slide
+    author : str, optional
+        Author name for title slide
+    slides : iterable[Slide or dict], optional
+        Slides in the deck. Can be a generator, in which case the slides are
+        only made as they are written out.
+    """
+
+    def __init__(self, title='', subtitle='', author='', slides=None):
+        self.title = title
+        self.subtitle = subtitle
+        self.author = author
+        self.slides = slides if slides is not None else []
+
+    @classmethod
+    def from_config(cls, config_filename):
+        """Make a Deck from a JSON or JSON-lines configuration file"""
+        front_dict, slides = ms.iter_config(config_filename)
+        return cls(title=front_dict.get('title', ''),
+                   subtitle=front_dict.get('subtitle', ''),
+                   author=front_dict.get('author', ''),
+                   slides=slides)
+
+    def add_slide(self, title='', plots=None, toptext='', bottomtext=''):
+        """Add a slide to the end of the deck, see Slide for the arguments
+
+        Returns
+        -------
+        Slide
+        """
+        slide = Slide(title, plots, toptext, bottomtext)
+        self.slides.append(slide)
+        return slide
+
+    def frontpage(self):
+        """Get the configuration file entry for the title page"""
+        return {'title': self.title, 'subtitle': self.subtitle, 'author': self.author}
+
+    def iter_slide_dicts(self):
+        """Get the configuration file entry for each slide, one at a time"""
+        for slide in self.slides:
+            yield slide.to_dict() if isinstance(slide, Slide) else slide
+
+    def to_config(self):
+        """Get the contents for a JSON configuration file"""
+        return {'frontpage': self.frontpage(), 'slides': list(self.iter_slide_dicts())}
+
+    def build(self, pdf_filename, template_filename=DEFAULT_TEMPLATE, **kwargs):
+        """Make the PDF. The TeX files are made alongside it.
+
+        The title page & slides are checked & escaped like a configuration
+        file's, see slide_config.
+
+        Parameters
+        ----------
+        pdf_filename : str
+            Output PDF filename
+        template_filename : str, optional
+            Name of beamer template tex file. Default is the one in this package.
+        **kwargs
+            Other options for make_slides.build_pdf, e.g. do_toc, jobs
+
+        Returns
+        -------
+        make_slides.BuildResult
+            Output PDF filename & timings
+
+        Raises
+        ------
+        slide_config.ConfigError
+            If a slide isn't valid
+        """
+        return ms.build_pdf(slide_config.normalise_frontpage(self.frontpage()),
+                            slide_config.iter_normalised_slides(self.iter_slide_dicts()),
+                            out_stem=os.path.splitext(pdf_filename)[0],
+                            template_filename=template_filename,
+                            **kwargs)
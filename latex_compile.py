@@ -0,0 +1,342 @@
+"""
+Running latex: as many passes as the auxiliary files need (keeping them between
+builds, so a rebuild usually needs one), measuring & limiting its memory, and
+finding the slides that stop a deck compiling.
+"""
+
+
+import logging
+import os
+import shutil
+import subprocess
+import time
+from sys import platform as _platform
+import latex_errors
+import tex_files
+
+
+log = logging.getLogger(__name__)
+
+
+# Files latex uses to pass info between passes
+AUX_EXTENSIONS = ['.aux', '.toc', '.nav', '.snm', '.out']
+
+# Hidden directory, next to the PDF, that the auxiliary files are kept in
+# between builds, so the next build can start from them
+AUX_STASH_DIR = ".latex_aux"
+
+# Most passes needed to get the TOC, navigation & page numbers right
+MAX_COMPILATIONS = 3
+
+
+def read_aux_files(aux_stem):
+    """Read the contents of all auxiliary files latex has produced
+
+    Parameters
+    ----------
+    aux_stem : str
+        Path to auxiliary files without extension
+
+    Returns
+    -------
+    dict
+        Contents of each existing file, keyed by extension
+    """
+    contents = {}
+    for ext in AUX_EXTENSIONS:
+        if os.path.isfile(aux_stem + ext):
+            with open(aux_stem + ext, "rb") as f:
+                contents[ext] = f.read()
+    return contents
+
+
+def get_aux_stash_filename(aux_stem, ext):
+    """Get where an auxiliary file is kept between builds"""
+    return os.path.join(os.path.dirname(aux_stem), AUX_STASH_DIR, os.path.basename(aux_stem) + ext)
+
+
+def stash_aux_files(aux_stem):
+    """Move the auxiliary files out of the way, to be restored by the next build,
+    see restore_aux_files"""
+    for ext in AUX_EXTENSIONS:
+        if os.path.isfile(aux_stem + ext):
+            stash_filename = get_aux_stash_filename(aux_stem, ext)
+            if not os.path.isdir(os.path.dirname(stash_filename)):
+                os.makedirs(os.path.dirname(stash_filename), exist_ok=True)
+            os.replace(aux_stem + ext, stash_filename)
+
+
+def restore_aux_files(aux_stem):
+    """Put back the auxiliary files from the last build, if they were cleaned up,
+    so the first pass already has the right TOC etc."""
+    for ext in AUX_EXTENSIONS:
+        stash_filename = get_aux_stash_filename(aux_stem, ext)
+        if not os.path.isfile(aux_stem + ext) and os.path.isfile(stash_filename):
+            shutil.copyfile(stash_filename, aux_stem + ext)
+
+
+def get_memory_usage(pid):
+    """Get the current memory (resident set size) of a process in MB,
+    or None if it can't be found (e.g. not on linux)"""
+    try:
+        with open("/proc/%d/status" % pid) as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024.
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def run_latex(args, max_memory=None, poll_interval=0.1):
+    """Run a latex command, and measure its peak memory usage
+
+    Parameters
+    ----------
+    args : list[str]
+        Command to run. The TeX file is the last argument.
+    max_memory : float, optional
+        If given, stop latex if its memory goes over this many MB.
+        Only works on linux.
+    poll_interval : float, optional
+        How often to check the memory, in seconds
+
+    Returns
+    -------
+    int, float
+        Return code, and peak memory in MB (None if it can't be measured)
+
+    Raises
+    ------
+    latex_errors.MemoryLimitError
+        If latex went over max_memory
+    """
+    if not hasattr(os, "wait4"):
+        return subprocess.call(args), None
+    proc = subprocess.Popen(args)
+    if max_memory is None:
+        _, status, rusage = os.wait4(proc.pid, 0)
+    else:
+        while True:
+            pid, status, rusage = os.wait4(proc.pid, os.WNOHANG)
+            if pid:
+                break
+            memory = get_memory_usage(proc.pid)
+            if memory is not None and memory > max_memory:
+                proc.kill()
+                os.wait4(proc.pid, 0)
+                raise latex_errors.MemoryLimitError(args[-1], max_memory, memory)
+            time.sleep(poll_interval)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    # maxrss is in kB on linux, bytes on OS X
+    peak_memory = rusage.ru_maxrss / (1024. * 1024. if _platform == "darwin" else 1024.)
+    return proc.returncode, peak_memory
+
+
+def compile_pdf(tex_filename, outdir=None,
+                latex_cmd='lualatex', num_compilations=1,
+                nonstop=False, verbose=False, cleanup=True, fmt=None, profile=None,
+                max_memory=None):
+    """Compile the pdf. Deletes all non-tex/pdf files afterwards.
+
+    Parameters
+    ----------
+    tex_filename : str
+        Name of TeX file to compile
+    outdir : str, optional
+        Output directory for PDF file. Default is the same as that of the TeX file.
+    latex_cmd : str, optional
+        Which latex command to run.
+    num_compilations : int, optional
+        Maximum number of times to run tex command. Default is once.
+        Stops early if the auxiliary files (aux, toc, nav, ...) are unchanged
+        by a pass, since another pass would produce the same output.
+        If more than once, the auxiliary files are kept between builds
+        (see stash_aux_files), so a rebuild usually needs only one pass.
+    nonstop : bool, optional
+        If True, just ignore compilation errors where possible.
+        Otherwise latex stops at the first error.
+    quiet : bool, optional
+        If True, run in batchmode and remove most of the prinout
+    cleanup : bool, optional
+        If True, remove all the non text/pdf files that latex produced
+    fmt : str, optional
+        Precompiled preamble format to use, see preamble_format.make_format
+    profile : dict, optional
+        If given, details of each pass & the cleanup are added to it
+    max_memory : float, optional
+        Stop latex if it uses more than this many MB, see run_latex
+
+    Returns
+    -------
+    list[float]
+        Time taken for each pass, in seconds
+
+    Raises
+    ------
+    latex_errors.CompileError
+        If latex fails, unless nonstop. The log file is kept.
+    latex_errors.MemoryLimitError
+        If latex goes over max_memory, even if nonstop
+    """
+    args = ["nice", "-n", "19", latex_cmd]
+    if nonstop:
+        args.extend(["-interaction", "nonstopmode"])
+    else:
+        args.append("-halt-on-error")
+    if not verbose:
+        args.extend(["--interaction", "batchmode"])
+    if outdir is not None:
+        args.append("-output-directory=%s" % outdir)
+    if fmt is not None:
+        args.append("-fmt=%s" % fmt)
+    args.append(tex_filename)
+    log.debug('Compiling PDF with')
+    log.debug(' '.join(args))
+
+    aux_stem = os.path.join(outdir or os.path.dirname(tex_filename),
+                            os.path.splitext(os.path.basename(tex_filename))[0])
+    if num_compilations > 1:
+        restore_aux_files(aux_stem)
+    aux_contents = read_aux_files(aux_stem)
+    pass_times = []
+    peak_memories = []
+    for i in range(num_compilations):
+        start = time.time()
+        ret, peak_memory = run_latex(args, max_memory)
+        pass_times.append(time.time() - start)
+        if peak_memory is not None:
+            peak_memories.append(peak_memory)
+        if profile is not None:
+            profile.setdefault('passes', []).append({'time': pass_times[-1],
+                                                     'returncode': ret,
+                                                     'peak_memory_mb': peak_memory})
+        if ret != 0:
+            err = latex_errors.CompileError(tex_filename, aux_stem + ".log",
+                                            latex_errors.parse_log(aux_stem + ".log"), ret)
+            if not nonstop:
+                raise err
+            # more passes would just hit the same errors
+            log.warning("%s", err)
+            break
+        if i + 1 < num_compilations:
+            new_aux_contents = read_aux_files(aux_stem)
+            if new_aux_contents == aux_contents:
+                log.debug("Auxiliary files unchanged, no more passes needed")
+                break
+            aux_contents = new_aux_contents
+
+    log.info("Compiled %s in %d pass(es): %s%s", tex_filename, len(pass_times),
+             ", ".join("%.1fs" % t for t in pass_times),
+             ", peak memory %.0f MB" % max(peak_memories) if peak_memories else "")
+
+    if cleanup:
+        start = time.time()
+        if num_compilations > 1:
+            stash_aux_files(aux_stem)
+        for ext in ['.toc', '.snm', '.out', '.nav', '.log', '.aux', '.tex', "_input.tex"]:
+            basename = os.path.splitext(tex_filename)[0]
+            this_file = basename + ext
+            if os.path.isfile(this_file):
+                log.debug("rm %s", this_file)
+                os.remove(this_file)
+        if profile is not None:
+            profile['cleanup'] = time.time() - start
+
+    return pass_times
+
+
+def find_bad_slides(template_filename, front_dict, slides, out_stem, error, fmt=None, verbose=False):
+    """Find all the slides that fail to compile.
+
+    Slides that the log points at are checked on their own, and if the log
+    doesn't say, the slides are split in half & each half checked, down to
+    single slides. Checks are a single pass without a table of contents.
+
+    Parameters
+    ----------
+    template_filename : str
+        Name of beamer template tex file
+    front_dict : dict
+        Title page contents
+    slides : list[dict]
+        Contents of each slide
+    out_stem : str
+        Stem for output files. Checks use out_stem + "_check".
+    error : latex_errors.CompileError
+        Error from compiling the whole deck
+    fmt : str, optional
+        Precompiled preamble format to use, see preamble_format.make_format
+    verbose : bool, optional
+        If True, show the latex output
+
+    Returns
+    -------
+    dict
+        latex_errors.CompileError for each bad slide's index
+
+    Raises
+    ------
+    latex_errors.CompileError
+        If the deck fails to compile even without any slides
+    """
+    check_stem = out_stem + "_check"
+    n_checks = [0]
+
+    def check(indices):
+        """Compile some of the slides, returning None if they compile,
+        otherwise the error and the indices of the slides it is located in"""
+        n_checks[0] += 1
+        line_offsets = []
+        tex_filename = tex_files.write_tex_files(template_filename, front_dict,
+                                          [slides[i] for i in indices],
+                                          check_stem, do_toc=False,
+                                          use_format=fmt is not None,
+                                          line_offsets=line_offsets)
+        try:
+            compile_pdf(tex_filename, outdir=os.path.dirname(os.path.abspath(tex_filename)),
+                           verbose=verbose, fmt=fmt)
+        except latex_errors.CompileError as err:
+            err.locate_slides(check_stem + "_input.tex", line_offsets)
+            return err, [indices[i] for i in err.slides]
+        return None
+
+    log.info("Looking for slides that fail to compile")
+    bad = {}
+    try:
+        if not error.slides and check([]) is not None:
+            # not the slides' fault
+            raise error
+
+        def search(indices, result):
+            while result is not None:
+                err, located = result
+                if len(indices) == 1:
+                    bad[indices[0]] = err
+                    return
+                # the log can point at the wrong slide, e.g. after an unclosed brace
+                confirmed = {}
+                for i in located:
+                    single_result = check([i])
+                    if single_result is not None:
+                        confirmed[i] = single_result[0]
+                if not confirmed:
+                    middle = len(indices) // 2
+                    for half in (indices[:middle], indices[middle:]):
+                        search(half, check(half))
+                    return
+                bad.update(confirmed)
+                indices = [i for i in indices if i not in confirmed]
+                if not indices:
+                    return
+                result = check(indices)
+
+        all_indices = list(range(len(slides)))
+        search(all_indices, (error, [i for i in error.slides if i < len(slides)]))
+    finally:
+        for ext in [".tex", "_input.tex", ".pdf", ".log", ".aux", ".nav", ".out", ".snm", ".toc"]:
+            if os.path.isfile(check_stem + ext):
+                os.remove(check_stem + ext)
+
+    log.info("Found %d bad slide(s) in %d checks", len(bad), n_checks[0])
+    return bad
@@ -0,0 +1,209 @@
+"""
+Handling of latex compilation errors: reading the errors from the log file,
+and working out which slide in the configuration they came from.
+Finding all the slides that fail to compile is in latex_compile.
+
+Errors in the log look like
+
+    ! LaTeX Error: File `missing_plot.pdf' not found.
+    ...
+    l.42 \\end{frame}
+
+where l.42 is the line in whichever file latex was reading at the time.
+That file is found by following the "(filename" and ")" that latex writes
+to the log as it opens & closes files. If it is a slides file, the line is
+mapped to a slide using the line each slide starts at.
+
+Latex being stopped for using too much memory is also reported here,
+see MemoryLimitError.
+"""
+
+
+import bisect
+import logging
+import os
+import re
+
+
+log = logging.getLogger(__name__)
+
+
+# TeX wraps log lines at this length
+MAX_PRINT_LINE = 79
+
+ERROR_RE = re.compile(r"^! (.*)")
+LINE_NUMBER_RE = re.compile(r"^l\.(\d+) ?(.*)")
+# Opening a file: (filename or ("file name"), closing it: )
+OPEN_CLOSE_RE = re.compile(r'\((?:"([^"]+)"|([^\s()"]*))|\)')
+
+
+class CompileError(RuntimeError):
+    """Latex failed to compile a document
+
+    Parameters
+    ----------
+    tex_filename : str
+        Document that failed
+    log_filename : str
+        Latex log file
+    errors : list[dict]
+        Errors from parse_log, each with 'message', 'file', 'line', 'context'
+        and 'slide' (index in the configuration's slides, if known)
+    returncode : int, optional
+        Exit code from latex
+    """
+
+    def __init__(self, tex_filename, log_filename, errors, returncode=None):
+        # Keep the args, so it can be pickled to pass between processes
+        super(CompileError, self).__init__(tex_filename, log_filename, errors, returncode)
+        self.tex_filename = tex_filename
+        self.log_filename = log_filename
+        self.errors = errors
+        self.returncode = returncode
+
+    @property
+    def slides(self):
+        """Indices of the slides the errors came from, where known"""
+        return sorted(set(e['slide'] for e in self.errors if e['slide'] is not None))
+
+    def locate_slides(self, slides_tex_file, line_offsets, first_index=0):
+        """Work out which slides the errors came from
+
+        Parameters
+        ----------
+        slides_tex_file : str
+            Slides TeX file that was compiled
+        line_offsets : list[int]
+            Line number each slide starts at, see tex_files.make_slides_tex_file
+        first_index : int, optional
+            Index in the configuration of the first slide in the file
+        """
+        name = os.path.basename(slides_tex_file)
+        for error in self.errors:
+            if error['file'] is None or error['line'] is None or os.path.basename(error['file']) != name:
+                continue
+            i = bisect.bisect_right(line_offsets, error['line']) - 1
+            if i >= 0:
+                error['slide'] = first_index + i
+
+    def renumber_slides(self, indices):
+        """Change which slides the errors came from, for when the slides
+        compiled were taken from a bigger list
+
+        Parameters
+        ----------
+        indices : sequence[int]
+            Index in the bigger list of each slide that was compiled
+        """
+        for error in self.errors:
+            if error['slide'] is not None:
+                error['slide'] = indices[error['slide']]
+
+    def __str__(self):
+        if not self.errors:
+            return "Failed to compile %s (exit code %s, see %s)" % (self.tex_filename, self.returncode,
+                                                                   self.log_filename)
+        error = self.errors[0]
+        if error['slide'] is not None:
+            where = " in slides[%d]" % error['slide']
+        elif error['line'] is not None:
+            where = " at %s:%d" % (error['file'] or self.tex_filename, error['line'])
+        else:
+            where = ""
+        return "Failed to compile %s%s: %s (see %s)" % (self.tex_filename, where, error['message'],
+                                                      self.log_filename)
+
+
+class MemoryLimitError(RuntimeError):
+    """Latex was stopped for using more memory than allowed
+
+    Parameters
+    ----------
+    tex_filename : str
+        Document being compiled
+    limit_mb : float
+        Memory limit in MB
+    peak_mb : float
+        Memory it had reached when it was stopped, in MB
+    """
+
+    def __init__(self, tex_filename, limit_mb, peak_mb):
+        super(MemoryLimitError, self).__init__(tex_filename, limit_mb, peak_mb)
+        self.tex_filename = tex_filename
+        self.limit_mb = limit_mb
+        self.peak_mb = peak_mb
+
+    def __str__(self):
+        return "Stopped compiling %s after it used %.0f MB (limit %.0f MB)" % (self.tex_filename, self.peak_mb,
+                                                                             self.limit_mb)
+
+
+def unwrap_lines(lines):
+    """Join up log lines that TeX has wrapped"""
+    unwrapped = []
+    wrapped = False
+    for line in lines:
+        if wrapped:
+            unwrapped[-1] += line
+        else:
+            unwrapped.append(line)
+        wrapped = len(line) == MAX_PRINT_LINE
+    return unwrapped
+
+
+def parse_log(log_filename):
+    """Get the errors from a latex log file
+
+    Parameters
+    ----------
+    log_filename : str
+        Name of log file
+
+    Returns
+    -------
+    list[dict]
+        Each error's message, the file & line it was in and the TeX on that
+        line ('file' & 'line' are None if they can't be found),
+        and 'slide', which is always None, see CompileError.locate_slides
+    """
+    if not os.path.isfile(log_filename):
+        return []
+    with open(log_filename, errors="replace") as f:
+        lines = unwrap_lines(f.read().splitlines())
+
+    errors = []
+    open_files = []
+    current = None
+    for line in lines:
+        match = ERROR_RE.match(line)
+        if match:
+            if current is not None:
+                errors.append(current)
+            current = {
+                'message': match.group(1).strip(),
+                'file': next((f for f in reversed(open_files) if f), None),
+                'line': None,
+                'context': None,
+                'slide': None,
+            }
+            continue
+        if current is not None:
+            # skip the rest of the error, its TeX may have brackets in it
+            match = LINE_NUMBER_RE.match(line)
+            if match:
+                current['line'] = int(match.group(1))
+                current['context'] = match.group(2).strip()
+                errors.append(current)
+                current = None
+            continue
+        for match in OPEN_CLOSE_RE.finditer(line):
+            if match.group(0) == ")":
+                if open_files:
+                    open_files.pop()
+            else:
+                filename = match.group(1) or match.group(2)
+                # plain brackets in messages are pushed as None, to keep the nesting
+                open_files.append(filename if filename and "." in filename else None)
+    if current is not None:
+        errors.append(current)
+    return errors
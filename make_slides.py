@@ -13,146 +13,142 @@ Run:
 """
 
 
-import glob
 import os
 import argparse
 import subprocess
-import beamer_slide_templates as bst
+import slide_cache
+import preamble_format
+import plot_processing
+import plot_metadata
+import pdf_engine
+import split_output
+import watch_build
+import latex_errors
+import latex_compile
+import tex_files
+import slide_config
+import artifact_cache
 import json
 import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from sys import platform as _platform
 import logging
 
+# The TeX writing & latex running used to live here, keep the old names for scripts
+from latex_compile import compile_pdf  # noqa: F401
+from tex_files import get_toc_tex, make_main_tex_file, make_slides_tex_file  # noqa: F401
+
 
 log = logging.getLogger(__name__)
-logging.basicConfig(level=logging.INFO, format='%(message)s')
 
 
-def make_main_tex_file(template_filename, frontpage_title='', subtitle='', author='',
-                       main_tex_file='', slides_tex_file='', toc_tex=''):
-    """Generate main TeX file for set of slides, using a template.
+# Resolution for thumbnails in draft builds
+DRAFT_DPI = 36
+
+# Errors a build reports to the user, rather than with a traceback
+BUILD_ERRORS = (latex_errors.CompileError, plot_metadata.PlotError, slide_config.ConfigError,
+                split_output.SplitError)
+
+
+def iter_config(config_filename):
+    """Read the configuration file, without necessarily loading all the slides.
+
+    A .json file is loaded in one go. A JSON-lines (.jsonl) file has one JSON
+    object per line: a line with a 'frontpage' entry gives the title page,
+    every other line is a slide. These are read one slide at a time.
+
+    Each entry is checked & escaped as it is read, see slide_config.
 
     Parameters
     ----------
-    template_filename : str
-        Name of beamer texmplate tex file
-    frontpage_title : str, optional
-        Title for title slide
-    subtitle : str, optional
-        Subtitle for title slide
-    author : str, optional
-        Author nae for front slide
-    main_tex_file : str, optional
-        Filename for main TeX file to be written.
-    slides_tex_file : str, optional
-        Filename for slides file to be included.
-    toc_tex : str, optional
-        Table of Contents tex snippet
+    config_filename : str
+        Name of JSON or JSON-lines config file
+
+    Returns
+    -------
+    dict, iterable[dict]
+        Title page contents, and contents of each slide
+
+    Raises
+    ------
+    slide_config.ConfigError
+        If an entry isn't valid. For JSON-lines files, this can happen
+        part way through reading the slides.
     """
-    with open(template_filename, "r") as template:
-        with open(main_tex_file, "w") as f:
-            substitute = {"@TITLE": frontpage_title, "@SUBTITLE": subtitle,
-                          "@FILE": slides_tex_file, "@AUTHOR": author,
-                          "@TOC": toc_tex}
-            for line in template:
-                for k in substitute:
-                    if k in line:
-                        line = line.replace(k, substitute[k])
-                f.write(line)
+    log.debug("Using configuration file %s", config_filename)
+    config_dir = os.path.dirname(config_filename)
+    if os.path.splitext(config_filename)[1] != ".jsonl":
+        with open(config_filename, "r") as fp:
+            config_dict = json.load(fp)
+        if not isinstance(config_dict.get('slides'), list):
+            raise slide_config.ConfigError("slides", "expected a list of slides")
+        return (slide_config.normalise_frontpage(config_dict.get('frontpage', {})),
+                list(slide_config.iter_normalised_slides(config_dict['slides'], config_dir)))
+
+    frontpage = {}
+    fp = open(config_filename, "r")
+    first_line = fp.readline()
+    if first_line.strip():
+        first_entry = json.loads(first_line)
+        if 'frontpage' in first_entry:
+            frontpage = first_entry['frontpage']
+        else:
+            fp.seek(0)
 
+    def iter_slides():
+        with fp:
+            for line in fp:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                if 'frontpage' in entry:
+                    raise slide_config.ConfigError("frontpage", "must be on the first line of %s" % config_filename)
+                yield entry
 
-def make_slides_tex_file(slides_tex_file, slides_dict):
-    """Generate TeX file for slides contents
+    return (slide_config.normalise_frontpage(frontpage),
+            slide_config.iter_normalised_slides(iter_slides(), config_dir))
+
+
+def load_config(config_filename):
+    """Load the whole configuration file
 
     Parameters
     ----------
-    slides_tex_file : str
-        Filename for slides TeX file to be written
-    slides_dict : dict
-        Dict of slides contents
+    config_filename : str
+        Name of JSON or JSON-lines config file
+
+    Returns
+    -------
+    dict
+        Configuration, with 'frontpage' and 'slides' entries
     """
-    with open(slides_tex_file, "w") as slides:
-        for slide in slides_dict:
-            log.debug("Writing slide")
-            template = None
-            num_plots = len(slide.get('plots', ''))
-            if num_plots == 0:
-                if slide.get('toptext', "") == "" and slide.get('bottomtext', "") == "":
-                    template = bst.only_title_slide
-                else:
-                    template = bst.zero_plot_slide
-            elif num_plots == 1:
-                template = bst.one_plot_slide
-            elif num_plots == 2:
-                template = bst.two_plot_slide
-            elif num_plots == 3:
-                template = bst.three_plot_slide
-            elif num_plots <= 4:
-                template = bst.four_plot_slide
-            elif num_plots <= 6:
-                template = bst.six_plot_slide
-            elif num_plots <= 8:
-                template = bst.eight_plot_slide
-            elif num_plots <= 10:
-                template = bst.ten_plot_slide
-            else:
-                raise RuntimeError("Cannot make a slide with %d plots" % num_plots)
-            slides.write(
-                bst.make_slide(
-                    slide_template=template,
-                    slide_section=slide.get('title', ''),
-                    slide_title=slide.get('title', ''),
-                    plots=slide.get('plots', ''),
-                    top_text=slide.get('toptext', ''),
-                    bottom_text=slide.get('bottomtext', '')
-                )
-            )
-
-
-def get_toc_tex(do_toc, n_slides=2):
-    """Gets text insert for table of contents
-    
+    frontpage, slides = iter_config(config_filename)
+    return {'frontpage': frontpage, 'slides': list(slides)}
+
+
+def get_output_stem(config_filename, draft=None):
+    """Get the stem for all output files, e.g. <stem>.tex, <stem>.pdf
+
     Parameters
     ----------
-    do_toc : bool
-        Whether to do actual TOC or dummy
-    n_cols : int
-        Number of slides to be in table of contents
-        Determines number of columns
+    config_filename : str
+        Name of JSON config file
+    draft : str, optional
+        Draft mode, if making a draft (see add_build_arguments).
+        Drafts get their own files, so they don't replace the full build.
+
     Returns
     -------
     str
-        Tex snippet to use
     """
-    if do_toc:
-        
-        tex = r"""
-\begin{frame}{Table of Contents}
-@STARTMULTICOL
-    \tableofcontents
-@ENDMULTICOL
-\end{frame}
-"""
-        n_cols = 1
-        if n_slides > 20:
-            n_cols = 3
-        elif n_slides > 10:
-            n_cols = 2
-
-        # Have to do it this way, multicols seems to ignore arg = 1 ?!
-        if n_cols > 1:
-            tex = tex.replace("@STARTMULTICOL", r"""    \begin{multicols}{"""+str(n_cols)+r"""}""")
-            tex = tex.replace("@ENDMULTICOL", r"    \end{multicols}")
-        else:
-            tex = tex.replace("@STARTMULTICOL", "")
-            tex = tex.replace("@ENDMULTICOL", "")
-    
-        return tex
-    else:
-        return ""
+    stem = os.path.splitext(config_filename)[0] + "_slides"
+    if draft:
+        stem += "_draft"
+    return stem
 
 
-def make_tex_files(template_filename, config_filename, do_toc):
+def make_tex_files(template_filename, config_filename, do_toc, use_format=False):
     """Make the relevant TeX files: main one,  and separate one with all plots
 
     Parameters
@@ -160,84 +156,20 @@ def make_tex_files(template_filename, config_filename, do_toc):
     template_filename : str
         Name of beamer texmplate tex file
     config_filename : str
-        Name of JSON config file
+        Name of JSON or JSON-lines config file
     do_toc : bool
         Add table of contents
+    use_format : bool, optional
+        Mark the end of the precompiled preamble in the main TeX file
 
     Returns
     -------
     str
         Main TeX filename
     """
-    log.debug("Using configuration file %s", config_filename)
-    with open(config_filename, "r") as fp:
-        config_dict = json.load(fp)
-
-    out_stem = os.path.splitext(config_filename)[0] + "_slides"
-    main_file = out_stem + ".tex"
-    slides_file = out_stem + "_input.tex"
-    log.debug("Writing to %s", main_file)
-
-    # Start beamer file - make main tex file
-    # Use template - change title, subtitle, include file
-    front_dict = config_dict['frontpage']
-    log.debug("Using template file %s", template_filename)
-    make_main_tex_file(template_filename,
-                       front_dict.get('title', ''),
-                       front_dict.get('subtitle', ''),
-                       front_dict.get('author', ''),
-                       main_file,
-                       slides_file,
-                       get_toc_tex(do_toc, n_slides=len(config_dict['slides'])))
-
-    # Now make the slides file to be included in main file
-    make_slides_tex_file(slides_tex_file=slides_file, slides_dict=config_dict['slides'])
-    return main_file
-
-
-def compile_pdf(tex_filename, outdir=None,
-                latex_cmd='lualatex', num_compilations=1,
-                nonstop=False, verbose=False, cleanup=True):
-    """Compile the pdf. Deletes all non-tex/pdf files afterwards.
-
-    Parameters
-    ----------
-    tex_filename : str
-        Name of TeX file to compile
-    outdir : str, optional
-        Output directory for PDF file. Default is the same as that of the TeX file.
-    latex_cmd : str, optional
-        Which latex command to run.
-    num_compilations : int, optional
-        Number of times to run tex command. Default is once.
-    nonstop : bool, optional
-        If True, just ignore compilation errors where possible
-    quiet : bool, optional
-        If True, run in batchmode and remove most of the prinout
-    cleanup : bool, optional
-        If True, remove all the non text/pdf files that latex produced
-    """
-    args = ["nice", "-n", "19", latex_cmd]
-    if nonstop:
-        args.extend(["-interaction", "nonstopmode"])
-    if not verbose:
-        args.extend(["--interaction", "batchmode"])
-    if outdir is not None:
-        args.append("-output-directory=%s" % outdir)
-    args.append(tex_filename)
-    log.debug('Compiling PDF with')
-    log.debug(' '.join(args))
-
-    for i in range(num_compilations):
-        subprocess.call(args)
-
-    if cleanup:
-        for ext in ['.toc', '.snm', '.out', '.nav', '.log', '.aux', '.tex', "_input.tex"]:
-            basename = os.path.splitext(tex_filename)[0]
-            this_file = basename + ext
-            if os.path.isfile(this_file):
-                log.debug("rm %s", this_file)
-                os.remove(this_file)
+    front_dict, slides = iter_config(config_filename)
+    return tex_files.write_tex_files(template_filename, front_dict, slides,
+                                     get_output_stem(config_filename), do_toc, use_format)
 
 
 def open_pdf(pdf_filename):
@@ -253,39 +185,659 @@ def open_pdf(pdf_filename):
         subprocess.call(["start", pdf_filename])
 
 
-def main(in_args):
-    """Run the whole shebang, making TeX files & compilation"""
-    parser = argparse.ArgumentParser(description=__doc__)
-    parser.add_argument("config", help="JSON configuration file")
+def positive_int(value):
+    """Argument type for a whole number that must be at least 1"""
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid int value: %r" % value)
+    if number < 1:
+        raise argparse.ArgumentTypeError("must be at least 1, not %d" % number)
+    return number
+
+
+def add_build_arguments(parser):
+    """Add the options that control how the deck is built to an argument parser,
+    for use with build()"""
     parser.add_argument("--template", help="Template beamer tex file", default="beamer_template.tex")
     parser.add_argument("--noCompile", help="Don't compile PDF", action='store_true')
     parser.add_argument("--noCleanup", help="Don't remove auxiliary aux/toc/log etc", action='store_true')
     parser.add_argument("-v", "--verbose", help="Verbose mode", action='store_true')
     parser.add_argument("--open", help="Open PDF", action='store_true')
     parser.add_argument("--notoc", help="No table of contents", action='store_true')
-    args = parser.parse_args(in_args)
+    parser.add_argument("--incremental",
+                        help="Compile each slide separately & cache them, "
+                        "so only changed slides are recompiled on the next run. "
+                        "Requires pypdf.",
+                        action='store_true')
+    parser.add_argument("-j", "--jobs",
+                        help="Split the slides into chunks, and compile this many "
+                        "simultaneously. Requires pypdf.",
+                        type=int, default=1)
+    parser.add_argument("--precompilePreamble",
+                        help="Use a cached precompiled preamble to speed up compilation. "
+                        "Requires the mylatexformat package.",
+                        action='store_true')
+    parser.add_argument("--preprocessPlots",
+                        help="Convert large PDF plots before compiling: 'raster' makes PNGs, "
+                        "'optimise' rewrites the PDF. Converted plots are cached. "
+                        "Requires ghostscript.",
+                        choices=['raster', 'optimise'])
+    parser.add_argument("--preprocessThreshold",
+                        help="Only preprocess plots bigger than this many MB",
+                        type=float, default=1.0)
+    parser.add_argument("--rasterDpi", help="Resolution for rasterised plots", type=int, default=150)
+    parser.add_argument("--draft",
+                        help="Quick preview with a single latex pass, made as <output>_draft.pdf. "
+                        "Plots are shown as boxes of the same size (placeholder, the default), "
+                        "or as low resolution images (thumbnail)",
+                        nargs='?', const='placeholder', choices=['placeholder', 'thumbnail'])
+    parser.add_argument("--engine",
+                        help="How to make the PDF: latex compiles everything, pdf draws slides "
+                        "that are just plots & plain text directly (much faster), "
+                        "and only uses latex for the rest. Needs pypdf.",
+                        choices=['latex', 'pdf'], default='latex')
+    parser.add_argument("--splitSections",
+                        help="Make a separate PDF for each section. Sections start at each "
+                        "title-only slide, or if there aren't any, each change of slide title.",
+                        action='store_true')
+    parser.add_argument("--splitEvery",
+                        help="Make a separate PDF for every N slides",
+                        type=positive_int, metavar="N")
+    parser.add_argument("--splitIndex",
+                        help="With --splitSections or --splitEvery, also make an index PDF "
+                        "linking to each part",
+                        action='store_true')
+    parser.add_argument("--noPlotCheck",
+                        help="Don't check all the plots exist & are valid before compiling",
+                        action='store_true')
+    parser.add_argument("--skipBadSlides",
+                        help="If the deck fails to compile, find the slides that cause it "
+                        "and build the deck without them",
+                        action='store_true')
+    parser.add_argument("--maxMemory", "--max-memory",
+                        help="Memory limit for latex in MB, shared between the latex processes "
+                        "running at once (see --jobs). If compiling the deck goes over it, "
+                        "latex is stopped and the deck is compiled in smaller chunks instead. "
+                        "Only works on linux. Requires pypdf.",
+                        type=float, dest="maxMemory", metavar="MB")
+    parser.add_argument("--cacheDir",
+                        help="Directory for the cache of compiled slides, converted plots & "
+                        "preambles, which can be shared between users. "
+                        "Default is $%s, or ~/.cache/beamer-plot-slides" % artifact_cache.DIR_ENV_VAR)
+    parser.add_argument("--cacheSize",
+                        help="Maximum size of the cache in MB, the least recently used entries "
+                        "are removed to stay under it. Default is $%s, or %d"
+                        % (artifact_cache.SIZE_ENV_VAR, artifact_cache.DEFAULT_MAX_SIZE_MB),
+                        type=float, metavar="MB")
+    parser.add_argument("--profileReport", "--profile-report",
+                        help="Write a JSON file with the time taken by each stage of the build, "
+                        "each slide, and each latex pass (with its peak memory)",
+                        dest="profileReport")
+
+
+class BuildResult(object):
+    """What was made by build_pdf
+
+    Attributes
+    ----------
+    pdf_filename : str
+        Output PDF filename
+    timings : dict
+        Time taken for each stage in seconds, e.g. 'tex' for writing the TeX
+        files, 'compile' for compilation, 'passes' for each latex pass
+    profile : dict
+        If requested, details of each slide & latex pass, see build_pdf
+    """
 
-    if args.verbose:
-        log.setLevel(logging.DEBUG)
-    else:
-        log.setLevel(logging.INFO)
+    def __init__(self, pdf_filename, timings, profile=None):
+        self.pdf_filename = pdf_filename
+        self.timings = timings
+        self.profile = profile
+
+    def __repr__(self):
+        return "BuildResult(%r, %r)" % (self.pdf_filename, self.timings)
+
+
+def build_pdf(front_dict, slides, out_stem, template_filename="beamer_template.tex",
+              do_toc=True, do_compile=True, cleanup=True, verbose=False,
+              incremental=False, jobs=1, precompile_preamble=False,
+              preprocess_plots=None, preprocess_threshold=1.0, raster_dpi=150,
+              profile=False, skip_bad_slides=False, check_plots=True, draft=None,
+              engine='latex', max_memory=None, cache_dir=None, cache_size=None, slide_indices=None):
+    """Make the TeX files & compile them.
+
+    EPS & SVG plots are always converted to PDF first (& cached), see
+    plot_processing.convert_slides.
+
+    This doesn't touch the logging configuration, so is safe to call repeatedly
+    from other programs.
+
+    Parameters
+    ----------
+    front_dict : dict
+        Title page contents
+    slides : iterable[dict]
+        Contents of each slide
+    out_stem : str
+        Stem for output files, e.g. <stem>.tex, <stem>.pdf
+    template_filename : str, optional
+        Name of beamer template tex file
+    do_toc : bool, optional
+        Add table of contents
+    do_compile : bool, optional
+        If False, only make the TeX files
+    cleanup : bool, optional
+        If True, remove all the non text/pdf files that latex produced
+    verbose : bool, optional
+        If True, show the latex output
+    incremental : bool, optional
+        Compile & cache each slide separately, see slide_cache.
+        Always the case for slides that need latex with engine 'pdf'.
+    jobs : int, optional
+        Number of chunks of slides to compile simultaneously
+    precompile_preamble : bool, optional
+        Use a precompiled preamble, see preamble_format
+    preprocess_plots : str, optional
+        'raster' or 'optimise' large plots, see plot_processing
+    preprocess_threshold : float, optional
+        Only preprocess plots bigger than this many MB
+    raster_dpi : int, optional
+        Resolution for rasterised plots
+    profile : bool, optional
+        Record details of each slide (render time & size of its plots) and each
+        latex pass (time & peak memory) in BuildResult.profile.
+        Not available for incremental or parallel builds.
+    skip_bad_slides : bool, optional
+        If the deck fails to compile, find the slides that fail
+        (see latex_compile.find_bad_slides) and build the deck without them.
+        Also skips slides with bad plots.
+    check_plots : bool, optional
+        Check all the plots exist & are valid before doing anything else,
+        see plot_metadata. If slides isn't a list, each slide's plots are
+        checked as it is read.
+    draft : str, optional
+        Make a quick preview, with a single latex pass. 'placeholder' shows
+        each plot as a box of the same size, 'thumbnail' uses low resolution
+        images of the plots, which are cached.
+    engine : str, optional
+        'latex' to compile everything, or 'pdf' to draw slides that are just
+        plots & plain text directly, see pdf_engine. Drafts with 'thumbnail'
+        plots are compiled with latex, since only PDF plots can be drawn.
+    max_memory : float, optional
+        Memory limit in MB for latex, for all the processes running at once.
+        If compiling the whole deck goes over it, the deck is compiled in
+        chunks instead (halving their size until they fit), see
+        slide_cache.build_pieces. Needs pypdf.
+    cache_dir : str, optional
+        Directory for the cache of pieces, plots & formats shared between builds,
+        see artifact_cache. Default is $BEAMER_PLOT_SLIDES_CACHE, or in the
+        user's cache directory.
+    cache_size : float, optional
+        Maximum size of the shared cache in MB
+    slide_indices : list[int], optional
+        Index in the configuration of each slide, for reporting errors,
+        if some of the configuration's slides have been left out
+
+    Returns
+    -------
+    BuildResult
+
+    Raises
+    ------
+    plot_metadata.PlotError
+        If any plots are bad, unless skip_bad_slides
+    latex_errors.CompileError
+        If compilation fails, and it isn't fixed by skip_bad_slides
+    """
+    timings = {}
+    build_profile = {'slides': []} if profile else None
+    start = time.time()
+    artifact_cache.configure(cache_dir, cache_size)
+    fmt = None
+    if precompile_preamble and do_compile:
+        fmt = preamble_format.make_format(template_filename)
+        timings['format'] = time.time() - start
+
+    def get_index(i):
+        """Index in the configuration of slides[i]"""
+        return slide_indices[i] if slide_indices is not None else i
+
+    kept_indices = None
+    if check_plots and not isinstance(slides, list):
+        # checked as they're read, so they don't all have to be in memory
+        kept_indices = []
+        slides = plot_metadata.iter_checked_slides(slides, skip_bad_slides, kept_indices=kept_indices)
+    elif check_plots:
+        check_start = time.time()
+        problems = plot_metadata.check_plots(slides)
+        timings['check'] = time.time() - check_start
+        if problems and not skip_bad_slides:
+            raise plot_metadata.PlotError([(get_index(i), plot_filename, problem)
+                                           for i, plot_filename, problem in problems])
+        for i, plot_filename, problem in problems:
+            log.error("Skipping slides[%d] (%s): %s: %s", get_index(i), slides[i].get('title', ''),
+                      plot_filename, problem)
+        if problems:
+            bad_slides = set(p[0] for p in problems)
+            kept = [i for i in range(len(slides)) if i not in bad_slides]
+            slide_indices = [get_index(i) for i in kept]
+            slides = [slides[i] for i in kept]
+
+    try:
+        convert_start = time.time()
+        slides = plot_processing.convert_slides(slides)
+        timings['convert'] = time.time() - convert_start
+
+        if draft == 'thumbnail':
+            preprocess_start = time.time()
+            slides = plot_processing.preprocess_slides(slides, mode='raster', threshold=0, dpi=DRAFT_DPI)
+            timings['preprocess'] = time.time() - preprocess_start
+        elif preprocess_plots:
+            preprocess_start = time.time()
+            slides = plot_processing.preprocess_slides(slides,
+                                                       mode=preprocess_plots,
+                                                       threshold=preprocess_threshold * 1024 * 1024,
+                                                       dpi=raster_dpi)
+            timings['preprocess'] = time.time() - preprocess_start
+        if skip_bad_slides or max_memory:
+            # need them again to rebuild without the bad ones, or in chunks
+            slides = list(slides)
+    except plot_metadata.PlotError as err:
+        # converting can fail too, for slides that may have been left out
+        if kept_indices is not None:
+            slide_indices = [get_index(i) for i in kept_indices]
+        err.problems = [(get_index(i), plot_filename, problem) for i, plot_filename, problem in err.problems]
+        raise
+    if kept_indices is not None and isinstance(slides, list):
+        slide_indices = [get_index(i) for i in kept_indices]
+
+    try:
+        if engine == 'pdf' and do_compile:
+            compile_start = time.time()
+            pdf_filename = pdf_engine.build_deck(template_filename, front_dict, slides, out_stem,
+                                                 do_toc=do_toc,
+                                                 jobs=jobs,
+                                                 cleanup=cleanup,
+                                                 verbose=verbose,
+                                                 fmt=fmt,
+                                                 draft=draft == 'placeholder')
+            timings['compile'] = time.time() - compile_start
+        elif (incremental or jobs > 1) and do_compile:
+            compile_start = time.time()
+            pdf_filename = slide_cache.build_pieces(template_filename=template_filename,
+                                                    config_dict={'frontpage': front_dict,
+                                                                 'slides': list(slides)},
+                                                    out_stem=out_stem,
+                                                    do_toc=do_toc,
+                                                    slides_per_piece=1 if incremental else None,
+                                                    jobs=jobs,
+                                                    cleanup=cleanup,
+                                                    verbose=verbose,
+                                                    fmt=fmt,
+                                                    draft=draft == 'placeholder',
+                                                    max_memory=max_memory)
+            timings['compile'] = time.time() - compile_start
+        else:
+            tex_start = time.time()
+            line_offsets = []
+            tex_file = tex_files.write_tex_files(template_filename=template_filename,
+                                                 front_dict=front_dict,
+                                                 slides=slides,
+                                                 out_stem=out_stem,
+                                                 do_toc=do_toc,
+                                                 use_format=fmt is not None,
+                                                 profile=build_profile['slides'] if profile else None,
+                                                 line_offsets=line_offsets,
+                                                 draft=draft == 'placeholder')
+            timings['tex'] = time.time() - tex_start
+
+            if do_compile:
+                compile_start = time.time()
+                try:
+                    timings['passes'] = latex_compile.compile_pdf(tex_file,
+                                                                  outdir=os.path.dirname(os.path.abspath(tex_file)),
+                                                                  # may need more than once to get TOC, PDF outline
+                                                                  # & page numbers correct, drafts make do with one
+                                                                  num_compilations=1 if draft else latex_compile.MAX_COMPILATIONS,
+                                                                  cleanup=cleanup,
+                                                                  verbose=verbose,
+                                                                  fmt=fmt,
+                                                                  profile=build_profile,
+                                                                  max_memory=max_memory)
+                except latex_errors.CompileError as err:
+                    err.locate_slides(out_stem + "_input.tex", line_offsets)
+                    raise
+                except latex_errors.MemoryLimitError as err:
+                    if len(slides) < 2:
+                        raise
+                    log.warning("%s, compiling in chunks instead", err)
+                    slide_cache.build_pieces(template_filename=template_filename,
+                                             config_dict={'frontpage': front_dict, 'slides': slides},
+                                             out_stem=out_stem,
+                                             do_toc=do_toc,
+                                             slides_per_piece=(len(slides) + 1) // 2,
+                                             jobs=jobs,
+                                             cleanup=cleanup,
+                                             verbose=verbose,
+                                             fmt=fmt,
+                                             draft=draft == 'placeholder',
+                                             max_memory=max_memory)
+                timings['compile'] = time.time() - compile_start
+
+            pdf_filename = tex_file.replace(".tex", ".pdf")
+    except latex_errors.CompileError as err:
+        if not skip_bad_slides:
+            if slide_indices is not None:
+                err.renumber_slides(slide_indices)
+            raise
+        bad_slides = latex_compile.find_bad_slides(template_filename, front_dict, slides, out_stem,
+                                                   err, fmt=fmt, verbose=verbose)
+        if slide_indices is not None:
+            err.renumber_slides(slide_indices)
+        log.error("%s", err)
+        for i in sorted(bad_slides):
+            log.error("Skipping slides[%d] (%s): %s", get_index(i), slides[i].get('title', ''),
+                      bad_slides[i].errors[0]['message'] if bad_slides[i].errors else bad_slides[i])
+        kept = [i for i in range(len(slides)) if i not in bad_slides]
+        result = build_pdf(front_dict, [slides[i] for i in kept], out_stem,
+                           template_filename=template_filename, do_toc=do_toc, do_compile=do_compile,
+                           cleanup=cleanup, verbose=verbose, incremental=incremental, jobs=jobs,
+                           precompile_preamble=precompile_preamble, profile=profile, check_plots=False,
+                           draft=draft, engine=engine, max_memory=max_memory,
+                           cache_dir=cache_dir, cache_size=cache_size,
+                           slide_indices=[get_index(i) for i in kept])
+        result.timings['total'] = time.time() - start
+        return result
+    artifact_cache.get_cache().save_stats()
+    timings['total'] = time.time() - start
+    return BuildResult(pdf_filename, timings, build_profile)
+
+
+def get_build_options(args):
+    """Get the build_pdf options from the arguments from add_build_arguments
 
-    tex_file = make_tex_files(template_filename=args.template,
-                              config_filename=args.config,
-                              do_toc=not args.notoc)
+    Returns
+    -------
+    dict
+    """
+    return dict(template_filename=args.template,
+                do_toc=not args.notoc,
+                do_compile=not args.noCompile,
+                cleanup=not args.noCleanup,
+                verbose=args.verbose,
+                incremental=args.incremental,
+                jobs=args.jobs,
+                precompile_preamble=args.precompilePreamble,
+                preprocess_plots=args.preprocessPlots,
+                preprocess_threshold=args.preprocessThreshold,
+                raster_dpi=args.rasterDpi,
+                skip_bad_slides=args.skipBadSlides,
+                check_plots=not args.noPlotCheck,
+                draft=args.draft,
+                engine=args.engine,
+                max_memory=args.maxMemory,
+                cache_dir=args.cacheDir,
+                cache_size=args.cacheSize,
+                profile=bool(getattr(args, 'profileReport', None)))
+
+
+def write_profile_report(report_filename, result, config_filename=None, config_time=None):
+    """Write the timings & profile from a build to a JSON file
+
+    Parameters
+    ----------
+    report_filename : str
+        Name of JSON file to write
+    result : BuildResult
+        Output from build_pdf, made with profile=True
+    config_filename : str, optional
+        Configuration file the deck was made from
+    config_time : float, optional
+        Time taken to read the configuration file, in seconds
+    """
+    profile = result.profile or {}
+    timings = dict(result.timings)
+    if config_time is not None:
+        timings['config'] = config_time
+    slides = profile.get('slides', [])
+    report = {
+        'config': config_filename,
+        'pdf': result.pdf_filename,
+        'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'timings': timings,
+        'passes': profile.get('passes', []),
+        'cleanup': profile.get('cleanup'),
+        'slides': slides,
+        'total_image_bytes': sum(s['image_bytes'] for s in slides),
+    }
+    with open(report_filename, "w") as f:
+        json.dump(report, f, indent=2)
+    log.info("Written profile report to %s", report_filename)
+
+
+def build(args, front_dict, slides, out_stem, config_time=None):
+    """Make the TeX files & compile them, according to the options from add_build_arguments
 
-    if not args.noCompile:
-        compile_pdf(tex_file,
-                    outdir=os.path.dirname(os.path.abspath(tex_file)),
-                    num_compilations=2,  # compile twice to get page numbers correct
-                    cleanup=not args.noCleanup,
-                    verbose=args.verbose)
+    Parameters
+    ----------
+    args : argparse.Namespace
+        Parsed options
+    front_dict : dict
+        Title page contents
+    slides : iterable[dict]
+        Contents of each slide
+    out_stem : str
+        Stem for output files
+    config_time : float, optional
+        Time taken to read the configuration, for the profile report
 
-    pdf_filename = tex_file.replace(".tex", ".pdf")
+    Returns
+    -------
+    str
+        Output PDF filename. If split into parts, the last part, or the index if made.
+    """
+    if args.splitSections or args.splitEvery:
+        pdf_filenames = split_output.build_split(front_dict, slides, out_stem, get_build_options(args),
+                                                 build_pdf, by_section=args.splitSections,
+                                                 slides_per_part=args.splitEvery,
+                                                 make_index=args.splitIndex,
+                                                 max_parts=getattr(args, 'parallelDecks', None))
+        log.info("")
+        log.info("Created PDFs %s", ", ".join(pdf_filenames))
+        if args.open:
+            # the index if there is one, otherwise the first part
+            open_pdf(pdf_filenames[-1] if args.splitIndex else pdf_filenames[0])
+        return pdf_filenames[-1]
+
+    result = build_pdf(front_dict, slides, out_stem, **get_build_options(args))
+    pdf_filename = result.pdf_filename
+    if getattr(args, 'profileReport', None):
+        write_profile_report(args.profileReport, result,
+                             config_filename=getattr(args, 'config', None),
+                             config_time=config_time)
     log.info("")
     log.info("Created PDF %s", pdf_filename)
     if args.open:
         open_pdf(pdf_filename)
+    return pdf_filename
+
+
+def read_manifest(manifest_filename):
+    """Read a list of configuration files, one per line.
+    Blank lines & lines starting with # are ignored.
+    Relative paths are relative to the manifest file.
+
+    Returns
+    -------
+    list[str]
+    """
+    config_filenames = []
+    manifest_dir = os.path.dirname(manifest_filename)
+    with open(manifest_filename) as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                config_filenames.append(os.path.join(manifest_dir, line))
+    return config_filenames
+
+
+def _build_batch_deck(config_filename, front_dict, slides, options):
+    """Build one deck in a batch, catching any error so the others can carry on
+
+    Returns
+    -------
+    BuildResult or str
+        Result, or error message if it failed
+    """
+    try:
+        return build_pdf(front_dict, slides, get_output_stem(config_filename, options['draft']), **options)
+    except Exception as err:
+        return "%s: %s" % (type(err).__name__, err)
+
+
+def build_batch(args, config_filenames, max_decks=None):
+    """Build several decks, several at a time.
+
+    Work that's shared between decks (the precompiled preamble, preprocessing
+    plots) is done once up front.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        Options from add_build_arguments
+    config_filenames : list[str]
+        Configuration file for each deck
+    max_decks : int, optional
+        Number of decks to build simultaneously. Default is the number of CPUs.
+        The --jobs are shared between them, so there are never more than
+        max(jobs, max_decks) latex processes at once.
+
+    Returns
+    -------
+    bool
+        True if all decks were built successfully
+    """
+    options = get_build_options(args)
+    max_decks = max_decks or os.cpu_count() or 1
+    options['jobs'] = max(1, options['jobs'] // max_decks)
+
+    # the same deck twice would have both builds writing the same files
+    unique_filenames = []
+    seen = set()
+    for config_filename in config_filenames:
+        if os.path.realpath(config_filename) in seen:
+            log.warning("Ignoring %s, it's already being built", config_filename)
+            continue
+        seen.add(os.path.realpath(config_filename))
+        unique_filenames.append(config_filename)
+    config_filenames = unique_filenames
+
+    artifact_cache.configure(options['cache_dir'], options['cache_size'])
+    results = {}
+    decks = []
+    for config_filename in config_filenames:
+        try:
+            front_dict, slides = iter_config(config_filename)
+            decks.append((config_filename, front_dict, list(slides)))
+        except (OSError, ValueError, KeyError, RuntimeError) as err:
+            results[config_filename] = "%s: %s" % (type(err).__name__, err)
+            log.error("Failed to read %s: %s", config_filename, results[config_filename])
+
+    if options['precompile_preamble'] and options['do_compile']:
+        # each deck will then find it in the cache
+        preamble_format.make_format(options['template_filename'])
+
+    if options['preprocess_plots']:
+        all_slides = plot_processing.preprocess_slides([s for d in decks for s in d[2]],
+                                                       mode=options['preprocess_plots'],
+                                                       threshold=options['preprocess_threshold'] * 1024 * 1024,
+                                                       dpi=options['raster_dpi'])
+        start = 0
+        for i, (config_filename, front_dict, slides) in enumerate(decks):
+            decks[i] = (config_filename, front_dict, all_slides[start:start + len(slides)])
+            start += len(slides)
+        options['preprocess_plots'] = None
+
+    log.info("Building %d decks", len(decks))
+    with ProcessPoolExecutor(max_workers=max_decks) as pool:
+        futures = {pool.submit(_build_batch_deck, config_filename, front_dict, slides, options): config_filename
+                   for config_filename, front_dict, slides in decks}
+        for future in as_completed(futures):
+            config_filename = futures[future]
+            results[config_filename] = future.result()
+            if isinstance(results[config_filename], BuildResult):
+                log.info("Built %s in %.1fs", results[config_filename].pdf_filename,
+                         results[config_filename].timings['total'])
+            else:
+                log.error("Failed to build %s: %s", config_filename, results[config_filename])
+
+    artifact_cache.get_cache().save_stats()
+    failures = [c for c in config_filenames if not isinstance(results[c], BuildResult)]
+    log.info("")
+    log.info("Built %d of %d decks", len(config_filenames) - len(failures), len(config_filenames))
+    for config_filename in failures:
+        log.info("FAILED: %s", config_filename)
+    return not failures
+
+
+def main(in_args):
+    """Run the whole shebang, making TeX files & compilation"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("config", help="JSON or JSON-lines configuration file(s). "
+                        "If more than one, all the decks are built in one go.",
+                        nargs='*')
+    parser.add_argument("--manifest", help="File listing configuration files to build, one per line")
+    parser.add_argument("--parallelDecks",
+                        help="When building several decks, how many to build simultaneously. "
+                        "Default is the number of CPUs.",
+                        type=int)
+    add_build_arguments(parser)
+    parser.add_argument("--watch",
+                        help="Keep running, and rebuild whenever the configuration, template "
+                        "or plots change. Implies --incremental.",
+                        action='store_true')
+    args = parser.parse_args(in_args)
+
+    # Set on the root logger, so that it applies to the other modules too
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    if args.verbose:
+        logging.getLogger().setLevel(logging.DEBUG)
+    else:
+        logging.getLogger().setLevel(logging.INFO)
+
+    # plots are checked & linked in the cache while reading the configuration
+    artifact_cache.configure(args.cacheDir, args.cacheSize)
+
+    config_filenames = list(args.config)
+    if args.manifest:
+        config_filenames.extend(read_manifest(args.manifest))
+    if not config_filenames:
+        parser.error("No configuration file given")
+
+    if len(config_filenames) > 1:
+        if args.watch:
+            parser.error("Can only --watch one configuration file")
+        if args.profileReport:
+            parser.error("Can only --profileReport one configuration file")
+        if args.splitSections or args.splitEvery:
+            parser.error("Can only split one configuration file")
+        if not build_batch(args, config_filenames, args.parallelDecks):
+            sys.exit(1)
+        return
+
+    args.config = config_filenames[0]
+    if args.watch:
+        watch_build.watch(args, iter_config, build, get_output_stem(args.config, args.draft))
+        return
+
+    start = time.time()
+    try:
+        front_dict, slides = iter_config(args.config)
+        build(args, front_dict, slides, get_output_stem(args.config, args.draft), config_time=time.time() - start)
+    except BUILD_ERRORS as err:
+        log.error("%s", err)
+        sys.exit(1)
 
 
 if __name__ == "__main__":
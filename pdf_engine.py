@@ -0,0 +1,529 @@
+"""
+PDF engine: make the deck without latex, for slides that are just plots.
+
+Each page is drawn directly with pypdf: plot PDFs are placed as form XObjects
+(so a plot used on several slides is only stored once), using the same
+layouts as the beamer templates (see beamer_slide_templates.plot_layout).
+Titles, text & page numbers are drawn in Helvetica, and the outline is added
+at the end. In draft builds, plots are drawn as boxes with their filename,
+like graphicx's draft option.
+
+Anything that really needs TeX (maths, macros, non-PDF plots, ...) falls back
+to latex: those slides are compiled as cached pieces, like incremental builds
+(see slide_cache), with the right page numbers, and merged in.
+
+The layout follows the default beamer theme closely, but not exactly.
+"""
+
+
+import logging
+import os
+import re
+import time
+import beamer_slide_templates as bst
+import latex_errors
+import pdf_utils
+import plot_metadata
+import preamble_format
+import slide_cache
+import tex_files
+
+try:
+    from pypdf import PdfReader, PdfWriter
+    from pypdf.generic import (ArrayObject, DecodedStreamObject, DictionaryObject,
+                               FloatObject, NameObject)
+except ImportError:
+    PdfReader = PdfWriter = None
+
+
+log = logging.getLogger(__name__)
+
+
+# Beamer 16:9 page, 160mm x 90mm
+PAGE_WIDTH = 453.54
+PAGE_HEIGHT = 255.12
+# 5mm, as set in the template
+MARGIN = 14.17
+TEXT_WIDTH = PAGE_WIDTH - 2 * MARGIN
+# Space for the frame title at the top, and page number at the bottom
+TITLE_SPACE = 30.
+FOOTER_SPACE = 14.
+
+TITLE_SIZE = 12.
+HUGE_SIZE = 20.
+TEXT_SIZE = 10.
+PAGE_NUMBER_SIZE = 6.
+MIN_TEXT_SIZE = 4.
+LINE_SPACING = 1.2
+
+# Default beamer theme colours
+STRUCTURE_COLOUR = (0.2, 0.2, 0.7)
+TEXT_COLOUR = (0., 0., 0.)
+
+# Helvetica glyph widths (per 1000 units of font size), for characters 32-126
+HELVETICA_WIDTHS = dict(zip(
+    [chr(c) for c in range(32, 127)],
+    [278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278,
+     556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278, 584, 584, 584, 556,
+     1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722, 778,
+     667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556,
+     333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556,
+     556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584]))
+DEFAULT_WIDTH = 556
+
+# Escaped characters that are fine as plain text
+TEX_ESCAPE_RE = re.compile(r"\\([&%$#_{}])")
+# Anything else that TeX would treat specially
+TEX_SPECIAL_RE = re.compile(r"[\\$^~{}%&#_]")
+
+
+def tex_to_plain(text):
+    """Get the plain text for some TeX, if it doesn't need TeX to render it
+
+    Parameters
+    ----------
+    text : str
+        TeX
+
+    Returns
+    -------
+    str
+        Plain text, or None if it has macros, maths, etc
+    """
+    if TEX_SPECIAL_RE.search(TEX_ESCAPE_RE.sub("", text)):
+        return None
+    return TEX_ESCAPE_RE.sub(r"\1", text)
+
+
+def can_draw(slide):
+    """Whether a slide can be drawn without latex: all its text is plain,
+    and all its plots are PDFs"""
+    texts = [slide.get('title', ''), slide.get('toptext', ''), slide.get('bottomtext', '')]
+    texts += [plot[1] for plot in slide.get('plots', []) if len(plot) > 1]
+    if any(tex_to_plain(t) is None for t in texts):
+        return False
+    return all(plot_metadata.resolve_plot(plot[0]).lower().endswith(".pdf")
+               for plot in slide.get('plots', []))
+
+
+def can_draw_front(front_dict, sections=()):
+    """Whether the title page, and the table of contents listing sections,
+    can be drawn without latex"""
+    texts = [front_dict.get(k, '') for k in ['title', 'subtitle', 'author']] + list(sections)
+    return all(tex_to_plain(t) is not None for t in texts)
+
+
+def text_width(text, size):
+    """Width of some text in Helvetica, in points"""
+    return sum(HELVETICA_WIDTHS.get(c, DEFAULT_WIDTH) for c in text) * size / 1000.
+
+
+def wrap_text(text, size, width):
+    """Split text into lines no wider than width"""
+    lines = []
+    for paragraph in text.split("\n"):
+        line = ""
+        for word in paragraph.split():
+            candidate = (line + " " + word) if line else word
+            if line and text_width(candidate, size) > width:
+                lines.append(line)
+                line = word
+            else:
+                line = candidate
+        lines.append(line)
+    return lines
+
+
+def truncate_text(text, size, width):
+    """Shorten text, ending it with "...", so it fits into width"""
+    if text_width(text, size) <= width:
+        return text
+    while text and text_width(text + "...", size) > width:
+        text = text[:-1]
+    return text + "..."
+
+
+def fit_text_size(text, size, width):
+    """Get the font size, no bigger than size, that fits text into width"""
+    text_size = text_width(text, size)
+    if text_size <= width:
+        return size
+    return max(MIN_TEXT_SIZE, size * width / text_size)
+
+
+def add_object(writer, obj):
+    """Add an object (e.g. a form XObject) to a document, getting a reference to it.
+    Older & newer pypdf only have this as a private method, so it's kept in one place."""
+    add = getattr(writer, "add_object", None) or writer._add_object
+    return add(obj)
+
+
+def get_rotation_matrix(rotate):
+    """Get the matrix that turns a page by its /Rotate (clockwise, in degrees)"""
+    return {0: [1, 0, 0, 1], 90: [0, -1, 1, 0], 180: [-1, 0, 0, -1], 270: [0, 1, -1, 0]}[rotate % 360]
+
+
+class Canvas(object):
+    """Content stream for one page
+
+    Parameters
+    ----------
+    page_number : int
+        Page number, drawn in the bottom right
+    """
+
+    def __init__(self, page_number):
+        self.ops = []
+        self.xobjects = {}
+        self.draw_text(str(page_number), PAGE_WIDTH - MARGIN, 4., PAGE_NUMBER_SIZE,
+                       TEXT_COLOUR, align="right")
+
+    def draw_text(self, text, x, y, size, colour=TEXT_COLOUR, align="left"):
+        """Draw a line of text with its baseline at y, starting, centred on,
+        or ending at x depending on align"""
+        if align == "centre":
+            x -= text_width(text, size) / 2.
+        elif align == "right":
+            x -= text_width(text, size)
+        escaped = text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+        self.ops.append("BT %.3g %.3g %.3g rg /F1 %.3g Tf %.2f %.2f Td (%s) Tj ET"
+                        % (colour + (size, x, y, escaped)))
+
+    def draw_lines(self, lines, x, top, size, colour=TEXT_COLOUR, align="left"):
+        """Draw lines of text going down from top, returning the y position after them"""
+        for line in lines:
+            top -= size * LINE_SPACING
+            self.draw_text(line, x, top + size * (LINE_SPACING - 1), size, colour, align)
+        return top
+
+    def draw_placeholder(self, label, x, y, width, height):
+        """Draw a box with a label in it, in place of a plot in draft builds"""
+        self.ops.append("q 0.5 w %.3g %.3g %.3g RG %.2f %.2f %.2f %.2f re S Q"
+                        % (TEXT_COLOUR + (x, y, width, height)))
+        size = min(TEXT_SIZE, height / 2.)
+        self.draw_text(truncate_text(label, size, width), x + width / 2., y + (height - size) / 2., size,
+                       align="centre")
+
+    def draw_form(self, name, form_ref, x, y, scale, bbox):
+        """Draw a form XObject with its bottom left corner at (x, y)"""
+        self.xobjects[name] = form_ref
+        self.ops.append("q %.4f 0 0 %.4f %.2f %.2f cm /%s Do Q"
+                        % (scale, scale, x - scale * bbox[0], y - scale * bbox[1], name))
+
+    def add_to(self, writer, font_ref):
+        """Add this as a new page at the end of the writer's document"""
+        page = writer.add_blank_page(PAGE_WIDTH, PAGE_HEIGHT)
+        resources = DictionaryObject({NameObject("/Font"): DictionaryObject({NameObject("/F1"): font_ref})})
+        if self.xobjects:
+            resources[NameObject("/XObject")] = DictionaryObject(
+                {NameObject("/" + name): ref for name, ref in self.xobjects.items()})
+        page[NameObject("/Resources")] = resources
+        contents = DecodedStreamObject()
+        contents.set_data("\n".join(self.ops).encode("cp1252", errors="replace"))
+        page.replace_contents(contents.flate_encode())
+
+
+class PlotForms(object):
+    """Form XObjects for the plots, each made once per document
+
+    Parameters
+    ----------
+    writer : pypdf.PdfWriter
+        Document to put them in
+    draft : bool, optional
+        Don't make the forms, just get the plots' sizes
+    """
+
+    def __init__(self, writer, draft=False):
+        self.writer = writer
+        self.draft = draft
+        self.forms = {}
+
+    def get(self, plot_filename):
+        """Get the name, reference & bounding box of the form for a plot.
+        The reference is None if draft.
+
+        The form shows the plot's crop box (as graphicx does), turned by its
+        /Rotate, and the bounding box is of what is shown.
+        """
+        filename = os.path.abspath(plot_metadata.resolve_plot(plot_filename))
+        if filename not in self.forms:
+            page = PdfReader(filename).pages[0]
+            box = page.cropbox
+            matrix = get_rotation_matrix(page.rotation)
+            corners = [(x * matrix[0] + y * matrix[2], x * matrix[1] + y * matrix[3])
+                       for x in (float(box.left), float(box.right)) for y in (float(box.bottom), float(box.top))]
+            bbox = [min(c[0] for c in corners), min(c[1] for c in corners),
+                    max(c[0] for c in corners), max(c[1] for c in corners)]
+            if self.draft:
+                self.forms[filename] = ("Plot%d" % len(self.forms), None, bbox)
+                return self.forms[filename]
+            form = DecodedStreamObject()
+            contents = page.get_contents()
+            form.set_data(contents.get_data() if contents is not None else b"")
+            form[NameObject("/Type")] = NameObject("/XObject")
+            form[NameObject("/Subtype")] = NameObject("/Form")
+            form[NameObject("/BBox")] = ArrayObject([FloatObject(v) for v in
+                                                     [box.left, box.bottom, box.right, box.top]])
+            form[NameObject("/Matrix")] = ArrayObject([FloatObject(v) for v in matrix + [0, 0]])
+            if "/Resources" in page:
+                form[NameObject("/Resources")] = page["/Resources"].clone(self.writer)
+            ref = add_object(self.writer, form.flate_encode())
+            self.forms[filename] = ("Plot%d" % len(self.forms), ref, bbox)
+        return self.forms[filename]
+
+
+def draw_title_page(canvas, front_dict):
+    """Draw the title page, like beamer's default \\titlepage"""
+    centre = PAGE_WIDTH / 2.
+    lines = []
+    for key, size, colour in [('title', 14.4, STRUCTURE_COLOUR),
+                              ('subtitle', TEXT_SIZE, STRUCTURE_COLOUR),
+                              ('author', TEXT_SIZE, TEXT_COLOUR)]:
+        for line in wrap_text(tex_to_plain(front_dict.get(key, '')), size, TEXT_WIDTH):
+            if line:
+                lines.append((line, size, colour))
+        lines.append(("", 6., colour))
+    today = time.localtime()
+    lines.append((time.strftime("%B ", today) + str(today.tm_mday) + time.strftime(", %Y", today),
+                  TEXT_SIZE, TEXT_COLOUR))
+    height = sum(size * LINE_SPACING for _, size, _ in lines)
+    top = (PAGE_HEIGHT + height) / 2.
+    for line, size, colour in lines:
+        top = canvas.draw_lines([line], centre, top, size, colour, align="centre")
+
+
+def draw_toc_page(canvas, sections):
+    """Draw the table of contents, in up to 3 columns like tex_files.get_toc_tex"""
+    draw_frame_title(canvas, "Table of Contents")
+    n_cols = 1
+    if len(sections) > 20:
+        n_cols = 3
+    elif len(sections) > 10:
+        n_cols = 2
+    n_rows = max(1, -(-len(sections) // n_cols))
+    available = PAGE_HEIGHT - TITLE_SPACE - FOOTER_SPACE
+    size = max(MIN_TEXT_SIZE, min(TEXT_SIZE, available / (n_rows * LINE_SPACING)))
+    col_width = TEXT_WIDTH / n_cols
+    top = PAGE_HEIGHT - TITLE_SPACE - (available - n_rows * size * LINE_SPACING) / 2.
+    for col in range(n_cols):
+        entries = sections[col * n_rows:(col + 1) * n_rows]
+        lines = ["%d  %s" % (col * n_rows + i + 1, title) for i, title in enumerate(entries)]
+        lines = [truncate_text(line, size, col_width) for line in lines]
+        canvas.draw_lines(lines, MARGIN + col * col_width, top, size, STRUCTURE_COLOUR)
+
+
+def draw_frame_title(canvas, title):
+    """Draw the title at the top left of a slide"""
+    size = fit_text_size(title, TITLE_SIZE, TEXT_WIDTH)
+    canvas.draw_text(title, MARGIN, PAGE_HEIGHT - 20., size, STRUCTURE_COLOUR)
+
+
+def draw_slide(canvas, slide, forms):
+    """Draw a slide, laid out like its beamer template"""
+    title = tex_to_plain(slide.get('title', ''))
+    plots = slide.get('plots', [])
+    if tex_files.choose_slide_template(slide) == bst.only_title_slide:
+        size = fit_text_size(title, HUGE_SIZE, TEXT_WIDTH)
+        canvas.draw_text(title, PAGE_WIDTH / 2., (PAGE_HEIGHT - size) / 2., size, align="centre")
+        return
+    draw_frame_title(canvas, title)
+
+    top_lines = [l for l in wrap_text(tex_to_plain(slide.get('toptext', '')), TEXT_SIZE, TEXT_WIDTH) if l]
+    bottom_lines = [l for l in wrap_text(tex_to_plain(slide.get('bottomtext', '')), TEXT_SIZE, TEXT_WIDTH) if l]
+    text_height = (len(top_lines) + len(bottom_lines)) * TEXT_SIZE * LINE_SPACING
+
+    plot_forms = [forms.get(plot[0]) for plot in plots]
+    aspects = [(bbox[2] - bbox[0]) / float(bbox[3] - bbox[1]) for _, _, bbox in plot_forms]
+    n_rows, n_cols, width_fraction = bst.plot_layout(
+        len(plots), round(sum(aspects) / len(aspects), 2) if aspects else bst.default_plot_aspect)
+    plot_width = width_fraction * TEXT_WIDTH
+    rows = [list(range(r * n_cols, min(len(plots), (r + 1) * n_cols))) for r in range(n_rows)]
+    rows = [r for r in rows if r]
+
+    def row_height(row, scale):
+        has_title = any(len(plots[i]) > 1 and plots[i][1] for i in row)
+        return ((TEXT_SIZE * LINE_SPACING if has_title else 0)
+                + max(plot_width * scale / aspects[i] for i in row))
+
+    # shrink the plots if they don't fit, where latex would run off the page
+    available = PAGE_HEIGHT - TITLE_SPACE - FOOTER_SPACE - text_height
+    scale = 1.
+    plots_height = sum(row_height(row, scale) for row in rows)
+    if plots_height > available > 0:
+        scale = available / plots_height
+        plots_height = sum(row_height(row, scale) for row in rows)
+
+    # centred vertically, like a beamer frame
+    top = PAGE_HEIGHT - TITLE_SPACE - (available - plots_height) / 2.
+    top = canvas.draw_lines(top_lines, MARGIN, top, TEXT_SIZE)
+    gap = (TEXT_WIDTH - n_cols * plot_width) / (n_cols + 1)
+    for row in rows:
+        height = row_height(row, scale)
+        for col, i in enumerate(row):
+            centre = MARGIN + gap * (col + 1) + plot_width * (col + 0.5)
+            name, ref, bbox = plot_forms[i]
+            width = plot_width * scale
+            plot_title = tex_to_plain(plots[i][1]) if len(plots[i]) > 1 else ""
+            if plot_title:
+                size = fit_text_size(plot_title, TEXT_SIZE, plot_width)
+                canvas.draw_text(plot_title, centre, top - TEXT_SIZE, size, align="centre")
+            scale_to_fit = width / (bbox[2] - bbox[0])
+            if ref is None:
+                canvas.draw_placeholder(os.path.basename(plots[i][0]), centre - width / 2., top - height,
+                                        width, scale_to_fit * (bbox[3] - bbox[1]))
+            else:
+                canvas.draw_form(name, ref, centre - width / 2., top - height, scale_to_fit, bbox)
+        top -= height
+    canvas.draw_lines(bottom_lines, MARGIN, top, TEXT_SIZE)
+
+
+def plan_pages(template_contents, preamble, front_dict, slides, do_toc, piece_pages):
+    """Work out which slides need latex, and the page each slide starts on.
+
+    Slides drawn directly are always one page. Latex pieces use their known
+    number of pages, or one if they've never been compiled, see slide_cache.plan_pieces.
+
+    Returns
+    -------
+    slide_cache.Piece or None, list[(int, slide_cache.Piece or None)]
+        Latex piece for the front if needed, and for each slide its page
+        number and latex piece (None if drawn directly)
+    """
+    front_piece = None
+    # title page & TOC frames
+    n_front_frames = 2 if do_toc else 1
+    sections = [slide.get('title', '') for slide in slides if slide_cache.has_section(slide)]
+    if can_draw_front(front_dict, sections if do_toc else []):
+        n_pages = n_front_frames
+    else:
+        key = slide_cache.hash_contents("front", template_contents, front_dict, sections, do_toc)
+        front_piece = slide_cache.Piece(key, [], 1, front=True)
+        n_pages = sum(piece_pages.get(key, [n_front_frames]))
+
+    plan = []
+    for i, slide in enumerate(slides):
+        if can_draw(slide):
+            plan.append((n_pages + 1, None))
+            n_pages += 1
+        else:
+            key = slide_cache.hash_contents("slides", preamble, [slide], [slide_cache.plot_stats(slide)])
+            plan.append((n_pages + 1, slide_cache.Piece(key, [slide], n_pages + 1, first_index=i,
+                                                         first_frame=n_front_frames + i + 1)))
+            n_pages += sum(piece_pages.get(key, [1]))
+    return front_piece, plan
+
+
+def build_deck(template_filename, front_dict, slides, out_stem, do_toc=True, jobs=1,
+               cleanup=True, verbose=False, fmt=None, draft=False):
+    """Make the PDF, drawing what can be drawn directly, and compiling the rest with latex.
+
+    Slides that need latex are always compiled & cached one at a time,
+    as for incremental builds.
+
+    Parameters
+    ----------
+    template_filename : str
+        Name of beamer template tex file, for slides that need latex
+    front_dict : dict
+        Title page contents
+    slides : iterable[dict]
+        Contents of each slide
+    out_stem : str
+        Stem for output files
+    do_toc : bool, optional
+        Add table of contents
+    jobs : int, optional
+        Number of latex pieces to compile simultaneously
+    cleanup : bool, optional
+        If True, remove all the non text/pdf files that latex produced
+    verbose : bool, optional
+        If True, show the latex output
+    fmt : str, optional
+        Precompiled preamble format to use, see preamble_format.make_format
+    draft : bool, optional
+        Show plots as boxes of the same size, with their filename
+
+    Returns
+    -------
+    str
+        Output PDF filename
+    """
+    pdf_utils.check_pypdf()
+    slides = list(slides)
+    config_dict = {'frontpage': front_dict, 'slides': slides}
+    cache_dir = slide_cache.get_cache_dir(out_stem)
+
+    with open(template_filename) as f:
+        template_contents = f.read()
+    dump_line = preamble_format.get_dump_line(template_filename) if fmt else None
+    preamble = slide_cache.get_template_preamble(template_filename, front_dict, dump_line, draft)
+
+    # Compile anything that needs latex, like slide_cache.build_pieces
+    piece_pages = slide_cache.load_manifest(cache_dir)
+    while True:
+        front_piece, plan = plan_pages(template_contents, preamble, front_dict, slides, do_toc, piece_pages)
+        pieces = [p for p in [front_piece] + [p for _, p in plan] if p is not None]
+        missing = [p for p in pieces if p.key not in piece_pages
+                   or not os.path.isfile(os.path.join(cache_dir, p.name + ".pdf"))]
+        if not missing:
+            break
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        for piece in missing:
+            if piece.front:
+                slide_cache.write_front_piece(template_filename, cache_dir, piece.name, config_dict,
+                                              do_toc, dump_line)
+            else:
+                piece.line_offsets = slide_cache.write_slide_piece(preamble, cache_dir, piece.name, piece.slides,
+                                                                   piece.first_page, piece.first_frame)
+        try:
+            piece_pages.update(slide_cache.compile_pieces(cache_dir, missing, jobs, cleanup, verbose, fmt))
+        except latex_errors.CompileError as err:
+            slide_cache.locate_piece_error(err, cache_dir, missing)
+            raise
+    n_drawn = len([p for _, p in plan if p is None])
+    log.info("Drawing %d slides directly, %d with latex", n_drawn, len(slides) - n_drawn)
+    if pieces:
+        slide_cache.save_manifest(cache_dir, {p.key: piece_pages[p.key] for p in pieces},
+                                  set(p.name for p in pieces))
+
+    writer = PdfWriter()
+    font_ref = add_object(writer, DictionaryObject({
+        NameObject("/Type"): NameObject("/Font"),
+        NameObject("/Subtype"): NameObject("/Type1"),
+        NameObject("/BaseFont"): NameObject("/Helvetica"),
+        NameObject("/Encoding"): NameObject("/WinAnsiEncoding"),
+    }))
+    forms = PlotForms(writer, draft)
+
+    if front_piece is None:
+        canvas = Canvas(1)
+        draw_title_page(canvas, front_dict)
+        canvas.add_to(writer, font_ref)
+        if do_toc:
+            canvas = Canvas(2)
+            draw_toc_page(canvas, [tex_to_plain(s.get('title', '')) for s in slides if slide_cache.has_section(s)])
+            canvas.add_to(writer, font_ref)
+    else:
+        writer.append(os.path.join(cache_dir, front_piece.name + ".pdf"), import_outline=False)
+
+    bookmarks = []
+    for slide, (page_number, piece) in zip(slides, plan):
+        if slide_cache.has_section(slide):
+            bookmarks.append((slide.get('title', ''), page_number - 1))
+        if piece is None:
+            canvas = Canvas(page_number)
+            draw_slide(canvas, slide, forms)
+            canvas.add_to(writer, font_ref)
+        else:
+            writer.append(os.path.join(cache_dir, piece.name + ".pdf"), import_outline=False)
+
+    for title, page_index in bookmarks:
+        writer.add_outline_item(tex_to_plain(title) or title, page_index)
+    if pieces and hasattr(writer, "compress_identical_objects"):
+        writer.compress_identical_objects(remove_identicals=True, remove_orphans=True)
+    pdf_filename = out_stem + ".pdf"
+    with open(pdf_filename, "wb") as f:
+        writer.write(f)
+    return pdf_filename
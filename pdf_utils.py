@@ -0,0 +1,68 @@
+"""
+Helpers for manipulating already-compiled PDF files, e.g. stitching together
+separately compiled pieces of a deck.
+
+These need the pypdf package, which is only required if you use the
+features that rely on them (e.g. incremental builds).
+"""
+
+
+import logging
+
+try:
+    from pypdf import PdfReader, PdfWriter
+except ImportError:
+    PdfReader = PdfWriter = None
+
+
+log = logging.getLogger(__name__)
+
+
+def check_pypdf():
+    """Raise a helpful error if pypdf isn't available."""
+    if PdfWriter is None:
+        raise ImportError("This feature needs the pypdf package: pip install pypdf")
+
+
+def count_pages(pdf_filename):
+    """Count the number of pages in a PDF file
+
+    Parameters
+    ----------
+    pdf_filename : str
+        Name of PDF file
+
+    Returns
+    -------
+    int
+    """
+    check_pypdf()
+    return len(PdfReader(pdf_filename).pages)
+
+
+def merge_pdfs(pdf_filenames, output_filename, bookmarks=None):
+    """Concatenate several PDF files into one.
+
+    Parameters
+    ----------
+    pdf_filenames : list[str]
+        PDF files to concatenate, in order
+    output_filename : str
+        Name of output PDF file
+    bookmarks : list[(str, int)], optional
+        Outline entries to add, as (title, page index) pairs.
+        Page indices count from 0 in the merged document.
+    """
+    check_pypdf()
+    writer = PdfWriter()
+    for pdf_filename in pdf_filenames:
+        log.debug("Appending %s", pdf_filename)
+        # don't copy the pieces' own outlines, they get rebuilt below
+        writer.append(pdf_filename, import_outline=False)
+    for title, page_index in bookmarks or []:
+        writer.add_outline_item(title, page_index)
+    # Plots repeated across pieces get embedded in each one, so merge them
+    if hasattr(writer, "compress_identical_objects"):
+        writer.compress_identical_objects(remove_identicals=True, remove_orphans=True)
+    with open(output_filename, "wb") as f:
+        writer.write(f)
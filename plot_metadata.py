@@ -0,0 +1,442 @@
+"""
+Pre-flight checks of plot files, before anything is compiled.
+
+Every plot is checked for existing, being readable, and having a valid
+header for its format (PDF, PNG, JPEG, EPS or SVG). At the same time its size
+is read (PDF first page, PNG IHDR, JPEG SOF, EPS BoundingBox, SVG width &
+height or viewBox), which gives the aspect ratio used for generated grid layouts.
+
+Results are kept in an index file in the artifact cache directory (see
+artifact_cache), keyed on each plot's path, mtime & size, so unchanged plots
+don't need to be read again.
+"""
+
+
+import json
+import logging
+import os
+import re
+import struct
+from concurrent.futures import ThreadPoolExecutor
+import artifact_cache
+
+try:
+    from pypdf import PdfReader
+except ImportError:
+    PdfReader = None
+
+
+log = logging.getLogger(__name__)
+
+
+# Name of the index file in the cache directory
+INDEX_NAME = "plot_index.json"
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+MEDIABOX_RE = re.compile(rb"/MediaBox\s*\[\s*([-+\d.]+)\s+([-+\d.]+)\s+([-+\d.]+)\s+([-+\d.]+)\s*\]")
+BOUNDINGBOX_RE = re.compile(rb"%%BoundingBox:\s*([-+\d.]+)\s+([-+\d.]+)\s+([-+\d.]+)\s+([-+\d.]+)")
+SVG_TAG_RE = re.compile(rb"<svg\b[^>]*>", re.DOTALL)
+SVG_LENGTH_RE = re.compile(rb"\b(width|height)\s*=\s*[\"']\s*([\d.]+)\s*(px|pt|pc|mm|cm|in)?\s*[\"']")
+# Without pypdf, how many bytes at each end of a PDF to look for a MediaBox in
+PDF_SEARCH_SIZE = 1 << 20
+SVG_VIEWBOX_RE = re.compile(rb"\bviewBox\s*=\s*[\"']\s*[-+\d.]+[\s,]+[-+\d.]+[\s,]+([\d.]+)[\s,]+([\d.]+)\s*[\"']")
+
+# Points per SVG length unit
+SVG_UNITS = {b"px": 0.75, b"pt": 1., b"pc": 12., b"mm": 72 / 25.4, b"cm": 72 / 2.54, b"in": 72.}
+
+# Extensions tried for plots given without one: graphicx's, then SVG,
+# which plot_processing converts to PDF
+DEFAULT_EXTENSIONS = [".pdf", ".png", ".jpg", ".jpeg", ".eps", ".svg"]
+
+# Information about plots we've already read, keyed by (filename, mtime, size)
+_plot_info = {}
+
+
+class PlotError(RuntimeError):
+    """Some plots are missing or can't be used
+
+    Parameters
+    ----------
+    problems : list[(int, str, str)]
+        Slide index, plot filename, and what's wrong with it, for each bad plot
+    """
+
+    def __init__(self, problems):
+        super(PlotError, self).__init__(problems)
+        self.problems = problems
+
+    def __str__(self):
+        lines = ["%d bad plot(s):" % len(self.problems)]
+        lines += ["  slides[%d]: %s: %s" % p for p in self.problems]
+        return "\n".join(lines)
+
+
+def get_default_index_filename():
+    """Get the file to store plot information in, in the artifact cache directory"""
+    return os.path.join(artifact_cache.get_cache().cache_dir, INDEX_NAME)
+
+
+def resolve_plot(plot_filename):
+    """Get the file graphicx would use for a plot, which may be given without
+    an extension. Returns the filename unchanged if there isn't one."""
+    if os.path.splitext(plot_filename)[1] or os.path.isfile(plot_filename):
+        return plot_filename
+    for ext in DEFAULT_EXTENSIONS:
+        if os.path.isfile(plot_filename + ext):
+            return plot_filename + ext
+    return plot_filename
+
+
+def read_pdf_info(f):
+    """Check a PDF, and get the size of its first page.
+
+    With pypdf, this only reads the trailer, cross-reference table & first page,
+    and gives the size latex will show (the crop box, rotated). Otherwise the
+    start & end of the file, where the page objects usually are, are searched
+    for a MediaBox.
+    """
+    if f.read(1024).find(b"%PDF-") < 0:
+        raise ValueError("not a PDF file")
+    size = f.seek(0, os.SEEK_END)
+    f.seek(max(0, size - 2048))
+    if f.read().rfind(b"%%EOF") < 0:
+        raise ValueError("PDF file is truncated")
+
+    if PdfReader is not None:
+        f.seek(0)
+        try:
+            page = PdfReader(f).pages[0]
+            width, height = float(page.cropbox.width), float(page.cropbox.height)
+            if page.rotation % 180:
+                width, height = height, width
+        except Exception as err:
+            # pypdf raises all sorts for broken files
+            raise ValueError("PDF file is corrupt: %s" % err)
+        return "pdf", abs(width), abs(height)
+
+    f.seek(0)
+    chunks = [f.read(PDF_SEARCH_SIZE)]
+    if size > PDF_SEARCH_SIZE:
+        f.seek(max(PDF_SEARCH_SIZE, size - PDF_SEARCH_SIZE))
+        chunks.append(f.read())
+    for chunk in chunks:
+        match = MEDIABOX_RE.search(chunk)
+        if match:
+            x0, y0, x1, y1 = [float(v) for v in match.groups()]
+            return "pdf", abs(x1 - x0), abs(y1 - y0)
+    # e.g. inside a compressed object stream
+    return "pdf", None, None
+
+
+def read_png_info(f):
+    """Check a PNG, and get its size"""
+    header = f.read(24)
+    if not header.startswith(PNG_SIGNATURE) or header[12:16] != b"IHDR":
+        raise ValueError("not a PNG file")
+    width, height = struct.unpack(">II", header[16:24])
+    return "png", float(width), float(height)
+
+
+def read_jpeg_info(f):
+    """Check a JPEG, and get its size from the start of frame segment"""
+    if f.read(2) != b"\xff\xd8":
+        raise ValueError("not a JPEG file")
+    while True:
+        marker = f.read(2)
+        if len(marker) < 2 or marker[0] != 0xff:
+            raise ValueError("JPEG file is corrupt")
+        if marker[1] in (0xd8, 0x01) or 0xd0 <= marker[1] <= 0xd7:
+            # no length
+            continue
+        length = struct.unpack(">H", f.read(2))[0]
+        # SOF0-SOF15, except DHT, JPG & DAC
+        if 0xc0 <= marker[1] <= 0xcf and marker[1] not in (0xc4, 0xc8, 0xcc):
+            height, width = struct.unpack(">xHH", f.read(5))
+            return "jpeg", float(width), float(height)
+        f.seek(length - 2, os.SEEK_CUR)
+
+
+def read_eps_info(f):
+    """Check an EPS, and get its size from its BoundingBox"""
+    header = f.read(1 << 16)
+    # may have a binary header for a preview image
+    if not header.startswith(b"%!PS") and not header.startswith(b"\xc5\xd0\xd3\xc6"):
+        raise ValueError("not a PostScript file")
+    match = BOUNDINGBOX_RE.search(header)
+    if not match:
+        return "eps", None, None
+    x0, y0, x1, y1 = [float(v) for v in match.groups()]
+    return "eps", abs(x1 - x0), abs(y1 - y0)
+
+
+def read_svg_info(f):
+    """Check an SVG, and get its size from its width & height, or its viewBox"""
+    header = f.read(1 << 16)
+    match = SVG_TAG_RE.search(header)
+    if not match:
+        raise ValueError("not an SVG file")
+    tag = match.group(0)
+    lengths = {}
+    for name, value, unit in SVG_LENGTH_RE.findall(tag):
+        lengths[name] = float(value) * SVG_UNITS[unit or b"px"]
+    if len(lengths) == 2:
+        return "svg", lengths[b"width"], lengths[b"height"]
+    match = SVG_VIEWBOX_RE.search(tag)
+    if not match:
+        return "svg", None, None
+    return "svg", float(match.group(1)), float(match.group(2))
+
+
+READERS = {
+    ".pdf": read_pdf_info,
+    ".png": read_png_info,
+    ".jpg": read_jpeg_info,
+    ".jpeg": read_jpeg_info,
+    ".eps": read_eps_info,
+    ".svg": read_svg_info,
+}
+
+
+def read_plot_info(plot_filename):
+    """Check a plot file, and get its format & size.
+
+    Parameters
+    ----------
+    plot_filename : str
+        Name of plot file
+
+    Returns
+    -------
+    dict
+        'format', 'width', 'height', 'aspect' (width/height).
+        Size entries are None if they can't be found, or it's not a known format.
+
+    Raises
+    ------
+    ValueError
+        If the file is missing, unreadable, or not what its extension says
+    """
+    filename = resolve_plot(plot_filename)
+    if not os.path.isfile(filename):
+        raise ValueError("file not found")
+    if os.path.getsize(filename) == 0:
+        raise ValueError("file is empty")
+    reader = READERS.get(os.path.splitext(filename)[1].lower())
+    try:
+        with open(filename, "rb") as f:
+            if reader is None:
+                f.read(1)
+                fmt, width, height = None, None, None
+            else:
+                fmt, width, height = reader(f)
+    except (OSError, struct.error) as err:
+        raise ValueError("can't read file: %s" % err)
+    aspect = width / height if width and height else None
+    return {'format': fmt, 'width': width, 'height': height, 'aspect': aspect}
+
+
+def get_plot_info(plot_filename, index=None):
+    """Get the information from read_plot_info, using the in-memory & index
+    caches when the file hasn't changed.
+
+    Parameters
+    ----------
+    plot_filename : str
+        Name of plot file
+    index : dict, optional
+        Index loaded from file, see load_index. New entries are added to it.
+
+    Returns
+    -------
+    dict
+        As for read_plot_info
+
+    Raises
+    ------
+    ValueError
+        If the plot is bad. Bad plots aren't cached.
+    """
+    filename = resolve_plot(plot_filename)
+    try:
+        st = os.stat(filename)
+    except OSError:
+        raise ValueError("file not found")
+    key = (os.path.abspath(filename), st.st_mtime, st.st_size)
+    if key in _plot_info:
+        return _plot_info[key]
+    entry = index.get(key[0]) if index is not None else None
+    if entry and entry['mtime'] == st.st_mtime and entry['size'] == st.st_size:
+        info = entry['info']
+    else:
+        info = read_plot_info(filename)
+        if index is not None:
+            index[key[0]] = {'mtime': st.st_mtime, 'size': st.st_size, 'info': info}
+    _plot_info[key] = info
+    return info
+
+
+def get_aspect(plot_filenames, default):
+    """Get the average aspect ratio (width/height) of some plots,
+    rounded so that similar plots give the same value.
+
+    Parameters
+    ----------
+    plot_filenames : list[str]
+        Plot files
+    default : float
+        Aspect ratio to use if none of the plots' sizes are known
+
+    Returns
+    -------
+    float
+    """
+    aspects = []
+    for plot_filename in plot_filenames:
+        try:
+            aspect = get_plot_info(plot_filename)['aspect']
+        except ValueError:
+            continue
+        if aspect:
+            aspects.append(aspect)
+    if not aspects:
+        return default
+    return round(sum(aspects) / len(aspects), 2)
+
+
+def load_index(index_filename):
+    """Load the plot index, or an empty one if it's missing or unreadable"""
+    if index_filename and os.path.isfile(index_filename):
+        try:
+            with open(index_filename) as f:
+                return json.load(f)
+        except ValueError:
+            log.warning("Ignoring corrupt plot index %s", index_filename)
+    return {}
+
+
+def save_index(index_filename, index):
+    """Save the plot index, under a temporary name first so that
+    simultaneous builds never see a partial file"""
+    dirname = os.path.dirname(index_filename)
+    if dirname:
+        artifact_cache.make_shared_dir(dirname)
+    tmp_filename = "%s.%d.tmp" % (index_filename, os.getpid())
+    with open(tmp_filename, "w") as f:
+        json.dump(index, f)
+    try:
+        # others sharing the cache can add to it too
+        os.chmod(tmp_filename, artifact_cache.FILE_MODE)
+    except OSError:
+        pass
+    os.rename(tmp_filename, index_filename)
+
+
+def check_plot(plot_filename, index=None):
+    """Check a plot, see get_plot_info
+
+    Returns
+    -------
+    str
+        What's wrong with it, or None if it's OK
+    """
+    try:
+        get_plot_info(plot_filename, index)
+        return None
+    except ValueError as err:
+        return str(err)
+
+
+def save_index_if_changed(index_filename, index, original_index):
+    """Save the plot index if any plots were added, warning if it can't be"""
+    if index != original_index:
+        try:
+            save_index(index_filename, index)
+        except OSError as err:
+            log.warning("Couldn't save plot index %s: %s", index_filename, err)
+
+
+def check_plots(slides, index_filename=None, jobs=None):
+    """Check all the plots in the slides, simultaneously.
+
+    Parameters
+    ----------
+    slides : list[dict]
+        Contents of each slide
+    index_filename : str, optional
+        File to store plot information in. Default is in the artifact cache directory.
+    jobs : int, optional
+        Number of plots to check simultaneously. Default is 4 per CPU,
+        since this is mostly waiting for the disk.
+
+    Returns
+    -------
+    list[(int, str, str)]
+        Slide index, plot filename and problem, for each bad plot
+    """
+    index_filename = index_filename or get_default_index_filename()
+    index = load_index(index_filename)
+    original_index = dict(index)
+
+    filenames = sorted(set(plot[0] for slide in slides for plot in slide.get('plots', [])))
+    with ThreadPoolExecutor(max_workers=jobs or 4 * (os.cpu_count() or 1)) as pool:
+        results = dict(zip(filenames, pool.map(lambda f: check_plot(f, index), filenames)))
+    log.debug("Checked %d plots", len(filenames))
+    save_index_if_changed(index_filename, index, original_index)
+
+    problems = []
+    for i, slide in enumerate(slides):
+        for plot in slide.get('plots', []):
+            if results[plot[0]] is not None:
+                problems.append((i, plot[0], results[plot[0]]))
+    return problems
+
+
+def iter_checked_slides(slides, skip_bad_slides=False, index_filename=None, jobs=None, kept_indices=None):
+    """Check each slide's plots as it is read, for slides that aren't all in
+    memory, see check_plots. Each plot is only checked the first time it's used.
+
+    Parameters
+    ----------
+    slides : iterable[dict]
+        Contents of each slide
+    skip_bad_slides : bool, optional
+        Leave out slides with bad plots, rather than raising PlotError
+    index_filename : str, optional
+        File to store plot information in. Default is in the artifact cache directory.
+    jobs : int, optional
+        Number of plots on a slide to check simultaneously, as for check_plots
+    kept_indices : list, optional
+        If given, the index of each slide that is yielded is added to it
+
+    Yields
+    ------
+    dict
+        Contents of each slide
+
+    Raises
+    ------
+    PlotError
+        At the first slide with bad plots, unless skip_bad_slides
+    """
+    index_filename = index_filename or get_default_index_filename()
+    index = load_index(index_filename)
+    original_index = dict(index)
+    results = {}
+    try:
+        with ThreadPoolExecutor(max_workers=jobs or 4 * (os.cpu_count() or 1)) as pool:
+            for i, slide in enumerate(slides):
+                filenames = sorted(set(plot[0] for plot in slide.get('plots', [])) - set(results))
+                results.update(zip(filenames, pool.map(lambda f: check_plot(f, index), filenames)))
+                problems = [(i, plot[0], results[plot[0]]) for plot in slide.get('plots', [])
+                            if results[plot[0]] is not None]
+                if problems and not skip_bad_slides:
+                    raise PlotError(problems)
+                for _, plot_filename, problem in problems:
+                    log.error("Skipping slides[%d] (%s): %s: %s", i, slide.get('title', ''), plot_filename, problem)
+                if not problems:
+                    if kept_indices is not None:
+                        kept_indices.append(i)
+                    yield slide
+        log.debug("Checked %d plots", len(results))
+    finally:
+        save_index_if_changed(index_filename, index, original_index)
@@ -0,0 +1,492 @@
+"""
+Preprocessing of plot files before they go into the deck.
+
+Large vector PDFs (e.g. scatter plots with millions of points) are slow for
+latex to embed and make huge decks. These can be converted into a rasterised
+PNG, or a re-written (optimised) PDF, using ghostscript. Converted files are
+stored in the artifact cache (see artifact_cache) under a hash of the
+original file's contents & the version of the program that converted it,
+so they are only remade when the original changes.
+
+EPS and SVG plots are converted to PDF up front in the same way, so latex
+doesn't have to convert each EPS every time it is included, and SVGs can be
+used at all. If an EPS can't be converted it is left for latex to convert,
+but an SVG that can't be converted is an error.
+
+Also has helpers for comparing plots, by contents or by low-resolution renderings.
+"""
+
+
+import collections
+import hashlib
+import logging
+import os
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+import artifact_cache
+import plot_metadata
+
+
+log = logging.getLogger(__name__)
+
+
+# Hashes of files we've already read, keyed by (filename, mtime, size)
+_digests = {}
+
+# Programs to convert each format to PDF, in order of preference.
+# {input} & {output} are replaced by the filenames.
+CONVERTERS = {
+    'eps': [
+        ["epstopdf", "--outfile={output}", "{input}"],
+        ["ps2pdf", "-dEPSCrop", "{input}", "{output}"],
+    ],
+    'svg': [
+        ["rsvg-convert", "-f", "pdf", "-o", "{output}", "{input}"],
+        ["inkscape", "{input}", "--export-type=pdf", "--export-filename={output}"],
+    ],
+}
+
+# Formats latex can use itself (slowly), if they can't be converted
+LATEX_FORMATS = {'eps'}
+
+# When converting slides that are read one at a time, how many slides
+# (per job) to read ahead, so there are always conversions to be done
+CONVERT_LOOKAHEAD = 4
+
+
+def get_default_cache_dir():
+    """Get the directory to store processed plots in"""
+    return artifact_cache.get_cache().get_dir("plots")
+
+
+def file_digest(filename):
+    """Get a hash of a file's contents.
+
+    Results are remembered, and only recalculated if the file's mtime or size changes.
+
+    Parameters
+    ----------
+    filename : str
+        Name of file
+
+    Returns
+    -------
+    str
+    """
+    st = os.stat(filename)
+    key = (os.path.abspath(filename), st.st_mtime, st.st_size)
+    if key not in _digests:
+        h = hashlib.sha1()
+        with open(filename, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        _digests[key] = h.hexdigest()
+    return _digests[key]
+
+
+def rasterise_plot(plot_filename, output_filename, dpi=150, device="png16m"):
+    """Convert the first page of a PDF into an image
+
+    Parameters
+    ----------
+    plot_filename : str
+        Name of PDF file
+    output_filename : str
+        Name of image file to make
+    dpi : int, optional
+        Resolution of image
+    device : str, optional
+        Ghostscript output device, e.g. png16m for PNG, pgmraw for greyscale PGM
+    """
+    args = ["gs", "-q", "-dSAFER", "-dBATCH", "-dNOPAUSE", "-dUseCropBox",
+            "-dFirstPage=1", "-dLastPage=1",
+            "-dTextAlphaBits=4", "-dGraphicsAlphaBits=4",
+            "-sDEVICE=%s" % device, "-r%d" % dpi,
+            "-sOutputFile=%s" % output_filename, plot_filename]
+    log.debug(" ".join(args))
+    subprocess.check_call(args)
+
+
+def optimise_plot(plot_filename, output_filename):
+    """Rewrite a PDF, compressing its contents & removing anything unused
+
+    Parameters
+    ----------
+    plot_filename : str
+        Name of PDF file
+    output_filename : str
+        Name of PDF file to make
+    """
+    args = ["gs", "-q", "-dSAFER", "-dBATCH", "-dNOPAUSE",
+            "-sDEVICE=pdfwrite", "-dCompatibilityLevel=1.5",
+            "-dPDFSETTINGS=/prepress", "-dDetectDuplicateImages=true",
+            "-sOutputFile=%s" % output_filename, plot_filename]
+    log.debug(" ".join(args))
+    subprocess.check_call(args)
+
+
+def get_converter(fmt):
+    """Get the command to convert a format to PDF, from the first of its
+    CONVERTERS that is installed, or None if none are"""
+    for args in CONVERTERS.get(fmt, []):
+        if shutil.which(args[0]):
+            return args
+    return None
+
+
+def convert_plot(plot_filename, fmt, cache_dir):
+    """Get a PDF version of a plot, making it if it isn't in the cache.
+
+    Parameters
+    ----------
+    plot_filename : str
+        Name of plot file
+    fmt : str
+        Its format, one of the keys of CONVERTERS
+    cache_dir : str
+        Directory to store converted plots in
+
+    Returns
+    -------
+    str
+        Name of the PDF, or the original if converting failed and latex
+        can use it as it is (see LATEX_FORMATS)
+
+    Raises
+    ------
+    ValueError
+        If it can't be converted, and latex can't use it as it is
+    """
+    converter = get_converter(fmt)
+    if converter is None:
+        problem = "can't convert to PDF, install one of %s" % ", ".join(args[0] for args in CONVERTERS[fmt])
+        if fmt not in LATEX_FORMATS:
+            raise ValueError(problem)
+        log.warning("%s: %s", plot_filename, problem)
+        return plot_filename
+    cached_filename = os.path.join(os.path.abspath(cache_dir), "%s-converted-%s.pdf"
+                                   % (file_digest(plot_filename), artifact_cache.get_tool_tag(converter[0])))
+    if artifact_cache.get_cache().lookup(cached_filename):
+        return cached_filename
+    tmp_filename = "%s.%d.tmp.pdf" % (cached_filename[:-4], os.getpid())
+    args = [a.format(input=plot_filename, output=tmp_filename) for a in converter]
+    log.debug(" ".join(args))
+    try:
+        subprocess.check_call(args, stdout=subprocess.DEVNULL)
+        artifact_cache.get_cache().store(tmp_filename, cached_filename)
+    except (OSError, subprocess.CalledProcessError) as err:
+        if os.path.isfile(tmp_filename):
+            os.remove(tmp_filename)
+        if fmt not in LATEX_FORMATS:
+            raise ValueError("failed to convert to PDF: %s" % err)
+        log.warning("Failed to convert %s to PDF, using original: %s", plot_filename, err)
+        return plot_filename
+    log.debug("Converted %s -> %s", plot_filename, cached_filename)
+    return cached_filename
+
+
+def get_plot_format(plot_filename):
+    """Get the format of a plot, or None if it's unknown or the plot is bad"""
+    try:
+        return plot_metadata.get_plot_info(plot_filename)['format']
+    except ValueError:
+        return None
+
+
+def preprocess_plot(plot_filename, mode, cache_dir, dpi=150):
+    """Get the processed version of a plot, making it if it isn't in the cache.
+
+    Parameters
+    ----------
+    plot_filename : str
+        Name of PDF file
+    mode : str
+        'raster' to convert to PNG, 'optimise' to rewrite the PDF
+    cache_dir : str
+        Directory to store processed plots in
+    dpi : int, optional
+        Resolution for rasterising
+
+    Returns
+    -------
+    str
+        Name of the processed file, or the original if processing failed
+    """
+    if mode == 'raster':
+        cached_name = "%s-raster%d-%s.png" % (file_digest(plot_filename), dpi, artifact_cache.get_tool_tag("gs"))
+        process = lambda out: rasterise_plot(plot_filename, out, dpi)
+    elif mode == 'optimise':
+        cached_name = "%s-optimised-%s.pdf" % (file_digest(plot_filename), artifact_cache.get_tool_tag("gs"))
+        process = lambda out: optimise_plot(plot_filename, out)
+    else:
+        raise ValueError("Unknown preprocessing mode %s" % mode)
+
+    cached_filename = os.path.join(os.path.abspath(cache_dir), cached_name)
+    if artifact_cache.get_cache().lookup(cached_filename):
+        return cached_filename
+    # Make it under a temporary name, so a failed or concurrent conversion
+    # never leaves a partial file under the real name
+    base, ext = os.path.splitext(cached_filename)
+    tmp_filename = "%s.%d.tmp%s" % (base, os.getpid(), ext)
+    try:
+        process(tmp_filename)
+        artifact_cache.get_cache().store(tmp_filename, cached_filename)
+    except (OSError, subprocess.CalledProcessError) as err:
+        log.warning("Failed to preprocess %s, using original: %s", plot_filename, err)
+        if os.path.isfile(tmp_filename):
+            os.remove(tmp_filename)
+        return plot_filename
+    log.debug("Preprocessed %s -> %s", plot_filename, cached_filename)
+    return cached_filename
+
+
+def read_pgm(filename):
+    """Read a binary greyscale PGM image
+
+    Parameters
+    ----------
+    filename : str
+        Name of PGM file
+
+    Returns
+    -------
+    int, int, bytes
+        Width, height, and one byte per pixel
+    """
+    with open(filename, "rb") as f:
+        data = f.read()
+    # header is: P5 <width> <height> <maxval>, separated by whitespace,
+    # possibly with comments, then a single whitespace before the pixels
+    fields = []
+    pos = 0
+    while len(fields) < 4:
+        while data[pos:pos + 1].isspace():
+            pos += 1
+        if data[pos:pos + 1] == b"#":
+            pos = data.index(b"\n", pos)
+            continue
+        end = pos
+        while not data[end:end + 1].isspace():
+            end += 1
+        fields.append(data[pos:end])
+        pos = end
+    if fields[0] != b"P5" or int(fields[3]) > 255:
+        raise ValueError("%s is not an 8-bit binary PGM" % filename)
+    width, height = int(fields[1]), int(fields[2])
+    pixels = data[pos + 1:pos + 1 + width * height]
+    return width, height, pixels
+
+
+def get_plot_pixels(plot_filename, dpi=30, cache_dir=None):
+    """Get a low-resolution greyscale rendering of a plot, for comparing plots.
+    The rendering is cached.
+
+    Returns
+    -------
+    int, int, bytes
+        Width, height, and one byte per pixel
+    """
+    cache_dir = cache_dir or get_default_cache_dir()
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    cached_filename = os.path.join(cache_dir, "%s-grey%d-%s.pgm"
+                                   % (file_digest(plot_filename), dpi, artifact_cache.get_tool_tag("gs")))
+    if not artifact_cache.get_cache().lookup(cached_filename):
+        tmp_filename = "%s.%d.tmp" % (cached_filename, os.getpid())
+        rasterise_plot(plot_filename, tmp_filename, dpi, device="pgmraw")
+        artifact_cache.get_cache().store(tmp_filename, cached_filename)
+    return read_pgm(cached_filename)
+
+
+def pixel_difference(pixels_a, pixels_b, tolerance=16):
+    """Get the fraction of pixels that differ between two renderings
+
+    Parameters
+    ----------
+    pixels_a, pixels_b : (int, int, bytes)
+        Renderings from get_plot_pixels
+    tolerance : int, optional
+        Greyscale difference below which pixels count as the same,
+        to ignore antialiasing noise
+
+    Returns
+    -------
+    float
+        Between 0 (identical) and 1. Renderings of different sizes give 1.
+    """
+    if pixels_a[:2] != pixels_b[:2]:
+        return 1.
+    a, b = pixels_a[2], pixels_b[2]
+    if a == b:
+        return 0.
+    n_diff = sum(1 for x, y in zip(a, b) if abs(x - y) > tolerance)
+    return n_diff / float(max(len(a), 1))
+
+
+def preprocess_slides(slides, mode='raster', threshold=1 << 20, dpi=150,
+                      cache_dir=None, jobs=None):
+    """Replace large PDF plots in all slides with processed versions.
+
+    Parameters
+    ----------
+    slides : iterable[dict]
+        Contents of each slide
+    mode : str, optional
+        'raster' to convert to PNG, 'optimise' to rewrite the PDF
+    threshold : int, optional
+        Only process PDFs bigger than this many bytes
+    dpi : int, optional
+        Resolution for rasterising
+    cache_dir : str, optional
+        Directory to store processed plots in. Default is in the user's cache directory.
+    jobs : int, optional
+        Number of plots to process simultaneously. Default is the number of CPUs.
+
+    Returns
+    -------
+    list[dict]
+        Contents of each slide, with plot filenames replaced
+    """
+    slides = list(slides)
+    cache_dir = cache_dir or get_default_cache_dir()
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+
+    to_process = set()
+    for slide in slides:
+        for plot in slide.get('plots', []):
+            filename = plot[0]
+            if (filename.lower().endswith(".pdf") and os.path.isfile(filename)
+                    and os.path.getsize(filename) > threshold):
+                to_process.add(filename)
+    if not to_process:
+        return slides
+
+    log.info("Preprocessing %d large plots", len(to_process))
+    with ThreadPoolExecutor(max_workers=jobs or os.cpu_count()) as pool:
+        to_process = sorted(to_process)
+        processed = dict(zip(to_process,
+                             pool.map(lambda f: preprocess_plot(f, mode, cache_dir, dpi), to_process)))
+
+    new_slides = []
+    for slide in slides:
+        if slide.get('plots'):
+            slide = dict(slide)
+            slide['plots'] = [[processed.get(plot[0], plot[0])] + list(plot[1:])
+                              for plot in slide['plots']]
+        new_slides.append(slide)
+    return new_slides
+
+
+def _replace_plots(slide, replacements):
+    """Get a slide with its plot filenames replaced, if any of them are in replacements"""
+    if not any(plot[0] in replacements for plot in slide.get('plots', [])):
+        return slide
+    slide = dict(slide)
+    slide['plots'] = [[replacements.get(plot[0], plot[0])] + list(plot[1:]) for plot in slide['plots']]
+    return slide
+
+
+def _convert_slide_plot(plot_filename, cache_dir):
+    """Convert a plot from a slide if it needs it, see convert_plot
+
+    Returns
+    -------
+    str, str
+        Filename to use, and what's wrong with the plot (or None)
+    """
+    fmt = get_plot_format(plot_filename)
+    if fmt not in CONVERTERS:
+        return plot_filename, None
+    try:
+        return convert_plot(plot_metadata.resolve_plot(plot_filename), fmt, cache_dir), None
+    except ValueError as err:
+        return plot_filename, str(err)
+
+
+def convert_slides(slides, cache_dir=None, jobs=None):
+    """Replace EPS & SVG plots in all slides with PDF versions, converting
+    them simultaneously. Other plots are left as they are.
+
+    Parameters
+    ----------
+    slides : iterable[dict]
+        Contents of each slide. If this is a list, all the plots are converted
+        in one go. Otherwise, each slide's plots start being converted as it
+        is read, and slides are given out once their plots are done, so only
+        a few slides are in memory at once (see CONVERT_LOOKAHEAD).
+    cache_dir : str, optional
+        Directory to store converted plots in. Default is in the user's cache directory.
+    jobs : int, optional
+        Number of plots to convert simultaneously. Default is the number of CPUs.
+
+    Returns
+    -------
+    iterable[dict]
+        Contents of each slide, with plot filenames replaced.
+        A list if slides was a list.
+
+    Raises
+    ------
+    plot_metadata.PlotError
+        If any plots can't be converted, and latex can't use them as they are.
+        If slides isn't a list, this is raised when the slide is reached.
+    """
+    cache_dir = cache_dir or get_default_cache_dir()
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir, exist_ok=True)
+    jobs = jobs or os.cpu_count() or 1
+
+    if not isinstance(slides, list):
+        return _iter_converted_slides(slides, cache_dir, jobs)
+
+    filenames = set(plot[0] for slide in slides for plot in slide.get('plots', []))
+    # plots can be given with or without their extension
+    resolved = {f: plot_metadata.resolve_plot(f) for f in filenames if get_plot_format(f) in CONVERTERS}
+    to_convert = sorted(set(resolved.values()))
+    if not to_convert:
+        return slides
+
+    log.info("Converting %d EPS/SVG plots to PDF", len(to_convert))
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        converted = dict(zip(to_convert, pool.map(lambda f: _convert_slide_plot(f, cache_dir), to_convert)))
+    problems = [(i, plot[0], converted[resolved[plot[0]]][1])
+                for i, slide in enumerate(slides) for plot in slide.get('plots', [])
+                if plot[0] in resolved and converted[resolved[plot[0]]][1] is not None]
+    if problems:
+        raise plot_metadata.PlotError(problems)
+    converted = {f: converted[r][0] for f, r in resolved.items()}
+    return [_replace_plots(slide, converted) for slide in slides]
+
+
+def _iter_converted_slides(slides, cache_dir, jobs):
+    """convert_slides for slides that aren't a list"""
+    # conversion of each plot, keyed by resolved filename
+    futures = {}
+    resolved = {}
+    # slides read but not given out yet
+    pending = collections.deque()
+
+    def finish(i, slide):
+        converted = {}
+        for plot in slide.get('plots', []):
+            filename, problem = futures[resolved[plot[0]]].result()
+            if problem is not None:
+                raise plot_metadata.PlotError([(i, plot[0], problem)])
+            if filename != plot[0]:
+                converted[plot[0]] = filename
+        return _replace_plots(slide, converted)
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        for i, slide in enumerate(slides):
+            for plot in slide.get('plots', []):
+                if plot[0] not in resolved:
+                    resolved[plot[0]] = plot_metadata.resolve_plot(plot[0])
+                    if resolved[plot[0]] not in futures:
+                        futures[resolved[plot[0]]] = pool.submit(_convert_slide_plot, resolved[plot[0]], cache_dir)
+            pending.append((i, slide))
+            if len(pending) > CONVERT_LOOKAHEAD * jobs:
+                yield finish(*pending.popleft())
+        while pending:
+            yield finish(*pending.popleft())
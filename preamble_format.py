@@ -0,0 +1,118 @@
+"""
+Precompiled preamble: dump the static part of a template's preamble
+(documentclass, packages, ...) into a TeX format file, so that each compilation
+doesn't need to load everything from scratch.
+
+Uses the mylatexformat package. The format is stored in the artifact cache
+(see artifact_cache) under a hash of the dumped part of the template & the
+latex version, so it gets rebuilt whenever either changes.
+
+Fonts set up with fontspec can't be dumped with LuaTeX (luaotfload keeps its
+state in Lua), so dumping stops before any font setup, or before the first line
+with a placeholder like @TITLE, whichever is first. The rest of the preamble is
+read as normal on each run.
+"""
+
+
+import hashlib
+import logging
+import os
+import re
+import subprocess
+import artifact_cache
+
+
+log = logging.getLogger(__name__)
+
+
+# Put this in the main TeX file where the format stops.
+# Without a format it does nothing, so the file still compiles normally.
+DUMP_MARKER = "\\csname endofdump\\endcsname\n"
+
+# Lines that can't go into the format
+NO_DUMP_RE = re.compile(r"fontspec|unicode-math|\\set(main|sans|mono)font|\\begin{document}|@[A-Z]")
+
+
+def get_default_cache_dir():
+    """Get the directory to store format files in"""
+    return artifact_cache.get_cache().get_dir("formats")
+
+
+def get_dump_line(template_filename):
+    """Get the index of the first template line that shouldn't go in the format
+
+    Parameters
+    ----------
+    template_filename : str
+        Name of beamer template tex file
+
+    Returns
+    -------
+    int
+    """
+    with open(template_filename) as f:
+        lines = f.readlines()
+    for i, line in enumerate(lines):
+        if NO_DUMP_RE.search(line.split("%")[0]):
+            return i
+    return len(lines)
+
+
+def make_format(template_filename, latex_cmd='lualatex', cache_dir=None):
+    """Get a format file with the template preamble, making it if necessary.
+
+    Parameters
+    ----------
+    template_filename : str
+        Name of beamer template tex file
+    latex_cmd : str, optional
+        Which latex command the format is for.
+    cache_dir : str, optional
+        Where to store format files. Default is in the user's cache directory.
+
+    Returns
+    -------
+    str
+        Path to format, without the .fmt extension, suitable for -fmt.
+        None if the format could not be made.
+    """
+    cache_dir = cache_dir or get_default_cache_dir()
+    with open(template_filename) as f:
+        lines = f.readlines()
+    dumped = "".join(lines[:get_dump_line(template_filename)])
+    version = artifact_cache.get_tool_version(latex_cmd) or ""
+    key = hashlib.sha1((latex_cmd + "\n" + version + "\n" + dumped).encode()).hexdigest()[:16]
+    fmt_name = os.path.join(os.path.abspath(cache_dir), "preamble-" + key)
+    if artifact_cache.get_cache().lookup(fmt_name + ".fmt"):
+        log.debug("Using cached format %s.fmt", fmt_name)
+        return fmt_name
+
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    log.info("Making precompiled preamble %s.fmt", fmt_name)
+    # Made under a temporary name, in case another build is making it too
+    tmp_name = "%s-%d" % (fmt_name, os.getpid())
+    with open(tmp_name + ".tex", "w") as f:
+        f.write(dumped)
+        f.write(DUMP_MARKER)
+        f.write("\\begin{document}\n\\end{document}\n")
+    args = [latex_cmd, "-ini", "-interaction=batchmode",
+            "-output-directory=%s" % os.path.dirname(tmp_name),
+            "-jobname=%s" % os.path.basename(tmp_name),
+            "&%s" % latex_cmd, "mylatexformat.ltx", tmp_name + ".tex"]
+    log.debug(' '.join(args))
+    ret = subprocess.call(args)
+    os.remove(tmp_name + ".tex")
+    if ret != 0 or not os.path.isfile(tmp_name + ".fmt"):
+        log.warning("Failed to make precompiled preamble, see %s.log. "
+                    "Is the mylatexformat package installed?", tmp_name)
+        return None
+    if os.path.isfile(tmp_name + ".log"):
+        os.remove(tmp_name + ".log")
+    try:
+        artifact_cache.get_cache().store(tmp_name + ".fmt", fmt_name + ".fmt")
+    except OSError as err:
+        log.warning("Couldn't add precompiled preamble to the cache, not using it: %s", err)
+        os.remove(tmp_name + ".fmt")
+        return None
+    return fmt_name
@@ -0,0 +1,506 @@
+"""
+Piecewise builds: the deck is split into pieces, each compiled as its own
+standalone PDF, and cached under a hash of its contents & plots.
+The final deck is stitched together from the cached pieces.
+
+This gives:
+
+- incremental builds: one slide per piece, so only slides whose hash has
+  changed get recompiled,
+- parallel builds: pieces are compiled simultaneously in a process pool.
+
+The title page & table of contents are compiled as a separate "front" piece,
+and each slide piece has its page number set explicitly, so numbering & the
+TOC are the same as for a normal build. A piece's hash doesn't include its
+page number, so once it has been compiled its number of pages is known
+wherever it ends up in the deck; its files are named by the hash & first page.
+
+Compiled pieces are also stored in the shared artifact cache (see
+artifact_cache), under a hash of their TeX & the contents of their plots, so
+a piece compiled for one deck (or by another user) is reused by any other deck
+that has the same slides on the same pages.
+"""
+
+
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+import artifact_cache
+import beamer_slide_templates as bst
+import latex_compile
+import latex_errors
+import pdf_utils
+import plot_metadata
+import plot_processing
+import preamble_format
+import tex_files
+
+
+log = logging.getLogger(__name__)
+
+
+MANIFEST_NAME = "manifest.json"
+
+# Write the slide each page comes from to <jobname>.pages,
+# counting \begin{frame}s, as overlays make several pages from one
+PAGES_TEX = r"""
+\newwrite\piecepages
+\newcounter{pieceslide}
+\ifdefined\AddToHook
+\immediate\openout\piecepages=\jobname.pages
+\AddToHook{env/frame/before}{\stepcounter{pieceslide}}
+\AddToHook{shipout/after}{\immediate\write\piecepages{\arabic{pieceslide}}}
+\fi
+"""
+
+
+def get_cache_dir(out_stem):
+    """Get the cache directory for a given output stem"""
+    return out_stem + "_cache"
+
+
+def get_template_preamble(template_filename, front_dict, dump_line=None, draft=False):
+    """Get everything in the template before \\begin{document},
+    with the title etc filled in.
+
+    Parameters
+    ----------
+    template_filename : str
+        Name of beamer template tex file
+    front_dict : dict
+        Title page contents
+    dump_line : int, optional
+        If using a precompiled preamble, index of the template line where it ends
+    draft : bool, optional
+        Show plots as boxes of the same size, see tex_files.DRAFT_TEX
+
+    Returns
+    -------
+    str
+    """
+    with open(template_filename) as f:
+        lines = f.readlines()
+    if dump_line is not None:
+        lines.insert(dump_line, preamble_format.DUMP_MARKER)
+    contents = "".join(lines)
+    match = re.search(r"^\s*\\begin{document}", contents, re.MULTILINE)
+    if not match:
+        raise RuntimeError("Cannot find \\begin{document} in template %s" % template_filename)
+    preamble = contents[:match.start()]
+    for k in ['title', 'subtitle', 'author']:
+        preamble = preamble.replace("@" + k.upper(), front_dict.get(k, ''))
+    if draft:
+        preamble += tex_files.DRAFT_TEX
+    return preamble
+
+
+def plot_stats(slide):
+    """Get (filename, mtime, size) for each plot in a slide, so that the hash
+    changes if any plot file changes. Missing files get None."""
+    stats = []
+    for plot in slide.get('plots', []):
+        try:
+            st = os.stat(plot[0])
+            stats.append([plot[0], st.st_mtime, st.st_size])
+        except OSError:
+            stats.append([plot[0], None, None])
+    return stats
+
+
+def hash_contents(*contents):
+    """Get a hash of some JSON-serialisable contents"""
+    return hashlib.sha1(json.dumps(contents, sort_keys=True).encode()).hexdigest()
+
+
+def load_manifest(cache_dir):
+    """Load the manifest of cached pieces, mapping hash to the number of pages of each slide"""
+    manifest_file = os.path.join(cache_dir, MANIFEST_NAME)
+    if not os.path.isfile(manifest_file):
+        return {}
+    with open(manifest_file) as f:
+        manifest = json.load(f)
+    # ignore entries from older versions, which only had the total
+    return {k: v for k, v in manifest.items() if isinstance(v, list)}
+
+
+def save_manifest(cache_dir, manifest, names):
+    """Save the manifest of cached pieces, and remove any stale pieces,
+    i.e. those not named in names"""
+    with open(os.path.join(cache_dir, MANIFEST_NAME), "w") as f:
+        json.dump(manifest, f, indent=2)
+    for filename in os.listdir(cache_dir):
+        stem, ext = os.path.splitext(filename)
+        if ext in (".pdf", ".pages") and stem not in names:
+            log.debug("Removing stale piece %s", filename)
+            os.remove(os.path.join(cache_dir, filename))
+
+
+def has_section(slide):
+    """Whether a slide starts a new section, i.e. appears in the TOC"""
+    return tex_files.choose_slide_template(slide) != bst.only_title_slide
+
+
+class Piece(object):
+    """A standalone document making up part of the deck: either the front
+    (title page & TOC), or a run of slides starting at a given page number.
+
+    Parameters
+    ----------
+    key : str
+        Hash of everything that goes into the piece, apart from its page number
+    slides : list[dict]
+        Slides in this piece. Ignored for the front piece.
+    first_page : int
+        Page number of the first slide in the piece
+    front : bool, optional
+        Whether this is the front piece
+    first_index : int, optional
+        Index in the configuration of the first slide in the piece
+    first_frame : int, optional
+        Frame number of the first slide in the piece.
+        Differs from the page number when slides have overlays.
+    """
+
+    def __init__(self, key, slides, first_page, front=False, first_index=0, first_frame=1):
+        self.key = key
+        # name of its files in the cache directory
+        self.name = "%s-%d-%d" % (key, first_page, first_frame)
+        self.slides = slides
+        self.first_page = first_page
+        self.first_frame = first_frame
+        self.front = front
+        self.first_index = first_index
+        # line each slide starts at in its TeX file, once written
+        self.line_offsets = []
+
+
+def write_front_piece(template_filename, cache_dir, name, config_dict, do_toc, dump_line=None):
+    """Write the TeX for the title page & table of contents.
+
+    The slides file only contains the section commands, which is enough for the TOC.
+    """
+    front_dict = config_dict['frontpage']
+    slides = config_dict['slides']
+    stem = os.path.join(cache_dir, name)
+    tex_files.make_main_tex_file(template_filename,
+                                 front_dict.get('title', ''),
+                                 front_dict.get('subtitle', ''),
+                                 front_dict.get('author', ''),
+                                 stem + ".tex",
+                                 stem + "_input.tex",
+                                 tex_files.get_toc_tex(do_toc, n_slides=len(slides)),
+                                 dump_line)
+    with open(stem + "_input.tex", "w") as f:
+        for slide in slides:
+            if has_section(slide):
+                f.write("\\section{%s}\n" % slide.get('title', ''))
+
+
+def write_slide_piece(preamble, cache_dir, name, slides, first_page, first_frame):
+    """Write the TeX for a standalone document of some slides,
+    starting at page number first_page & frame number first_frame.
+
+    The slide each page comes from is written to a .pages file,
+    see get_slide_pages.
+
+    Returns
+    -------
+    list[int]
+        Line each slide starts at in the slides TeX file
+    """
+    stem = os.path.join(cache_dir, name)
+    line_offsets = []
+    tex_files.make_slides_tex_file(stem + "_input.tex", slides, line_offsets=line_offsets)
+    with open(stem + ".tex", "w") as f:
+        f.write(preamble)
+        f.write(PAGES_TEX)
+        f.write("\\begin{document}\n")
+        f.write("\\setcounter{page}{%d}\n" % first_page)
+        f.write("\\setcounter{framenumber}{%d}\n" % (first_frame - 1))
+        f.write("\\input{%s}\n" % (stem + "_input.tex"))
+        f.write("\\end{document}\n")
+    return line_offsets
+
+
+def get_slide_pages(stem, n_slides):
+    """Get the number of pages of each slide in a compiled piece.
+
+    Uses the slide of each page from the piece's .pages file. If that is
+    missing or doesn't add up, e.g. for the front piece, or with a latex
+    too old for hooks, all the extra pages are assumed to be in the last slide.
+
+    Returns
+    -------
+    list[int]
+    """
+    n_pages = pdf_utils.count_pages(stem + ".pdf")
+    try:
+        with open(stem + ".pages") as f:
+            page_slides = [int(line) for line in f if line.strip()]
+        slide_pages = [page_slides.count(i + 1) for i in range(n_slides)]
+        if sum(slide_pages) == n_pages and all(slide_pages):
+            return slide_pages
+    except (OSError, ValueError):
+        pass
+    if n_slides > 1:
+        log.debug("Don't know the pages of each slide in %s", stem)
+    return [1] * (n_slides - 1) + [n_pages - n_slides + 1]
+
+
+def compile_piece(cache_dir, name, n_slides=1, num_compilations=1, cleanup=True, verbose=False, fmt=None,
+                  max_memory=None):
+    """Compile a piece, returning the number of pages of each of its slides"""
+    tex_filename = os.path.join(cache_dir, name + ".tex")
+    latex_compile.compile_pdf(tex_filename,
+                              outdir=os.path.abspath(cache_dir),
+                              num_compilations=num_compilations,
+                              cleanup=cleanup,
+                              verbose=verbose,
+                              fmt=fmt,
+                              max_memory=max_memory)
+    pdf_filename = os.path.join(cache_dir, name + ".pdf")
+    if not os.path.isfile(pdf_filename):
+        raise RuntimeError("Failed to compile %s" % tex_filename)
+    return get_slide_pages(os.path.join(cache_dir, name), n_slides)
+
+
+def get_shared_filename(cache_dir, piece, fmt=None):
+    """Get the name a written piece is stored under in the artifact cache.
+
+    This is a hash of its TeX, with the deck's cache directory taken out and
+    each plot's path replaced by a hash of its contents, and the latex version.
+    So it is the same for anyone with the same plots, wherever they are.
+    """
+    stem = os.path.join(cache_dir, piece.name)
+    plot_digests = {}
+    for slide in piece.slides:
+        for plot in slide.get('plots', []):
+            filename = plot_metadata.resolve_plot(plot[0])
+            if os.path.isfile(filename):
+                plot_digests[plot[0]] = plot_processing.file_digest(filename)
+    contents = []
+    for suffix in [".tex", "_input.tex"]:
+        with open(stem + suffix) as f:
+            tex = f.read().replace(stem, "@PIECE")
+        for plot_filename, digest in plot_digests.items():
+            tex = tex.replace("{%s}" % plot_filename, "{@PLOT-%s}" % digest)
+        contents.append(tex)
+    key = hash_contents("piece", contents, artifact_cache.get_tool_version("lualatex"),
+                        os.path.basename(fmt) if fmt else None)
+    return os.path.join(artifact_cache.get_cache().get_dir("pieces"), key + ".pdf")
+
+
+def compile_pieces(cache_dir, pieces, jobs=1, cleanup=True, verbose=False, fmt=None, max_memory=None):
+    """Compile several pieces, using up to jobs processes simultaneously.
+    Pieces in the artifact cache are copied from there instead.
+
+    max_memory (in MB) is for all the latex processes together,
+    so each one running at once gets an equal share of it.
+
+    Returns
+    -------
+    dict
+        Number of pages of each slide, for each piece's key
+    """
+    cache = artifact_cache.get_cache()
+    shared_filenames = {p.name: get_shared_filename(cache_dir, p, fmt) for p in pieces}
+    piece_pages = {}
+    to_compile = []
+    for piece in pieces:
+        stem = os.path.join(cache_dir, piece.name)
+        shared_stem = os.path.splitext(shared_filenames[piece.name])[0]
+        # which slide each page is from only matters with more than one
+        if (cache.fetch(shared_stem + ".pdf", stem + ".pdf")
+                and (len(piece.slides) < 2 or cache.fetch(shared_stem + ".pages", stem + ".pages"))):
+            piece_pages[piece.key] = get_slide_pages(stem, max(1, len(piece.slides)))
+            if cleanup:
+                for suffix in [".tex", "_input.tex"]:
+                    os.remove(stem + suffix)
+        else:
+            to_compile.append(piece)
+    if piece_pages:
+        log.info("Got %d pieces from %s", len(piece_pages), cache.cache_dir)
+
+    if max_memory is not None and jobs > 1 and len(to_compile) > 1:
+        max_memory /= min(jobs, len(to_compile))
+        log.debug("Limiting each latex process to %.0f MB", max_memory)
+    # Front page needs more than one pass for the TOC to be filled
+    compile_args = [(cache_dir, p.name, max(1, len(p.slides)), latex_compile.MAX_COMPILATIONS if p.front else 1,
+                     cleanup, verbose, fmt, max_memory)
+                    for p in to_compile]
+    if jobs == 1 or len(to_compile) <= 1:
+        compiled = [compile_piece(*a) for a in compile_args]
+    else:
+        log.info("Compiling %d pieces using %d processes", len(to_compile), jobs)
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = [pool.submit(compile_piece, *a) for a in compile_args]
+            compiled = [future.result() for future in futures]
+    for piece, slide_pages in zip(to_compile, compiled):
+        piece_pages[piece.key] = slide_pages
+        stem = os.path.join(cache_dir, piece.name)
+        shared_stem = os.path.splitext(shared_filenames[piece.name])[0]
+        try:
+            if len(piece.slides) > 1 and os.path.isfile(stem + ".pages"):
+                cache.store(stem + ".pages", shared_stem + ".pages", copy=True)
+            cache.store(stem + ".pdf", shared_stem + ".pdf", copy=True)
+        except OSError as err:
+            log.warning("Couldn't add piece %s to %s: %s", piece.name, cache.cache_dir, err)
+    return piece_pages
+
+
+def locate_piece_error(err, cache_dir, pieces):
+    """Work out which slides a piece's compilation error came from
+
+    Parameters
+    ----------
+    err : latex_errors.CompileError
+        Error from compiling a piece
+    cache_dir : str
+        Directory the pieces are in
+    pieces : list[Piece]
+        Pieces that were being compiled, including the one that failed
+    """
+    name = os.path.splitext(os.path.basename(err.tex_filename))[0]
+    for piece in pieces:
+        if piece.name == name and not piece.front:
+            err.locate_slides(os.path.join(cache_dir, name + "_input.tex"),
+                              piece.line_offsets, piece.first_index)
+
+
+def plan_pieces(template_contents, preamble, config_dict, do_toc, piece_pages,
+                slides_per_piece=1):
+    """Work out the hash & first page of every piece in the deck.
+
+    Since each piece's page numbers depend on the size of all the pieces before
+    it, we use the known number of pages of each slide in piece_pages, and
+    assume one page per slide (plus one for the TOC) for pieces that have never
+    been compiled. Hashes don't depend on page numbers, so once those pieces are
+    compiled, all the page numbers are right.
+
+    Returns
+    -------
+    list[Piece]
+    """
+    front_dict = config_dict['frontpage']
+    slides = config_dict['slides']
+    sections = [slide.get('title', '') for slide in slides if has_section(slide)]
+    front_key = hash_contents("front", template_contents, front_dict, sections, do_toc)
+    pieces = [Piece(front_key, [], 1, front=True)]
+    # title page & TOC frames
+    n_front_frames = 2 if do_toc else 1
+    n_pages = sum(piece_pages.get(front_key, [n_front_frames]))
+    for i in range(0, len(slides), slides_per_piece):
+        these_slides = slides[i:i + slides_per_piece]
+        key = hash_contents("slides", preamble, these_slides,
+                            [plot_stats(s) for s in these_slides])
+        pieces.append(Piece(key, these_slides, n_pages + 1, first_index=i,
+                            first_frame=n_front_frames + i + 1))
+        n_pages += sum(piece_pages.get(key, [1] * len(these_slides)))
+    return pieces
+
+
+def build_pieces(template_filename, config_dict, out_stem, do_toc, slides_per_piece=1,
+                 jobs=1, cleanup=True, verbose=False, fmt=None, draft=False, max_memory=None):
+    """Build the PDF from separately compiled pieces,
+    only recompiling those that have changed since the last build.
+
+    Parameters
+    ----------
+    template_filename : str
+        Name of beamer template tex file
+    config_dict : dict
+        Configuration, with 'frontpage' and 'slides' entries
+    out_stem : str
+        Stem for output files
+    do_toc : bool
+        Add table of contents
+    slides_per_piece : int, optional
+        Number of slides to put in each piece.
+        If None, split the slides evenly between jobs pieces.
+    jobs : int, optional
+        Number of pieces to compile simultaneously
+    cleanup : bool, optional
+        If True, remove all the non text/pdf files that latex produced
+    verbose : bool, optional
+        If True, show the latex output
+    fmt : str, optional
+        Precompiled preamble format to use, see preamble_format.make_format
+    draft : bool, optional
+        Show plots as boxes of the same size, see tex_files.DRAFT_TEX
+    max_memory : float, optional
+        Memory limit in MB for latex, shared between the processes running
+        at once (see compile_pieces). If a piece goes over its share,
+        the slides are split into pieces half the size & tried again.
+
+    Returns
+    -------
+    str
+        Output PDF filename
+
+    Raises
+    ------
+    latex_errors.MemoryLimitError
+        If a piece of one slide, or the front piece, goes over its share of max_memory
+    """
+    pdf_utils.check_pypdf()
+    cache_dir = get_cache_dir(out_stem)
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    if slides_per_piece is None:
+        slides_per_piece = max(1, int(math.ceil(len(config_dict['slides']) / float(jobs))))
+
+    with open(template_filename) as f:
+        template_contents = f.read()
+    dump_line = preamble_format.get_dump_line(template_filename) if fmt else None
+    preamble = get_template_preamble(template_filename, config_dict['frontpage'], dump_line, draft)
+
+    piece_pages = load_manifest(cache_dir)
+    cached_names = set(os.path.splitext(f)[0] for f in os.listdir(cache_dir) if f.endswith(".pdf"))
+    while True:
+        pieces = plan_pieces(template_contents, preamble, config_dict, do_toc,
+                             piece_pages, slides_per_piece)
+        missing = [p for p in pieces if p.key not in piece_pages
+                   or not os.path.isfile(os.path.join(cache_dir, p.name + ".pdf"))]
+        if not missing:
+            break
+        # If any of these turn out to have a different number of pages to
+        # that assumed, the pieces after it move to other pages, so go round
+        # once more to compile them there
+        for piece in missing:
+            if piece.front:
+                write_front_piece(template_filename, cache_dir, piece.name, config_dict, do_toc, dump_line)
+            else:
+                piece.line_offsets = write_slide_piece(preamble, cache_dir, piece.name, piece.slides,
+                                                       piece.first_page, piece.first_frame)
+        try:
+            piece_pages.update(compile_pieces(cache_dir, missing, jobs, cleanup, verbose, fmt, max_memory))
+        except latex_errors.CompileError as err:
+            locate_piece_error(err, cache_dir, missing)
+            raise
+        except latex_errors.MemoryLimitError as err:
+            if slides_per_piece == 1 or os.path.basename(err.tex_filename) == pieces[0].name + ".tex":
+                raise
+            slides_per_piece = max(1, slides_per_piece // 2)
+            log.warning("%s, trying again with %d slides per piece", err, slides_per_piece)
+
+    n_reused = len([p for p in pieces if p.name in cached_names])
+    log.info("Reused %d of %d cached pieces", n_reused, len(pieces))
+    save_manifest(cache_dir, {p.key: piece_pages[p.key] for p in pieces}, set(p.name for p in pieces))
+
+    bookmarks = []
+    for piece in pieces:
+        page = piece.first_page - 1
+        for slide, n_pages in zip(piece.slides, piece_pages[piece.key]):
+            if has_section(slide):
+                bookmarks.append((slide.get('title', ''), page))
+            page += n_pages
+
+    pdf_filename = out_stem + ".pdf"
+    pdf_utils.merge_pdfs([os.path.join(cache_dir, p.name + ".pdf") for p in pieces],
+                         pdf_filename,
+                         bookmarks=bookmarks)
+    return pdf_filename
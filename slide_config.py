@@ -0,0 +1,363 @@
+"""
+Normalisation of configurations, between reading the JSON and making the TeX:
+checking each entry has the right type, escaping characters that would stop
+latex compiling, and finding the plots.
+
+Text fields are TeX, so can have maths, macros, etc. in them. Escaping only
+touches characters that can't be meant literally where they are:
+
+- % is always escaped (it would comment out the rest of the slide), and so
+  is #, unless the text defines a macro (\\newcommand, \\def, ...) and it is
+  a parameter like #1 or ##1
+- _ and & are escaped outside maths (& is left alone if the text has an
+  environment, e.g. a tabular, that could be using it). Maths is $...$,
+  $$...$$, \\(...\\), \\[...\\], \\ensuremath{...}, or a maths environment
+  like equation.
+- if there is an odd number of $, the last one is escaped
+- anything already escaped is left as it is, as is the first argument of
+  \\url, \\href, etc.
+
+Escaping is memoised, since the same strings (e.g. labels) turn up on many slides.
+
+Plots given relative to the configuration file's directory are found, and any
+whose path has characters TeX can't take in a filename are linked under a safe
+name in the artifact cache directory (see artifact_cache).
+"""
+
+
+import functools
+import hashlib
+import logging
+import os
+import re
+import artifact_cache
+import plot_metadata
+
+
+log = logging.getLogger(__name__)
+
+
+# Allowed entries & their types. Anything else is warned about & ignored.
+FRONTPAGE_SCHEMA = {
+    'title': str,
+    'subtitle': str,
+    'author': str,
+}
+
+SLIDE_SCHEMA = {
+    'title': str,
+    'toptext': str,
+    'bottomtext': str,
+    'plots': list,
+}
+
+# Commands whose first argument is a URL, filename or label, not text
+VERBATIM_COMMANDS = {"url", "href", "includegraphics", "input", "include", "label", "ref",
+                     "eqref", "hyperlink", "hypertarget", "cite"}
+
+# Environments whose contents are maths
+MATH_ENVIRONMENTS = {"equation", "equation*", "align", "align*", "alignat", "alignat*", "gather",
+                     "gather*", "multline", "multline*", "flalign", "flalign*", "eqnarray",
+                     "eqnarray*", "displaymath", "math"}
+
+# Commands that define macros, whose parameters are #1, #2, ...
+DEFINITION_RE = re.compile(r"\\(?:(?:re)?newcommand|providecommand|(?:re)?newenvironment|[egx]?def|"
+                           r"(?:New|Renew|Provide|Declare)DocumentCommand)(?![A-Za-z])")
+
+COMMAND_RE = re.compile(r"\\([A-Za-z@]+)\*?\s*(?:\[[^\]]*\]\s*)?")
+
+# Characters TeX can't take in an \includegraphics filename
+UNSAFE_PATH_RE = re.compile(r"[%#&$\\{}~^]")
+
+
+class ConfigError(ValueError):
+    """An entry in the configuration isn't valid
+
+    Parameters
+    ----------
+    where : str
+        Which entry, e.g. "slides[3].plots[1]"
+    problem : str
+        What's wrong with it
+    """
+
+    def __init__(self, where, problem):
+        super(ConfigError, self).__init__(where, problem)
+        self.where = where
+        self.problem = problem
+
+    def __str__(self):
+        return "Invalid configuration: %s: %s" % (self.where, self.problem)
+
+
+def _skip_group(text, start):
+    """Get the index just after the braced group starting at text[start]"""
+    depth = 0
+    i = start
+    while i < len(text):
+        if text[i] == "\\":
+            i += 2
+            continue
+        if text[i] == "{":
+            depth += 1
+        elif text[i] == "}":
+            depth -= 1
+            if depth == 0:
+                return i + 1
+        i += 1
+    return len(text)
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def escape_tex(text):
+    """Escape the characters in some TeX that would stop it compiling,
+    see the module description.
+
+    Parameters
+    ----------
+    text : str
+        Text to escape
+
+    Returns
+    -------
+    str
+    """
+    if not any(c in text for c in "%#_&$"):
+        return text
+
+    # positions of unescaped $, to find an unmatched one
+    dollars = []
+    i = 0
+    while i < len(text):
+        if text[i] == "\\":
+            i += 2
+            continue
+        if text[i] == "$":
+            dollars.append(i)
+        i += 1
+    unmatched_dollar = dollars[-1] if len(dollars) % 2 else None
+    escape_ampersand = "\\begin{" not in text
+    has_definitions = DEFINITION_RE.search(text) is not None
+
+    out = []
+    # $...$ or $$...$$, then \(, \[ & maths environments (which can be nested),
+    # then the end of any \ensuremath argument
+    in_dollars = False
+    in_double_dollars = False
+    math_depth = 0
+    math_until = 0
+    i = 0
+    while i < len(text):
+        c = text[i]
+        if c == "\\":
+            match = COMMAND_RE.match(text, i)
+            command = match.group(1) if match else text[i + 1:i + 2]
+            if command in ("(", "["):
+                math_depth += 1
+                end = i + 2
+            elif command in (")", "]"):
+                math_depth = max(0, math_depth - 1)
+                end = i + 2
+            elif command in VERBATIM_COMMANDS | {"begin", "end"} and text.startswith("{", match.end()):
+                end = _skip_group(text, match.end())
+                if text[match.end() + 1:end - 1].strip() in MATH_ENVIRONMENTS:
+                    math_depth = math_depth + 1 if command == "begin" else max(0, math_depth - 1)
+            elif command == "ensuremath" and text.startswith("{", match.end()):
+                math_until = max(math_until, _skip_group(text, match.end()))
+                end = match.end()
+            elif match:
+                end = match.end()
+            else:
+                end = i + 2
+            out.append(text[i:end])
+            i = end
+            continue
+        in_math = in_dollars or in_double_dollars or math_depth > 0 or i < math_until
+        if c == "$":
+            if i == unmatched_dollar:
+                out.append("\\$")
+            elif not in_dollars and text.startswith("$", i + 1) and i + 1 != unmatched_dollar:
+                in_double_dollars = not in_double_dollars
+                out.append("$$")
+                i += 2
+                continue
+            else:
+                in_dollars = not in_dollars
+                out.append(c)
+        elif c == "#":
+            # leave macro parameters, e.g. in \newcommand\f[1]{#1}
+            end = i
+            while text.startswith("#", end):
+                end += 1
+            if has_definitions and end < len(text) and text[end].isdigit():
+                out.append(text[i:end + 1])
+                i = end + 1
+                continue
+            out.append("\\#")
+        elif c == "%":
+            out.append("\\%")
+        elif c == "_" and not in_math:
+            out.append("\\_")
+        elif c == "&" and not in_math and escape_ampersand:
+            out.append("\\&")
+        else:
+            out.append(c)
+        i += 1
+    return "".join(out)
+
+
+def get_safe_plot_path(plot_filename, link_dir=None):
+    """Get a path for a plot that TeX can use, linking it under a safe name
+    if its path has special characters in it
+
+    Parameters
+    ----------
+    plot_filename : str
+        Plot file
+    link_dir : str, optional
+        Directory for links. Default is in the artifact cache directory.
+
+    Returns
+    -------
+    str
+    """
+    if not UNSAFE_PATH_RE.search(plot_filename):
+        return plot_filename
+    filename = os.path.abspath(plot_metadata.resolve_plot(plot_filename))
+    if not os.path.isfile(filename):
+        # leave it for the plot check to report
+        return plot_filename
+    if link_dir is None:
+        link_dir = artifact_cache.get_cache().get_dir("links")
+    elif not os.path.isdir(link_dir):
+        os.makedirs(link_dir, exist_ok=True)
+    name = hashlib.sha1(filename.encode()).hexdigest()[:16] + os.path.splitext(filename)[1].lower()
+    link = os.path.join(link_dir, name)
+    if not os.path.islink(link) or os.readlink(link) != filename:
+        tmp_link = "%s.%d.tmp" % (link, os.getpid())
+        os.symlink(filename, tmp_link)
+        os.replace(tmp_link, link)
+    log.debug("Linked %s as %s", plot_filename, link)
+    return link
+
+
+def check_entry(entry, schema, where):
+    """Check an entry's fields against a schema, turning numbers into strings
+
+    Returns
+    -------
+    dict
+        The entry's known fields
+
+    Raises
+    ------
+    ConfigError
+        If a field has the wrong type
+    """
+    if not isinstance(entry, dict):
+        raise ConfigError(where, "expected an object, got %s" % type(entry).__name__)
+    checked = {}
+    for key, value in entry.items():
+        expected = schema.get(key)
+        if expected is None:
+            log.warning("Ignoring unknown entry %s.%s", where, key)
+            continue
+        if expected is str and isinstance(value, (int, float)) and not isinstance(value, bool):
+            value = str(value)
+        if not isinstance(value, expected):
+            raise ConfigError("%s.%s" % (where, key),
+                              "expected %s, got %s" % (expected.__name__, type(value).__name__))
+        checked[key] = value
+    return checked
+
+
+def normalise_frontpage(front_dict):
+    """Check & escape the title page contents
+
+    Parameters
+    ----------
+    front_dict : dict
+        Title page contents from the configuration
+
+    Returns
+    -------
+    dict
+
+    Raises
+    ------
+    ConfigError
+        If the contents aren't valid
+    """
+    front_dict = check_entry(front_dict, FRONTPAGE_SCHEMA, "frontpage")
+    return {key: escape_tex(value) for key, value in front_dict.items()}
+
+
+def normalise_slide(slide, where, resolve_path):
+    """Check & escape one slide's contents, and find its plots
+
+    Parameters
+    ----------
+    slide : dict
+        Slide contents from the configuration
+    where : str
+        Which slide, for errors, e.g. "slides[3]"
+    resolve_path : callable
+        Gets the path to use for a plot from the one given
+
+    Returns
+    -------
+    dict
+
+    Raises
+    ------
+    ConfigError
+        If the contents aren't valid
+    """
+    slide = check_entry(slide, SLIDE_SCHEMA, where)
+    normalised = {key: escape_tex(value) for key, value in slide.items() if key != 'plots'}
+    if 'plots' in slide:
+        plots = []
+        for j, plot in enumerate(slide['plots']):
+            if isinstance(plot, str):
+                # just a filename
+                plot = [plot]
+            if (not isinstance(plot, (list, tuple)) or not 1 <= len(plot) <= 2
+                    or not all(isinstance(p, str) for p in plot)):
+                raise ConfigError("%s.plots[%d]" % (where, j), "expected [filename, title]")
+            if not plot[0]:
+                raise ConfigError("%s.plots[%d]" % (where, j), "empty filename")
+            plots.append([resolve_path(plot[0]), escape_tex(plot[1]) if len(plot) > 1 else ""])
+        normalised['plots'] = plots
+    return normalised
+
+
+def iter_normalised_slides(slides, config_dir=""):
+    """Normalise each slide, see normalise_slide
+
+    Parameters
+    ----------
+    slides : iterable[dict]
+        Contents of each slide from the configuration
+    config_dir : str, optional
+        Directory of the configuration file. Relative plot paths that don't
+        exist from the current directory are looked for here.
+
+    Yields
+    ------
+    dict
+    """
+    paths = {}
+
+    def resolve_path(plot_filename):
+        if plot_filename not in paths:
+            path = plot_filename
+            if (config_dir and not os.path.isabs(path)
+                    and not os.path.exists(plot_metadata.resolve_plot(path))):
+                relative_path = os.path.join(config_dir, path)
+                if os.path.exists(plot_metadata.resolve_plot(relative_path)):
+                    path = relative_path
+            paths[plot_filename] = get_safe_plot_path(path)
+        return paths[plot_filename]
+
+    for i, slide in enumerate(slides):
+        yield normalise_slide(slide, "slides[%d]" % i, resolve_path)
@@ -0,0 +1,222 @@
+"""
+Split output: make several smaller PDFs from one deck, instead of one big one.
+
+The deck can be split into sections, or every N slides. Each part is a
+complete deck with its own title page (& table of contents), compiled
+independently of the others, several at a time. Optionally an index PDF is
+made as well, with a link to each part.
+
+Sections start at each title-only slide (a slide with just a title, used as a
+divider). If a deck doesn't have any, each run of consecutive slides with the
+same title is a section instead.
+"""
+
+
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+import beamer_slide_templates as bst
+import latex_errors
+import tex_files
+
+
+log = logging.getLogger(__name__)
+
+
+# Number of parts listed on each slide of the index
+INDEX_ENTRIES_PER_SLIDE = 12
+
+
+class SplitError(RuntimeError):
+    """Some parts of a split deck failed to build
+
+    Parameters
+    ----------
+    failures : list[int]
+        Index of each part that failed
+    n_parts : int
+        Total number of parts
+    """
+
+    def __init__(self, failures, n_parts):
+        super(SplitError, self).__init__(failures, n_parts)
+        self.failures = failures
+        self.n_parts = n_parts
+
+    def __str__(self):
+        return "Failed to build %d of %d parts (%s)" % (len(self.failures), self.n_parts,
+                                                        ", ".join(str(i + 1) for i in self.failures))
+
+
+class Part(object):
+    """Some of the slides in a deck, to go into their own PDF
+
+    Parameters
+    ----------
+    title : str
+        Description of the part, for its title page & the index
+    slides : list[dict]
+        Contents of each slide
+    first_index : int
+        Index of the first slide in the whole deck
+    """
+
+    def __init__(self, title, slides, first_index):
+        self.title = title
+        self.slides = slides
+        self.first_index = first_index
+
+
+def split_by_section(slides):
+    """Split slides into sections
+
+    Parameters
+    ----------
+    slides : list[dict]
+        Contents of each slide
+
+    Returns
+    -------
+    list[Part]
+    """
+    is_divider = [tex_files.choose_slide_template(slide) == bst.only_title_slide for slide in slides]
+    parts = []
+    for i, slide in enumerate(slides):
+        if any(is_divider):
+            new_part = is_divider[i]
+        else:
+            new_part = i == 0 or slide.get('title', '') != slides[i - 1].get('title', '')
+        if new_part or not parts:
+            parts.append(Part(slide.get('title', ''), [], i))
+        parts[-1].slides.append(slide)
+    return parts
+
+
+def split_by_count(slides, slides_per_part):
+    """Split slides into parts of slides_per_part slides
+
+    Returns
+    -------
+    list[Part]
+    """
+    if slides_per_part < 1:
+        raise ValueError("Need at least 1 slide per part, not %d" % slides_per_part)
+    parts = []
+    for i in range(0, len(slides), slides_per_part):
+        these_slides = slides[i:i + slides_per_part]
+        parts.append(Part("Slides %d-%d" % (i + 1, i + len(these_slides)), these_slides, i))
+    return parts
+
+
+def get_part_frontpage(front_dict, part, part_number, n_parts):
+    """Get the title page contents for a part"""
+    part_front = dict(front_dict)
+    description = "Part %d of %d: %s" % (part_number, n_parts, part.title)
+    if front_dict.get('subtitle'):
+        part_front['subtitle'] = front_dict['subtitle'] + " \\\\ " + description
+    else:
+        part_front['subtitle'] = description
+    return part_front
+
+
+def get_index_slides(parts, pdf_filenames):
+    """Get slides listing each part, linking to its PDF"""
+    items = []
+    for i, (part, pdf_filename) in enumerate(zip(parts, pdf_filenames)):
+        items.append("\\item \\href{%s}{Part %d: %s} (%d slides)"
+                     % (os.path.basename(pdf_filename), i + 1, part.title, len(part.slides)))
+    slides = []
+    for start in range(0, len(items), INDEX_ENTRIES_PER_SLIDE):
+        slides.append({
+            'title': "Parts",
+            'toptext': "\\begin{itemize}\n%s\n\\end{itemize}" % "\n".join(items[start:start + INDEX_ENTRIES_PER_SLIDE])
+        })
+    return slides
+
+
+def _build_part(build_pdf, front_dict, part, out_stem, options):
+    """Build one part, in a separate process. Errors are returned, not raised,
+    so the other parts can carry on."""
+    try:
+        return build_pdf(front_dict, part.slides, out_stem, **options)
+    except latex_errors.CompileError as err:
+        # say which slides in the whole deck it was
+        err.renumber_slides(range(part.first_index, part.first_index + len(part.slides)))
+        return "%s: %s" % (type(err).__name__, err)
+    except Exception as err:
+        return "%s: %s" % (type(err).__name__, err)
+
+
+def build_split(front_dict, slides, out_stem, options, build_pdf, by_section=False, slides_per_part=None,
+                make_index=False, max_parts=None):
+    """Build a deck as several PDFs
+
+    Parameters
+    ----------
+    front_dict : dict
+        Title page contents
+    slides : iterable[dict]
+        Contents of each slide
+    out_stem : str
+        Stem for output files. Parts are <out_stem>_part<N>.pdf,
+        and the index is <out_stem>_index.pdf.
+    options : dict
+        Options for build_pdf
+    build_pdf : callable
+        Builds one deck, e.g. make_slides.build_pdf. It must be picklable,
+        as the parts are built in separate processes.
+    by_section : bool, optional
+        Split into sections
+    slides_per_part : int, optional
+        Otherwise, split every this many slides
+    make_index : bool, optional
+        Also make an index PDF, linking to each part
+    max_parts : int, optional
+        Number of parts to build simultaneously. Default is the number of CPUs.
+        The jobs in options are shared between them, as for make_slides.build_batch.
+
+    Returns
+    -------
+    list[str]
+        PDF filename of each part, then the index if made
+
+    Raises
+    ------
+    SplitError
+        If any part fails to build
+    """
+    max_parts = max_parts or os.cpu_count() or 1
+    options = dict(options, jobs=max(1, options.get('jobs', 1) // max_parts))
+    slides = list(slides)
+    if by_section:
+        parts = split_by_section(slides)
+    else:
+        parts = split_by_count(slides, slides_per_part)
+    n_digits = len(str(len(parts)))
+    out_stems = ["%s_part%0*d" % (out_stem, n_digits, i + 1) for i in range(len(parts))]
+
+    log.info("Building %d parts", len(parts))
+    results = {}
+    with ProcessPoolExecutor(max_workers=max_parts) as pool:
+        futures = [pool.submit(_build_part, build_pdf, get_part_frontpage(front_dict, part, i + 1, len(parts)),
+                               part, out_stems[i], options)
+                   for i, part in enumerate(parts)]
+        for i, future in enumerate(futures):
+            results[i] = future.result()
+            if not isinstance(results[i], str):
+                log.info("Built %s in %.1fs", results[i].pdf_filename, results[i].timings['total'])
+            else:
+                log.error("Failed to build part %d (slides[%d] onwards): %s",
+                          i + 1, parts[i].first_index, results[i])
+
+    failures = [i for i in results if isinstance(results[i], str)]
+    if failures:
+        raise SplitError(failures, len(parts))
+    pdf_filenames = [results[i].pdf_filename for i in range(len(parts))]
+
+    if make_index:
+        index_options = dict(options, do_toc=False, incremental=False, jobs=1)
+        result = build_pdf(front_dict, get_index_slides(parts, pdf_filenames), out_stem + "_index",
+                           **index_options)
+        pdf_filenames.append(result.pdf_filename)
+    return pdf_filenames
@@ -0,0 +1,22 @@
+import os
+import sys
+
+import pytest
+
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+
+@pytest.fixture(autouse=True)
+def cache_home(tmp_path, monkeypatch):
+    """Keep the plot index, converted plots etc. out of the user's cache,
+    and forget about plots from other tests"""
+    import artifact_cache
+    import plot_metadata
+    monkeypatch.setattr(plot_metadata, "_plot_info", {})
+    cache_home = tmp_path / "cache_home"
+    monkeypatch.setenv("XDG_CACHE_HOME", str(cache_home))
+    monkeypatch.delenv(artifact_cache.DIR_ENV_VAR, raising=False)
+    monkeypatch.setattr(artifact_cache, "_cache", None)
+    return cache_home
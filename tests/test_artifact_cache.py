@@ -0,0 +1,122 @@
+import os
+import shutil
+import stat
+import threading
+import time
+
+import pytest
+
+import artifact_cache
+from conftest import REPO_DIR
+
+
+def add_entry(cache, kind, name, size, age):
+    """Add an entry of size bytes, last used age seconds ago"""
+    filename = os.path.join(cache.get_dir(kind), name)
+    tmp_filename = filename + ".tmp"
+    with open(tmp_filename, "wb") as f:
+        f.write(b"x" * size)
+    cache.store(tmp_filename, filename)
+    used = time.time() - age
+    os.utime(filename, (used, used))
+    return filename
+
+
+def test_store_lookup_fetch(tmp_path):
+    cache = artifact_cache.ArtifactCache(str(tmp_path / "cache"), max_size=1)
+    filename = os.path.join(cache.get_dir("plots"), "a.pdf")
+    assert not cache.lookup(filename)
+    add_entry(cache, "plots", "a.pdf", 10, age=0)
+    assert cache.lookup(filename)
+    dest = str(tmp_path / "out.pdf")
+    assert cache.fetch(filename, dest)
+    assert not cache.fetch(filename + "x", dest + "x")
+    assert not os.path.exists(dest + "x")
+    assert cache.save_stats() == {'plots': {'hits': 2, 'misses': 2, 'stores': 1}}
+
+
+def test_eviction(tmp_path):
+    cache = artifact_cache.ArtifactCache(str(tmp_path / "cache"), max_size=1000. / (1024 * 1024))
+    oldest = add_entry(cache, "pieces", "oldest.pdf", 300, age=3000)
+    old = add_entry(cache, "plots", "old.pdf", 300, age=2000)
+    newer = add_entry(cache, "plots", "newer.pdf", 300, age=1000)
+    # too recently used to be removed
+    recent = add_entry(cache, "pieces", "recent.pdf", 300, age=0)
+    cache.evict()
+    # down to 80% of the maximum, removing the least recently used first
+    assert not os.path.exists(oldest)
+    assert not os.path.exists(old)
+    assert os.path.exists(newer)
+    assert os.path.exists(recent)
+
+
+def test_eviction_keeps_recent(tmp_path):
+    cache = artifact_cache.ArtifactCache(str(tmp_path / "cache"), max_size=1000. / (1024 * 1024))
+    filenames = [add_entry(cache, "pieces", "%d.pdf" % i, 400, age=0) for i in range(3)]
+    cache.evict()
+    assert all(os.path.exists(f) for f in filenames)
+
+
+@pytest.mark.skipif(artifact_cache.fcntl is None, reason="needs fcntl")
+def test_exclusive_lock_waits_for_readers(tmp_path):
+    cache = artifact_cache.ArtifactCache(str(tmp_path / "cache"))
+    events = []
+
+    def evict():
+        with cache.locked(exclusive=True):
+            events.append("exclusive")
+
+    with cache.locked():
+        thread = threading.Thread(target=evict)
+        thread.start()
+        time.sleep(0.2)
+        events.append("shared released")
+    thread.join(5)
+    assert events == ["shared released", "exclusive"]
+
+
+def test_shared_permissions(tmp_path):
+    cache = artifact_cache.ArtifactCache(str(tmp_path / "cache"))
+    filename = add_entry(cache, "plots", "a.pdf", 10, age=0)
+    for dirname in [cache.cache_dir, os.path.dirname(filename)]:
+        assert stat.S_IMODE(os.stat(dirname).st_mode) == artifact_cache.DIR_MODE
+    assert stat.S_IMODE(os.stat(filename).st_mode) == artifact_cache.FILE_MODE
+    lock_filename = os.path.join(cache.cache_dir, artifact_cache.LOCK_NAME)
+    assert stat.S_IMODE(os.stat(lock_filename).st_mode) == artifact_cache.FILE_MODE
+
+
+def test_read_only_lock(tmp_path):
+    """Someone else's lock file, that we can only read"""
+    cache = artifact_cache.ArtifactCache(str(tmp_path / "cache"))
+    with cache.locked():
+        pass
+    os.chmod(os.path.join(cache.cache_dir, artifact_cache.LOCK_NAME), 0o444)
+    with cache.locked():
+        pass
+
+
+def test_hit_when_not_owner(tmp_path, monkeypatch):
+    """Only the owner can mark an entry as used, but it's still a hit for everyone else"""
+    cache = artifact_cache.ArtifactCache(str(tmp_path / "cache"))
+    filename = add_entry(cache, "pieces", "a.pdf", 10, age=0)
+
+    def utime(*args, **kwargs):
+        raise PermissionError(1, "Operation not permitted")
+
+    monkeypatch.setattr(os, "utime", utime)
+    assert cache.lookup(filename)
+    assert cache.fetch(filename, str(tmp_path / "out.pdf"))
+
+
+def test_one_cache_directory(tmp_path):
+    """The plot index & links to plots are in the configured cache directory too"""
+    import plot_metadata
+    import slide_config
+    cache_dir = str(tmp_path / "shared")
+    artifact_cache.configure(cache_dir)
+    plot = tmp_path / "50%_cut.pdf"
+    shutil.copy(os.path.join(REPO_DIR, "example", "plot1.pdf"), str(plot))
+    link = slide_config.get_safe_plot_path(str(plot))
+    assert link.startswith(os.path.join(cache_dir, "links") + os.sep)
+    assert plot_metadata.check_plots([{'plots': [[link, ""]]}]) == []
+    assert os.path.isfile(os.path.join(cache_dir, plot_metadata.INDEX_NAME))
@@ -0,0 +1,31 @@
+import json
+import os
+import shutil
+
+import make_slides
+import tex_files
+from conftest import REPO_DIR
+
+
+def write_config(filename, title):
+    with open(filename, "w") as f:
+        json.dump({'frontpage': {'title': title},
+                   'slides': [{'title': "Plot", 'plots': [["plot1.pdf", ""]]}]}, f)
+
+
+def test_batch_draft(tmp_path, monkeypatch):
+    """Drafts of several decks don't replace their full builds"""
+    shutil.copy(os.path.join(REPO_DIR, "beamer_template.tex"), str(tmp_path))
+    shutil.copy(os.path.join(REPO_DIR, "example", "plot1.pdf"), str(tmp_path))
+    monkeypatch.chdir(tmp_path)
+    write_config("a.json", "A")
+    write_config("b.json", "B")
+
+    make_slides.main(["a.json", "b.json", "--noCompile", "--parallelDecks", "1"])
+    make_slides.main(["a.json", "b.json", "--noCompile", "--parallelDecks", "1", "--draft"])
+
+    for stem in ["a_slides", "b_slides"]:
+        with open(stem + ".tex") as f:
+            assert tex_files.DRAFT_TEX not in f.read()
+        with open(stem + "_draft.tex") as f:
+            assert tex_files.DRAFT_TEX in f.read()
@@ -0,0 +1,66 @@
+import os
+import subprocess
+import sys
+
+import compare_dirs
+from conftest import REPO_DIR
+
+
+def make_files(dname, filenames):
+    for filename in filenames:
+        path = dname / filename
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text("")
+
+
+def test_scan_dir(tmp_path):
+    make_files(tmp_path, ["a.pdf", "b.PDF", "c.png", ".hidden.pdf", "sub/d.pdf", ".git/e.pdf"])
+    filenames, mtimes = compare_dirs.scan_dir(str(tmp_path), ["pdf"])
+    assert filenames == ["a.pdf"]
+    assert list(mtimes) == [""]
+    filenames, mtimes = compare_dirs.scan_dir(str(tmp_path), ["pdf", "png"], recursive=True)
+    assert filenames == ["a.pdf", "c.png", os.path.join("sub", "d.pdf")]
+    assert sorted(mtimes) == ["", "sub"]
+
+
+def test_scan_dir_symlink_loop(tmp_path):
+    make_files(tmp_path, ["sub/a.pdf"])
+    os.symlink(str(tmp_path), str(tmp_path / "sub" / "loop"))
+    os.symlink(str(tmp_path / "sub" / "a.pdf"), str(tmp_path / "link.pdf"))
+    filenames, _ = compare_dirs.scan_dir(str(tmp_path), ["pdf"], recursive=True)
+    assert filenames == ["link.pdf", os.path.join("sub", "a.pdf")]
+
+
+def test_scan_dirs_index(tmp_path):
+    dirs = [tmp_path / "old", tmp_path / "new"]
+    make_files(dirs[0], ["a.pdf", "b.pdf"])
+    make_files(dirs[1], ["a.pdf"])
+    index = str(tmp_path / "index.json")
+    dirs = [str(d) for d in dirs]
+    assert compare_dirs.scan_dirs(dirs, ["pdf"], index_filename=index) == [{"a.pdf", "b.pdf"}, {"a.pdf"}]
+    make_files(tmp_path / "new", ["b.pdf"])
+    os.utime(dirs[1], (0, 0))
+    assert compare_dirs.scan_dirs(dirs, ["pdf"], index_filename=index) == [{"a.pdf", "b.pdf"}] * 2
+
+
+def test_scan_dirs_bad_index(tmp_path):
+    make_files(tmp_path / "plots", ["a.pdf"])
+    index = tmp_path / "index.json"
+    index.write_text('{"half-written": ')
+    assert compare_dirs.scan_dirs([str(tmp_path / "plots")], ["pdf"], index_filename=str(index)) == [{"a.pdf"}]
+    # no temporary file left behind
+    assert sorted(os.listdir(str(tmp_path))) == ["index.json", "plots"]
+    index.write_text('[]')
+    assert compare_dirs.scan_dirs([str(tmp_path / "plots")], ["pdf"], index_filename=str(index)) == [{"a.pdf"}]
+
+
+def test_build_error_exit(tmp_path):
+    """Build errors, here a split part failing, are reported without a traceback as for make_slides"""
+    make_files(tmp_path, ["a/plot.pdf", "b/plot.pdf"])
+    proc = subprocess.run([sys.executable, os.path.join(REPO_DIR, "compare_dirs.py"), "out.pdf",
+                           "--dir", "a", "--dir", "b", "--dirlabel", "A", "--dirlabel", "B", "--noCompile",
+                           "--splitEvery", "1"],
+                          cwd=str(tmp_path), env=dict(os.environ, XDG_CACHE_HOME=str(tmp_path / "cache")),
+                          stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    assert proc.returncode == 1
+    assert "Traceback" not in proc.stdout
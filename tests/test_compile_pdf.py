@@ -0,0 +1,73 @@
+import os
+import subprocess
+import sys
+
+import latex_compile
+import make_slides
+from conftest import REPO_DIR
+
+
+def fake_latex(monkeypatch, n_changes):
+    """Make run_latex write an aux file that changes for the first n_changes passes"""
+    runs = []
+
+    def run_latex(args, max_memory=None):
+        tex_filename = args[-1]
+        runs.append(tex_filename)
+        with open(os.path.splitext(tex_filename)[0] + ".aux", "w") as f:
+            f.write("pass %d\n" % min(len(runs), n_changes))
+        return 0, None
+
+    monkeypatch.setattr(latex_compile, "run_latex", run_latex)
+    return runs
+
+
+def test_stops_when_aux_unchanged(tmp_path, monkeypatch):
+    runs = fake_latex(monkeypatch, n_changes=1)
+    tex_filename = str(tmp_path / "deck.tex")
+    open(tex_filename, "w").close()
+    assert len(latex_compile.compile_pdf(tex_filename, num_compilations=3, cleanup=False)) == 2
+    assert len(runs) == 2
+
+
+def test_maximum_passes(tmp_path, monkeypatch):
+    fake_latex(monkeypatch, n_changes=10)
+    tex_filename = str(tmp_path / "deck.tex")
+    open(tex_filename, "w").close()
+    assert len(latex_compile.compile_pdf(tex_filename, num_compilations=3, cleanup=False)) == 3
+
+
+def test_rebuild_after_cleanup(tmp_path, monkeypatch):
+    """The auxiliary files are kept between builds, so an unchanged deck needs one pass"""
+    runs = fake_latex(monkeypatch, n_changes=1)
+    tex_filename = str(tmp_path / "deck.tex")
+    open(tex_filename, "w").close()
+    latex_compile.compile_pdf(tex_filename, num_compilations=3)
+    assert not os.path.exists(str(tmp_path / "deck.aux"))
+    assert os.path.isfile(str(tmp_path / latex_compile.AUX_STASH_DIR / "deck.aux"))
+
+    del runs[:]
+    open(tex_filename, "w").close()
+    assert len(latex_compile.compile_pdf(tex_filename, num_compilations=3)) == 1
+
+
+def test_no_toc_passes(tmp_path, monkeypatch):
+    """Without a TOC, a new deck still needs a second pass for the PDF outline, but a draft doesn't"""
+    monkeypatch.chdir(tmp_path)
+    runs = fake_latex(monkeypatch, n_changes=1)
+    slides = [{'title': "Plot", 'plots': [[os.path.join(REPO_DIR, "example", "plot1.pdf"), ""]]}]
+    template = os.path.join(REPO_DIR, "beamer_template.tex")
+    make_slides.build_pdf({'title': "Test"}, slides, "deck", template_filename=template, do_toc=False)
+    assert len(runs) == 2
+
+    del runs[:]
+    make_slides.build_pdf({'title': "Test"}, slides, "deck_draft", template_filename=template, do_toc=False,
+                          draft='placeholder')
+    assert len(runs) == 1
+
+
+def test_no_import_cycle():
+    """The modules make_slides uses don't import it back"""
+    code = ("import sys, latex_compile, latex_errors, pdf_engine, slide_cache, split_output, tex_files; "
+            "assert 'make_slides' not in sys.modules")
+    subprocess.check_call([sys.executable, "-c", code], cwd=REPO_DIR)
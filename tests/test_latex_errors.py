@@ -0,0 +1,83 @@
+import os
+
+import pytest
+
+import latex_errors
+import latex_compile
+import make_slides
+from conftest import REPO_DIR
+
+
+TEMPLATE = os.path.join(REPO_DIR, "beamer_template.tex")
+PLOT = os.path.join(REPO_DIR, "example", "plot1.pdf")
+
+
+@pytest.fixture
+def fake_latex(monkeypatch):
+    """compile_pdf that fails on the first line with BAD in it, and doesn't
+    say where if the slide has UNLOCATED in it. Returns the TeX filenames compiled."""
+    compiled = []
+
+    def compile_pdf(tex_filename, outdir=None, **kwargs):
+        compiled.append(tex_filename)
+        input_filename = os.path.splitext(tex_filename)[0] + "_input.tex"
+        with open(tex_filename) as f:
+            lines = [(None, n, line) for n, line in enumerate(f, 1)]
+        with open(input_filename) as f:
+            lines += [(input_filename, n, line) for n, line in enumerate(f, 1)]
+        for filename, n, line in lines:
+            if "BAD" in line:
+                location = (None, None) if "UNLOCATED" in line or filename is None else (filename, n)
+                raise latex_errors.CompileError(tex_filename, "x.log", [{
+                    'message': "Undefined control sequence.", 'file': location[0], 'line': location[1],
+                    'context': None, 'slide': None}])
+        with open(os.path.splitext(tex_filename)[0] + ".pdf", "w") as f:
+            f.write("%PDF")
+        return [0.]
+
+    monkeypatch.setattr(latex_compile, "compile_pdf", compile_pdf)
+    return compiled
+
+
+def slides_titled(titles):
+    return [{'title': title, 'plots': [[PLOT, ""]]} for title in titles]
+
+
+def find(slides, tmp_path, slides_in_error=()):
+    error = latex_errors.CompileError("deck.tex", "deck.log", [
+        {'message': "x", 'file': None, 'line': None, 'context': None, 'slide': i} for i in slides_in_error])
+    return latex_compile.find_bad_slides(TEMPLATE, {'title': "Test"}, slides, str(tmp_path / "deck"), error)
+
+
+def test_find_located_slide(fake_latex, tmp_path):
+    bad = find(slides_titled(["ok", "BAD", "ok"]), tmp_path, slides_in_error=[1])
+    assert sorted(bad) == [1]
+    assert len(fake_latex) == 2
+
+
+def test_find_by_bisecting(fake_latex, tmp_path):
+    titles = ["ok"] * 8
+    titles[2] = titles[5] = "BAD UNLOCATED"
+    bad = find(slides_titled(titles), tmp_path)
+    assert sorted(bad) == [2, 5]
+    assert not [f for f in os.listdir(str(tmp_path)) if f.startswith("deck_check")]
+
+
+def test_not_the_slides(fake_latex, tmp_path):
+    front = {'title': "BAD UNLOCATED"}
+    error = latex_errors.CompileError("deck.tex", "deck.log", [])
+    with pytest.raises(latex_errors.CompileError):
+        latex_compile.find_bad_slides(TEMPLATE, front, slides_titled(["ok"]), str(tmp_path / "deck"), error)
+
+
+def test_skip_bad_slides_reports_configuration_index(fake_latex, tmp_path, caplog):
+    """Indices are of the whole configuration, even after slides with bad plots are left out"""
+    slides = slides_titled(["ok", "missing plot", "ok", "BAD", "ok"])
+    slides[1]['plots'] = [["missing.pdf", ""]]
+    make_slides.build_pdf({'title': "Test"}, slides, str(tmp_path / "deck"), template_filename=TEMPLATE,
+                          skip_bad_slides=True)
+    skipped = [r.getMessage() for r in caplog.records if r.getMessage().startswith("Skipping")]
+    assert skipped == ["Skipping slides[1] (missing plot): missing.pdf: file not found",
+                       "Skipping slides[3] (BAD): Undefined control sequence."]
+    with open(str(tmp_path / "deck_input.tex")) as f:
+        assert "BAD" not in f.read()
@@ -0,0 +1,76 @@
+import os
+
+import pytest
+
+pypdf = pytest.importorskip("pypdf")
+
+import pdf_engine
+from conftest import REPO_DIR
+
+
+TEMPLATE = os.path.join(REPO_DIR, "beamer_template.tex")
+
+
+def make_plot(filename, width, height, rotate=0):
+    writer = pypdf.PdfWriter()
+    page = writer.add_blank_page(width, height)
+    if rotate:
+        page.rotate(rotate)
+    with open(filename, "wb") as f:
+        writer.write(f)
+    return filename
+
+
+def build(tmp_path, plots, draft=False):
+    slides = [{'title': "Plot %d" % i, 'plots': [[plot, "a plot"]]} for i, plot in enumerate(plots)]
+    pdf_filename = pdf_engine.build_deck(TEMPLATE, {'title': "Test", 'author': "Me"}, slides,
+                                         str(tmp_path / "deck"), do_toc=True, draft=draft)
+    return pypdf.PdfReader(pdf_filename)
+
+
+def test_truncate_text():
+    assert pdf_engine.truncate_text("short", 10, 100) == "short"
+    text = pdf_engine.truncate_text("a much longer line of text", 10, 60)
+    assert text.endswith("...")
+    assert pdf_engine.text_width(text, 10) <= 60
+
+
+def test_plots_embedded_once(tmp_path):
+    plot = make_plot(str(tmp_path / "plot.pdf"), 400, 300)
+    reader = build(tmp_path, [plot, plot])
+    assert len(reader.pages) == 4
+    forms = [page["/Resources"]["/XObject"]["/Plot0"].indirect_reference for page in reader.pages[2:]]
+    assert forms[0] == forms[1]
+
+
+def test_rotated_plot(tmp_path):
+    plot = make_plot(str(tmp_path / "plot.pdf"), 400, 200, rotate=90)
+    page = build(tmp_path, [plot]).pages[2]
+    form = page["/Resources"]["/XObject"]["/Plot0"]
+    assert [float(v) for v in form["/Matrix"]] == [0, -1, 1, 0, 0, 0]
+    # drawn at the size it's shown, i.e. portrait
+    ops = page.get_contents().get_data().decode()
+    scale = float([line for line in ops.splitlines() if "/Plot0 Do" in line][0].split()[1])
+    assert scale * 400 < pdf_engine.PAGE_HEIGHT
+
+
+def test_draft(tmp_path):
+    plot = make_plot(str(tmp_path / "plot.pdf"), 400, 300)
+    page = build(tmp_path, [plot], draft=True).pages[2]
+    assert "/XObject" not in page["/Resources"]
+    ops = page.get_contents().get_data().decode()
+    assert " re S " in ops
+    assert "(plot.pdf) Tj" in ops
+
+
+def test_maths_section_title(tmp_path):
+    """A table of contents that needs latex is compiled, not drawn"""
+    plot = make_plot(str(tmp_path / "plot.pdf"), 400, 300)
+    slides = [{'title': "Plain", 'plots': [[plot, ""]]},
+              {'title': "$m_{jj}$"},
+              {'title': "$m_{jj}$ fit", 'plots': [[plot, ""]]}]
+    front_piece, plan = pdf_engine.plan_pages("", "", {'title': "Test"}, slides, True, {})
+    assert front_piece is not None
+    assert [piece is None for _, piece in plan] == [True, False, False]
+    front_piece, _ = pdf_engine.plan_pages("", "", {'title': "Test"}, slides, False, {})
+    assert front_piece is None
@@ -0,0 +1,81 @@
+import os
+
+import pytest
+
+import plot_metadata
+from conftest import REPO_DIR
+
+
+PLOT = os.path.join(REPO_DIR, "example", "plot1.pdf")
+
+
+def make_pdf(filename, width, height, rotate=0):
+    pypdf = pytest.importorskip("pypdf")
+    writer = pypdf.PdfWriter()
+    page = writer.add_blank_page(width, height)
+    if rotate:
+        page.rotate(rotate)
+    with open(filename, "wb") as f:
+        writer.write(f)
+
+
+def test_pdf_size():
+    info = plot_metadata.read_plot_info(PLOT)
+    assert (info['format'], info['width'], info['height']) == ("pdf", 576, 432)
+
+
+def test_pdf_size_without_pypdf(monkeypatch):
+    monkeypatch.setattr(plot_metadata, "PdfReader", None)
+    info = plot_metadata.read_plot_info(PLOT)
+    assert (info['width'], info['height']) == (576, 432)
+
+
+def test_rotated_pdf(tmp_path):
+    filename = str(tmp_path / "rotated.pdf")
+    make_pdf(filename, 200, 100, rotate=90)
+    assert plot_metadata.read_plot_info(filename)['aspect'] == 0.5
+
+
+def test_bad_pdfs(tmp_path):
+    truncated = tmp_path / "truncated.pdf"
+    with open(PLOT, "rb") as f:
+        truncated.write_bytes(f.read()[:1000])
+    not_pdf = tmp_path / "not.pdf"
+    not_pdf.write_bytes(b"hello")
+    for filename, problem in [(truncated, "truncated"), (not_pdf, "not a PDF"),
+                              (tmp_path / "missing.pdf", "not found")]:
+        with pytest.raises(ValueError, match=problem):
+            plot_metadata.read_plot_info(str(filename))
+
+
+def iter_slides(plots, read):
+    for i, plot in enumerate(plots):
+        read.append(i)
+        yield {'title': "slide %d" % i, 'plots': [[plot, ""]]}
+
+
+def test_check_plots(tmp_path):
+    slides = [{'plots': [[PLOT, ""]]}, {'plots': [[PLOT, ""], ["missing.pdf", ""]]}]
+    assert plot_metadata.check_plots(slides, str(tmp_path / "index.json")) == [(1, "missing.pdf", "file not found")]
+
+
+def test_iter_checked_slides_is_lazy(tmp_path):
+    read = []
+    slides = plot_metadata.iter_checked_slides(iter_slides([PLOT, PLOT, "missing.pdf", PLOT], read),
+                                               index_filename=str(tmp_path / "index.json"))
+    assert next(slides)['title'] == "slide 0"
+    assert read == [0]
+    next(slides)
+    with pytest.raises(plot_metadata.PlotError) as err:
+        next(slides)
+    assert err.value.problems == [(2, "missing.pdf", "file not found")]
+    assert read == [0, 1, 2]
+    assert os.path.isfile(str(tmp_path / "index.json"))
+
+
+def test_iter_checked_slides_skip(tmp_path):
+    kept = []
+    slides = plot_metadata.iter_checked_slides(iter_slides([PLOT, "missing.pdf", PLOT], []), skip_bad_slides=True,
+                                               index_filename=str(tmp_path / "index.json"), kept_indices=kept)
+    assert [s['title'] for s in slides] == ["slide 0", "slide 2"]
+    assert kept == [0, 2]
@@ -0,0 +1,60 @@
+import pytest
+
+import artifact_cache
+import plot_metadata
+import plot_processing
+
+
+@pytest.fixture
+def plots(tmp_path, monkeypatch):
+    """An SVG & an EPS plot, which are 'converted' by copying them"""
+    monkeypatch.setitem(plot_processing.CONVERTERS, 'svg', [["cp", "{input}", "{output}"]])
+    monkeypatch.setitem(plot_processing.CONVERTERS, 'eps', [["cp", "{input}", "{output}"]])
+    svg = tmp_path / "plot.svg"
+    svg.write_text('<svg xmlns="http://www.w3.org/2000/svg" width="10" height="20"></svg>')
+    eps = tmp_path / "plot.eps"
+    eps.write_text("%!PS-Adobe-3.0 EPSF-3.0\n%%BoundingBox: 0 0 10 20\n")
+    return str(svg), str(eps)
+
+
+def slides_with(plots):
+    return [{'title': str(i), 'plots': [[plot, ""]]} for i, plot in enumerate(plots)]
+
+
+def test_convert_slides(plots, tmp_path):
+    svg, eps = plots
+    slides = plot_processing.convert_slides(slides_with([svg, eps, svg]), cache_dir=str(tmp_path / "cache"))
+    converted = [s['plots'][0][0] for s in slides]
+    assert converted[0] == converted[2]
+    # keyed by the converter's version too
+    assert all(c.endswith("-%s.pdf" % artifact_cache.get_tool_tag("cp")) for c in converted)
+
+
+def test_convert_streamed_slides(plots, tmp_path):
+    svg, eps = plots
+    slides = slides_with([svg, eps] * 20)
+    streamed = plot_processing.convert_slides(iter(slides), cache_dir=str(tmp_path / "cache"), jobs=2)
+    assert not isinstance(streamed, list)
+    assert list(streamed) == plot_processing.convert_slides(slides, cache_dir=str(tmp_path / "cache"))
+
+
+def test_no_converter(plots, tmp_path, monkeypatch):
+    svg, eps = plots
+    monkeypatch.setitem(plot_processing.CONVERTERS, 'svg', [["no-such-converter", "{input}", "{output}"]])
+    monkeypatch.setitem(plot_processing.CONVERTERS, 'eps', [["no-such-converter", "{input}", "{output}"]])
+    # latex can use the EPS as it is, but not the SVG
+    slides = plot_processing.convert_slides(slides_with([eps]), cache_dir=str(tmp_path / "cache"))
+    assert slides[0]['plots'][0][0] == eps
+    with pytest.raises(plot_metadata.PlotError) as err:
+        plot_processing.convert_slides(slides_with([eps, svg]), cache_dir=str(tmp_path / "cache"))
+    assert [p[:2] for p in err.value.problems] == [(1, svg)]
+
+
+def test_failed_conversion_streamed(plots, tmp_path, monkeypatch):
+    svg, eps = plots
+    monkeypatch.setitem(plot_processing.CONVERTERS, 'svg', [["false", "{input}", "{output}"]])
+    slides = plot_processing.convert_slides(iter(slides_with([eps, eps, svg])), cache_dir=str(tmp_path / "cache"))
+    assert len([next(slides), next(slides)]) == 2
+    with pytest.raises(plot_metadata.PlotError) as err:
+        next(slides)
+    assert [p[:2] for p in err.value.problems] == [(2, svg)]
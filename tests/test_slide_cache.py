@@ -0,0 +1,89 @@
+import os
+import re
+
+import pytest
+
+pypdf = pytest.importorskip("pypdf")
+
+import latex_compile
+import slide_cache
+from conftest import REPO_DIR
+
+
+TEMPLATE = os.path.join(REPO_DIR, "beamer_template.tex")
+PLOT = os.path.join(REPO_DIR, "example", "plot1.pdf")
+
+
+@pytest.fixture
+def fake_latex(monkeypatch):
+    """compile_pdf that makes a page per frame & \\pause, and writes the
+    .pages file like PAGES_TEX does. Returns the TeX filenames compiled."""
+    compiled = []
+
+    def compile_pdf(tex_filename, outdir=None, **kwargs):
+        compiled.append(tex_filename)
+        stem = os.path.splitext(tex_filename)[0]
+        tex = ""
+        for filename in [tex_filename, stem + "_input.tex"]:
+            with open(filename) as f:
+                tex += "".join(re.sub(r"(?<!\\)%.*", "", line) for line in f)
+        page_slides = []
+        for i, frame in enumerate(tex.split("\\begin{frame}")[1:], 1):
+            page_slides += [i] * (1 + frame.count("\\pause"))
+        if "piecepages" in tex:
+            with open(stem + ".pages", "w") as f:
+                f.writelines("%d\n" % i for i in page_slides)
+        writer = pypdf.PdfWriter()
+        for _ in page_slides:
+            writer.add_blank_page(100, 100)
+        writer.write(stem + ".pdf")
+        return [0.]
+
+    monkeypatch.setattr(latex_compile, "compile_pdf", compile_pdf)
+    return compiled
+
+
+def build(tmp_path, n_pauses, slides_per_piece=1):
+    config = {'frontpage': {'title': "Test"},
+              'slides': [{'title': "Slide %d" % i, 'toptext': "a \\pause" * n, 'plots': [[PLOT, ""]]}
+                         for i, n in enumerate(n_pauses)]}
+    pdf_filename = slide_cache.build_pieces(TEMPLATE, config, str(tmp_path / "deck"), do_toc=False,
+                                            slides_per_piece=slides_per_piece)
+    return pypdf.PdfReader(pdf_filename)
+
+
+def test_overlays_settle(fake_latex, tmp_path):
+    """Pieces after slides with overlays are compiled again at most once"""
+    reader = build(tmp_path, [1] * 8)
+    assert len(reader.pages) == 17
+    # front & 8 slides, then the 7 that moved
+    assert len(fake_latex) == 16
+    assert [reader.get_destination_page_number(o) for o in reader.outline] == list(range(1, 17, 2))
+    del fake_latex[:]
+    build(tmp_path, [1] * 8)
+    assert fake_latex == []
+
+
+def test_moved_piece_renumbered(fake_latex, tmp_path):
+    build(tmp_path, [0, 0, 0])
+    del fake_latex[:]
+    build(tmp_path, [2, 0, 0])
+    # the first slide grew, so the others move along
+    assert len(fake_latex) == 3
+    cache_dir = slide_cache.get_cache_dir(str(tmp_path / "deck"))
+    assert len([f for f in os.listdir(cache_dir) if f.endswith(".pdf")]) == 4
+
+
+def test_bookmarks_within_piece(fake_latex, tmp_path):
+    reader = build(tmp_path, [2, 0, 1, 0], slides_per_piece=2)
+    assert [reader.get_destination_page_number(o) for o in reader.outline] == [1, 4, 5, 7]
+
+
+def test_slide_pages_fallback(tmp_path):
+    writer = pypdf.PdfWriter()
+    for _ in range(5):
+        writer.add_blank_page(100, 100)
+    writer.write(str(tmp_path / "piece.pdf"))
+    assert slide_cache.get_slide_pages(str(tmp_path / "piece"), 3) == [1, 1, 3]
+    (tmp_path / "piece.pages").write_text("1\n2\n2\n2\n3\n")
+    assert slide_cache.get_slide_pages(str(tmp_path / "piece"), 3) == [1, 3, 1]
@@ -0,0 +1,93 @@
+import os
+import re
+import shutil
+
+import pytest
+
+import make_slides
+import slide_config
+from conftest import REPO_DIR
+
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("plain text", "plain text"),
+    ("jet_pt, 50% efficiency", "jet\\_pt, 50\\% efficiency"),
+    ("cut #3 & #4", "cut \\#3 \\& \\#4"),
+    ("$p_T$ of jet_1", "$p_T$ of jet\\_1"),
+    ("$x_1$ costs $3", "$x_1$ costs \\$3"),
+    ("already\\_escaped \\%", "already\\_escaped \\%"),
+    ("\\[ p_T \\]", "\\[ p_T \\]"),
+    ("\\( p_T \\) and p_T", "\\( p_T \\) and p\\_T"),
+    ("\\ensuremath{p_T} x_y", "\\ensuremath{p_T} x\\_y"),
+    ("\\begin{equation}\n \\alpha_{T} = x \\times y \n\\end{equation}",
+     "\\begin{equation}\n \\alpha_{T} = x \\times y \n\\end{equation}"),
+    ("\\begin{align*} a_1 &= b \\end{align*} c_d", "\\begin{align*} a_1 &= b \\end{align*} c\\_d"),
+    ("a \\\\[2pt] b_c", "a \\\\[2pt] b\\_c"),
+    ("see \\url{http://a.b/my_page#x}", "see \\url{http://a.b/my_page#x}"),
+    ("$$x_1$$ for y_1", "$$x_1$$ for y\\_1"),
+    ("$$x_1$$ costs $3", "$$x_1$$ costs \\$3"),
+    ("$a$$b_c$ d_e", "$a$$b_c$ d\\_e"),
+    ("\\newcommand\\f[1]{#1_x} \\f{a}", "\\newcommand\\f[1]{#1\\_x} \\f{a}"),
+    ("\\def\\g#1{\\def\\h##1{#1##1}} #", "\\def\\g#1{\\def\\h##1{#1##1}} \\#"),
+])
+def test_escape_tex(text, expected):
+    assert slide_config.escape_tex(text) == expected
+    # decks from configuration files are normalised again when built
+    assert slide_config.escape_tex(expected) == expected
+
+
+def test_normalise_slide_errors():
+    with pytest.raises(slide_config.ConfigError, match=r"slides\[0\]\.plots\[1\]"):
+        list(slide_config.iter_normalised_slides([{'plots': [["a.pdf"], [1, 2]]}]))
+    with pytest.raises(slide_config.ConfigError, match=r"slides\[1\]\.title"):
+        list(slide_config.iter_normalised_slides([{}, {'title': ["x"]}]))
+
+
+def test_jsonl_frontpage_not_first(tmp_path):
+    config = tmp_path / "deck.jsonl"
+    config.write_text('{"title": "A"}\n{"frontpage": {"title": "Deck"}}\n')
+    _, slides = make_slides.iter_config(str(config))
+    with pytest.raises(slide_config.ConfigError, match="frontpage"):
+        list(slides)
+
+
+def test_deck_normalised(tmp_path):
+    import deck
+    my_deck = deck.Deck(title="50% done")
+    my_deck.add_slide("jet_pt", plots=[(os.path.join(REPO_DIR, "example", "plot1.pdf"), "p_T")])
+    my_deck.build(str(tmp_path / "deck.pdf"), do_compile=False)
+    with open(str(tmp_path / "deck.tex")) as f:
+        assert "50\\% done" in f.read()
+    with open(str(tmp_path / "deck_input.tex")) as f:
+        assert "jet\\_pt" in f.read()
+    my_deck.add_slide(["not a title"])
+    with pytest.raises(slide_config.ConfigError, match=r"slides\[1\]\.title"):
+        my_deck.build(str(tmp_path / "deck.pdf"), do_compile=False)
+
+
+def _unshare_plots(tex):
+    """Put shared plots back as \\includegraphics, as they were before plots were shared"""
+    boxes = dict(re.findall(r"\\newsavebox\{\\(\w+)\}\\sbox\{\\\w+\}\{\\includegraphics\{([^}]*)\}\}\n", tex))
+    tex = re.sub(r"\\newsavebox\{.*\n", "", tex)
+    return re.sub(r"\\resizebox\{([^}]*)\}\{!\}\{\\usebox\{\\(\w+)\}\}",
+                  lambda m: "\\includegraphics[width=%s]{%s}" % (m.group(1), boxes[m.group(2)]), tex)
+
+
+def test_example_no_compile(tmp_path, monkeypatch):
+    """The example configuration makes the same TeX as it always has"""
+    shutil.copytree(os.path.join(REPO_DIR, "example"), str(tmp_path / "example"),
+                    ignore=shutil.ignore_patterns("configuration_slides*"))
+    shutil.copy(os.path.join(REPO_DIR, "beamer_template.tex"), str(tmp_path))
+    monkeypatch.chdir(tmp_path)
+
+    make_slides.main(["example/configuration.json", "--noCompile"])
+
+    for name, expected_name in [("configuration_slides.tex", "example_slides.tex"),
+                                ("configuration_slides_input.tex", "example_slides_input.tex")]:
+        with open(os.path.join("example", name)) as f:
+            tex = _unshare_plots(f.read())
+        with open(os.path.join(DATA_DIR, expected_name)) as f:
+            assert tex == f.read()
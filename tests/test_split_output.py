@@ -0,0 +1,45 @@
+import pytest
+
+import split_output
+
+
+def slides_titled(titles):
+    return [{'title': title, 'plots': [["plot.pdf", ""]]} for title in titles]
+
+
+def describe(parts):
+    return [(part.first_index, len(part.slides)) for part in parts]
+
+
+def test_split_by_count():
+    slides = slides_titled("abcdefg")
+    parts = split_output.split_by_count(slides, 3)
+    assert describe(parts) == [(0, 3), (3, 3), (6, 1)]
+    assert [p.title for p in parts] == ["Slides 1-3", "Slides 4-6", "Slides 7-7"]
+    assert describe(split_output.split_by_count(slides, 10)) == [(0, 7)]
+    assert split_output.split_by_count([], 3) == []
+
+
+@pytest.mark.parametrize("slides_per_part", [0, -1])
+def test_split_by_count_invalid(slides_per_part):
+    with pytest.raises(ValueError):
+        split_output.split_by_count(slides_titled("ab"), slides_per_part)
+
+
+def test_split_by_title():
+    """Without dividers, each change of title starts a section"""
+    parts = split_output.split_by_section(slides_titled(["A", "A", "B", "A", "A"]))
+    assert describe(parts) == [(0, 2), (2, 1), (3, 2)]
+    assert [p.title for p in parts] == ["A", "B", "A"]
+
+
+def test_split_by_divider():
+    slides = [{'title': "Intro"}] + slides_titled("ab") + [{'title': "Results"}] + slides_titled("c")
+    parts = split_output.split_by_section(slides)
+    assert describe(parts) == [(0, 3), (3, 2)]
+    assert [p.title for p in parts] == ["Intro", "Results"]
+
+
+def test_split_before_first_divider():
+    slides = slides_titled("a") + [{'title': "Intro"}] + slides_titled("b")
+    assert describe(split_output.split_by_section(slides)) == [(0, 1), (1, 2)]
@@ -0,0 +1,15 @@
+import watch_build
+
+
+def test_get_watched_files():
+    def iter_config(config_filename):
+        return {}, iter([{'plots': [["a.pdf", ""], ["b.pdf", ""]]}, {'title': "Divider"}])
+
+    assert watch_build.get_watched_files("c.json", "t.tex", iter_config) == {"c.json", "t.tex", "a.pdf", "b.pdf"}
+
+
+def test_get_watched_files_bad_config():
+    def iter_config(config_filename):
+        raise ValueError("half-edited")
+
+    assert watch_build.get_watched_files("c.json", "t.tex", iter_config) == {"c.json", "t.tex"}
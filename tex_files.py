@@ -0,0 +1,357 @@
+"""
+Writing the TeX for a deck: the main file, made from the template with the
+title page & table of contents filled in, and the slides file it inputs,
+with a frame for each slide from beamer_slide_templates.
+"""
+
+
+import logging
+import os
+import re
+import time
+import beamer_slide_templates as bst
+import plot_processing
+import preamble_format
+
+
+log = logging.getLogger(__name__)
+
+
+# Put in the preamble to make graphicx draw a box with the filename instead of
+# each plot. Plots still get read to find their size, but aren't embedded.
+DRAFT_TEX = "\\setkeys{Gin}{draft}\n"
+
+BEGIN_DOCUMENT_RE = re.compile(r"^\s*\\begin{document}")
+
+
+def make_main_tex_file(template_filename, frontpage_title='', subtitle='', author='',
+                       main_tex_file='', slides_tex_file='', toc_tex='', dump_line=None,
+                       draft=False):
+    """Generate main TeX file for set of slides, using a template.
+
+    Parameters
+    ----------
+    template_filename : str
+        Name of beamer texmplate tex file
+    frontpage_title : str, optional
+        Title for title slide
+    subtitle : str, optional
+        Subtitle for title slide
+    author : str, optional
+        Author nae for front slide
+    main_tex_file : str, optional
+        Filename for main TeX file to be written.
+    slides_tex_file : str, optional
+        Filename for slides file to be included.
+    toc_tex : str, optional
+        Table of Contents tex snippet
+    dump_line : int, optional
+        If using a precompiled preamble, index of the template line where it ends
+    draft : bool, optional
+        Show plots as boxes of the same size, see DRAFT_TEX
+    """
+    with open(template_filename, "r") as template:
+        with open(main_tex_file, "w") as f:
+            substitute = {"@TITLE": frontpage_title, "@SUBTITLE": subtitle,
+                          "@FILE": slides_tex_file, "@AUTHOR": author,
+                          "@TOC": toc_tex}
+            for i, line in enumerate(template):
+                if i == dump_line:
+                    f.write(preamble_format.DUMP_MARKER)
+                if draft and BEGIN_DOCUMENT_RE.match(line):
+                    f.write(DRAFT_TEX)
+                for k in substitute:
+                    if k in line:
+                        line = line.replace(k, substitute[k])
+                f.write(line)
+
+
+def choose_slide_template(slide):
+    """Choose the appropriate slide template for a slide
+
+    Parameters
+    ----------
+    slide : dict
+        Slide contents
+
+    Returns
+    -------
+    str
+        Slide template
+    """
+    num_plots = len(slide.get('plots', ''))
+    if num_plots == 0:
+        if slide.get('toptext', "") == "" and slide.get('bottomtext', "") == "":
+            return bst.only_title_slide
+        else:
+            return bst.zero_plot_slide
+    elif num_plots == 1:
+        return bst.one_plot_slide
+    elif num_plots == 2:
+        return bst.two_plot_slide
+    elif num_plots == 3:
+        return bst.three_plot_slide
+    elif num_plots <= 4:
+        return bst.four_plot_slide
+    elif num_plots <= 6:
+        return bst.six_plot_slide
+    elif num_plots <= 8:
+        return bst.eight_plot_slide
+    elif num_plots <= 10:
+        return bst.ten_plot_slide
+    else:
+        aspect = plot_metadata.get_aspect([p[0] for p in slide['plots']], bst.default_plot_aspect)
+        return bst.make_grid_slide_template(num_plots, aspect)
+
+
+def make_slides_tex_file(slides_tex_file, slides_dict, share_plots=True, profile=None,
+                         line_offsets=None):
+    """Generate TeX file for slides contents
+
+    Parameters
+    ----------
+    slides_tex_file : str
+        Filename for slides TeX file to be written
+    slides_dict : iterable[dict]
+        Contents of each slide. Can be a generator, in which case
+        each slide is written as it is produced.
+    share_plots : bool, optional
+        If True, plots that appear more than once are only embedded once,
+        see share_repeated_plots
+    profile : list, optional
+        If given, the time to render each slide and the size of its plots are added to it
+    line_offsets : list, optional
+        If given, the line number each slide starts at is added to it,
+        for finding which slide a latex error came from
+
+    Returns
+    -------
+    int
+        Number of slides written
+    """
+    n_slides = 0
+    plot_uses = {}
+    line_number = 1
+    with open(slides_tex_file, "w") as slides:
+        for slide in slides_dict:
+            n_slides += 1
+            log.debug("Writing slide")
+            template = choose_slide_template(slide)
+            for plot in slide.get('plots', []):
+                plot_uses[plot[0]] = plot_uses.get(plot[0], 0) + 1
+            start = time.time()
+            slide_tex = bst.make_slide(
+                slide_template=template,
+                slide_section=slide.get('title', ''),
+                slide_title=slide.get('title', ''),
+                plots=slide.get('plots', ''),
+                top_text=slide.get('toptext', ''),
+                bottom_text=slide.get('bottomtext', '')
+            )
+            slides.write(slide_tex)
+            if line_offsets is not None:
+                line_offsets.append(line_number)
+            line_number += slide_tex.count("\n")
+            if profile is not None:
+                profile.append({'index': len(profile),
+                                'title': slide.get('title', ''),
+                                'render_time': time.time() - start,
+                                'num_plots': len(slide.get('plots', [])),
+                                'image_bytes': sum(os.path.getsize(p[0]) for p in slide.get('plots', [])
+                                                   if os.path.isfile(p[0]))})
+    if share_plots:
+        n_header_lines = share_repeated_plots(slides_tex_file, plot_uses)
+        if line_offsets:
+            line_offsets[:] = [n + n_header_lines for n in line_offsets]
+    return n_slides
+
+
+def find_repeated_plots(plot_uses):
+    """Find plot files that are used more than once, either under the same
+    filename, or as identical files under different filenames.
+
+    Parameters
+    ----------
+    plot_uses : dict
+        Number of times each plot filename is used
+
+    Returns
+    -------
+    list[list[str]]
+        Groups of filenames that are the same plot
+    """
+    # Only files of the same size can be identical, so avoid reading the rest
+    by_size = {}
+    for filename in plot_uses:
+        if os.path.isfile(filename):
+            by_size.setdefault(os.path.getsize(filename), []).append(filename)
+
+    groups = []
+    for filenames in by_size.values():
+        if len(filenames) == 1:
+            by_digest = {None: filenames}
+        else:
+            by_digest = {}
+            for filename in filenames:
+                by_digest.setdefault(plot_processing.file_digest(filename), []).append(filename)
+        for group in by_digest.values():
+            if sum(plot_uses[f] for f in group) > 1:
+                groups.append(sorted(group))
+    return sorted(groups)
+
+
+def get_shared_plot_name(index):
+    """Get a TeX box name for a shared plot, e.g. sharedplotA, ..., sharedplotAB"""
+    letters = ""
+    index += 1
+    while index > 0:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(ord('A') + remainder) + letters
+    return "sharedplot" + letters
+
+
+def share_repeated_plots(slides_tex_file, plot_uses):
+    """Make plots used more than once only get embedded in the PDF once.
+
+    Each repeated plot is put in a TeX box at the start of the slides file,
+    and the includegraphics for it are replaced by a scaled copy of that box.
+    The PDF then just refers to the same image each time.
+
+    Parameters
+    ----------
+    slides_tex_file : str
+        Slides TeX file to modify
+    plot_uses : dict
+        Number of times each plot filename is used
+
+    Returns
+    -------
+    int
+        Number of lines added to the start of the file
+    """
+    groups = find_repeated_plots(plot_uses)
+    if not groups:
+        return 0
+
+    header = []
+    box_names = {}
+    bytes_saved = 0
+    for i, group in enumerate(groups):
+        name = get_shared_plot_name(i)
+        header.append("\\newsavebox{\\%s}\\sbox{\\%s}{\\includegraphics{%s}}\n" % (name, name, group[0]))
+        for filename in group:
+            box_names[filename] = name
+        bytes_saved += os.path.getsize(group[0]) * (sum(plot_uses[f] for f in group) - 1)
+    log.info("Sharing %d repeated plots, saving ~%.1f MB", len(groups), bytes_saved / 1024. / 1024.)
+
+    include_re = re.compile(r"\\includegraphics\[width=([^\]]*)\]{([^}]*)}")
+
+    def use_box(match):
+        if match.group(2) not in box_names:
+            return match.group(0)
+        return "\\resizebox{%s}{!}{\\usebox{\\%s}}" % (match.group(1), box_names[match.group(2)])
+
+    tmp_filename = slides_tex_file + ".tmp"
+    with open(slides_tex_file) as fin, open(tmp_filename, "w") as fout:
+        fout.writelines(header)
+        for line in fin:
+            fout.write(include_re.sub(use_box, line))
+    os.rename(tmp_filename, slides_tex_file)
+    return len(header)
+
+
+def get_toc_tex(do_toc, n_slides=2):
+    """Gets text insert for table of contents
+    
+    Parameters
+    ----------
+    do_toc : bool
+        Whether to do actual TOC or dummy
+    n_cols : int
+        Number of slides to be in table of contents
+        Determines number of columns
+    Returns
+    -------
+    str
+        Tex snippet to use
+    """
+    if do_toc:
+        
+        tex = r"""
+\begin{frame}{Table of Contents}
+@STARTMULTICOL
+    \tableofcontents
+@ENDMULTICOL
+\end{frame}
+"""
+        n_cols = 1
+        if n_slides > 20:
+            n_cols = 3
+        elif n_slides > 10:
+            n_cols = 2
+
+        # Have to do it this way, multicols seems to ignore arg = 1 ?!
+        if n_cols > 1:
+            tex = tex.replace("@STARTMULTICOL", r"""    \begin{multicols}{"""+str(n_cols)+r"""}""")
+            tex = tex.replace("@ENDMULTICOL", r"    \end{multicols}")
+        else:
+            tex = tex.replace("@STARTMULTICOL", "")
+            tex = tex.replace("@ENDMULTICOL", "")
+    
+        return tex
+    else:
+        return ""
+
+
+def write_tex_files(template_filename, front_dict, slides, out_stem, do_toc, use_format=False,
+                    profile=None, line_offsets=None, draft=False):
+    """Make the relevant TeX files: main one, and separate one with all plots
+
+    Parameters
+    ----------
+    template_filename : str
+        Name of beamer template tex file
+    front_dict : dict
+        Title page contents
+    slides : iterable[dict]
+        Contents of each slide. Can be a generator, each slide is written
+        as it is produced.
+    out_stem : str
+        Stem for output files
+    do_toc : bool
+        Add table of contents
+    use_format : bool, optional
+        Mark the end of the precompiled preamble in the main TeX file
+    profile : list, optional
+        If given, details of each slide are added to it, see make_slides_tex_file
+    line_offsets : list, optional
+        If given, the line each slide starts at is added to it, see make_slides_tex_file
+    draft : bool, optional
+        Show plots as boxes of the same size
+
+    Returns
+    -------
+    str
+        Main TeX filename
+    """
+    main_file = out_stem + ".tex"
+    slides_file = out_stem + "_input.tex"
+
+    # Make the slides file to be included in main file first,
+    # since the TOC needs to know how many slides there are
+    n_slides = make_slides_tex_file(slides_tex_file=slides_file, slides_dict=slides, profile=profile,
+                                    line_offsets=line_offsets)
+
+    # Make main tex file from template - change title, subtitle, include file
+    log.debug("Writing to %s", main_file)
+    log.debug("Using template file %s", template_filename)
+    make_main_tex_file(template_filename,
+                       front_dict.get('title', ''),
+                       front_dict.get('subtitle', ''),
+                       front_dict.get('author', ''),
+                       main_file,
+                       slides_file,
+                       get_toc_tex(do_toc, n_slides=n_slides),
+                       preamble_format.get_dump_line(template_filename) if use_format else None,
+                       draft)
+    return main_file
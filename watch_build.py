@@ -0,0 +1,126 @@
+"""
+Watch mode: stay running, and rebuild the deck whenever the configuration,
+template, or any of the plots change.
+
+Rebuilds are incremental (see slide_cache), so only the affected slides are
+recompiled, and everything already in memory (compiled templates, file hashes,
+the precompiled preamble) is reused between rebuilds.
+
+Files are checked by polling their modification times, which works on any
+platform and on network filesystems, where inotify doesn't see remote changes.
+"""
+
+
+import logging
+import os
+import time
+
+
+log = logging.getLogger(__name__)
+
+
+def get_watched_files(config_filename, template_filename, iter_config):
+    """Get all the files that go into the deck
+
+    Parameters
+    ----------
+    config_filename : str
+        Name of JSON config file
+    template_filename : str
+        Name of beamer template tex file
+    iter_config : callable
+        Reads a config file, returning the title page & slides,
+        e.g. make_slides.iter_config
+
+    Returns
+    -------
+    set[str]
+    """
+    filenames = set([config_filename, template_filename])
+    try:
+        _, slides = iter_config(config_filename)
+        for slide in slides:
+            for plot in slide.get('plots', []):
+                filenames.add(plot[0])
+    except (ValueError, KeyError, RuntimeError) as err:
+        # e.g. config is half-edited, just watch it until it's fixed
+        log.error("Couldn't read %s: %s", config_filename, err)
+    return filenames
+
+
+def get_mtimes(filenames):
+    """Get the modification time of each file, or None if it doesn't exist"""
+    mtimes = {}
+    for filename in filenames:
+        try:
+            mtimes[filename] = os.stat(filename).st_mtime
+        except OSError:
+            mtimes[filename] = None
+    return mtimes
+
+
+def wait_for_change(mtimes, poll_interval):
+    """Wait until any of the files has changed
+
+    Returns
+    -------
+    list[str], float
+        Files that changed, and the latest modification time
+    """
+    while True:
+        time.sleep(poll_interval)
+        new_mtimes = get_mtimes(mtimes.keys())
+        changed = [f for f in mtimes if new_mtimes[f] != mtimes[f]]
+        if changed:
+            latest = max([new_mtimes[f] for f in changed if new_mtimes[f] is not None] or [time.time()])
+            return changed, latest
+
+
+def watch(args, iter_config, build, out_stem, poll_interval=1.0):
+    """Build the deck, then rebuild it every time one of its inputs changes.
+    Runs until interrupted.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        Options from make_slides.add_build_arguments, plus the config filename
+    iter_config : callable
+        Reads a config file, returning the title page & slides,
+        e.g. make_slides.iter_config
+    build : callable
+        Builds the deck from args, the title page, slides & output stem,
+        e.g. make_slides.build
+    out_stem : str
+        Stem for output files
+    poll_interval : float, optional
+        Seconds between checking for changes
+    """
+    args.incremental = True
+    first = True
+    changed_at = None
+    while True:
+        mtimes = get_mtimes(get_watched_files(args.config, args.template, iter_config))
+        start = time.time()
+        try:
+            front_dict, slides = iter_config(args.config)
+            build(args, front_dict, slides, out_stem)
+            if changed_at is None:
+                log.info("Built in %.1fs", time.time() - start)
+            else:
+                log.info("Rebuilt in %.1fs, %.1fs since the change was made",
+                         time.time() - start, time.time() - changed_at)
+        except Exception as err:
+            # keep going, the user will probably fix it
+            log.error("Build failed: %s", err)
+        if first:
+            # only open the PDF once, the viewer should reload it
+            args.open = False
+            first = False
+
+        log.info("Watching %d files for changes, Ctrl-C to stop", len(mtimes))
+        try:
+            changed, changed_at = wait_for_change(mtimes, poll_interval)
+        except KeyboardInterrupt:
+            return
+        log.info("")
+        log.info("Changed: %s", ", ".join(sorted(changed)))